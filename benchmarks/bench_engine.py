@@ -0,0 +1,74 @@
+"""
+benchmarks.bench_engine
+~~~~~~~~~~~~~~~~~~~~~~~
+
+Bookkeeping overhead of EngineBridge.replay, bar events per second with an
+algorithm that does nothing and with one that keeps a position open.
+
+    $ python -m benchmarks.bench_engine [bars]
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from foreanalyzer._internal_utils import ACC_CURRENCIES, ACC_TIMEFRAMES, MODE
+from foreanalyzer.algorithm import AbstractAlgorithm
+from foreanalyzer.engine import EngineBridge
+
+BARS = 1000000
+EURUSD = ACC_CURRENCIES.EURUSD
+
+
+class Idle(AbstractAlgorithm):
+    """no decision, only the engine works"""
+
+    def __init__(self, bars):
+        super().__init__(ACC_TIMEFRAMES.ONE_MINUTE, [EURUSD], 1, len(bars))
+        self.bars = bars
+
+    def feed(self):
+        return self.bars
+
+    def prepare(self, instr, data=None):
+        return self.bars
+
+    def analyse(self):
+        pass
+
+    def on_bar(self, engine, instr, index):
+        pass
+
+
+class Holder(Idle):
+    """open one position on the first bar and keep it"""
+
+    def on_bar(self, engine, instr, index):
+        if not index:
+            engine.open(MODE.BUY, instr, 2500)
+
+
+def make_bars(rows):
+    close = 1.1 + np.cumsum(np.random.normal(0, 1e-5, rows))
+    return pd.DataFrame({
+        'timestamp': pd.date_range('2018-01-01', periods=rows, freq='min'),
+        'open': close, 'high': close, 'low': close, 'close': close})
+
+
+def main(rows):
+    bars = make_bars(rows)
+    for algo_class in (Idle, Holder):
+        engine = EngineBridge(rows, 'beginner', 1000)
+        # conversion rates of EURUSD come from its own bars
+        engine.handler.data[EURUSD.value] = bars
+        start = time.perf_counter()
+        engine.replay(algo_class(bars))
+        elapsed = time.perf_counter() - start
+        print("{:>8} {} bars in {:.3f}s, {:.0f} events/s".format(
+            algo_class.__name__, rows, elapsed, rows / elapsed))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else BARS)
@@ -0,0 +1,76 @@
+"""
+benchmarks.bench_indicators
+~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Time the vectorized indicators and the cost of a streaming update.
+
+    $ python -m benchmarks.bench_indicators [rows]
+
+The previous row by row SMA is timed on LEGACY_CAP rows and scaled
+linearly to rows.
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from foreanalyzer.algorithm import (
+    ATR, EMA, MACD, RSI, SMA, WMA, BollingerBands)
+
+ROWS = 1000000
+LEGACY_CAP = 5000
+UPDATES = 100000
+TOOLS = [('SMA(15)', SMA(15)), ('SMA(200)', SMA(200)), ('EMA(15)', EMA(15)),
+         ('WMA(15)', WMA(15)), ('RSI(14)', RSI(14)),
+         ('BollingerBands(20, 2)', BollingerBands(20, 2)),
+         ('ATR(14)', ATR(14)), ('MACD(12, 26, 9)', MACD(12, 26, 9))]
+
+
+def make_bars(rows):
+    close = 1.1 + np.cumsum(np.random.normal(0, 1e-4, rows))
+    spread = np.abs(np.random.normal(0, 5e-5, (2, rows)))
+    return pd.DataFrame({'open': close, 'high': close + spread[0],
+                         'low': close - spread[1], 'close': close})
+
+
+def legacy_sma(df, period):
+    """previous implementation, kept as reference"""
+    df['sma'] = np.nan
+    close_index = df.columns.get_loc('close')
+    for i in range(period, len(df) + 1):
+        sma = sum(df.iloc[i - period:i, close_index]) / period
+        df.at[df.index[i - 1], 'sma'] = sma
+    return df
+
+
+def main(rows):
+    df = make_bars(rows)
+    print("{} rows".format(rows))
+    for name, tool in TOOLS:
+        start = time.perf_counter()
+        tool.eval(df)
+        print("{:>24} {:>10.4f}s".format(name, time.perf_counter() - start))
+    bars = df.iloc[:UPDATES].to_dict('records')
+    print("update, {} bars".format(len(bars)))
+    for name, tool in TOOLS:
+        tool.reset()
+        start = time.perf_counter()
+        for bar in bars:
+            tool.update(bar)
+        elapsed = time.perf_counter() - start
+        print("{:>24} {:>10.3f}us".format(
+            name, elapsed / len(bars) * 1e6))
+    legacy_rows = min(rows, LEGACY_CAP)
+    start = time.perf_counter()
+    legacy_sma(make_bars(legacy_rows), 15)
+    legacy = (time.perf_counter() - start) * rows / legacy_rows
+    print("{:>24} {:>10.4f}s{}".format(
+        'legacy SMA(15)', legacy, '*' if legacy_rows < rows else ''))
+    if legacy_rows < rows:
+        print("* extrapolated from {} rows".format(LEGACY_CAP))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else ROWS)
@@ -0,0 +1,76 @@
+"""
+benchmarks.bench_normalize
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Compare the row by row timestamp parsing against normalize_df.
+
+    $ python -m benchmarks.bench_normalize [rows ...]
+
+The row by row reference is too slow for millions of rows, it is timed on
+at most LEGACY_CAP rows and scaled linearly above that.
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from foreanalyzer.data_handler import normalize_df
+
+SIZES = [10000, 1000000, 10000000]
+LEGACY_CAP = 10000
+
+
+def make_raw(rows):
+    """raw frame as read from a HistData csv, one row per minute"""
+    stamps = pd.Timestamp('2001-01-02 23:01') + \
+        pd.to_timedelta(np.arange(rows), unit='m')
+    close = 1.1 + np.cumsum(np.random.normal(0, 1e-4, rows))
+    return pd.DataFrame({
+        '<TICKER>': 'EURUSD',
+        '<DTYYYYMMDD>': stamps.year * 10000 + stamps.month * 100 + stamps.day,
+        '<TIME>': stamps.hour * 10000 + stamps.minute * 100 + stamps.second,
+        '<OPEN>': close, '<HIGH>': close, '<LOW>': close, '<CLOSE>': close,
+        '<VOL>': 4})
+
+
+def legacy_normalize_df(df, range_of_values):
+    """previous implementation, kept as reference"""
+    df.drop(df.index[:-range_of_values], inplace=True)
+    df.rename(columns=lambda x: x.strip('<>').lower(), inplace=True)
+    df['time'] = df['time'].astype(object)
+    for row in df.iterrows():
+        str_time = str(int(row[1].loc['time']))
+        str_date = str(int(row[1].loc['dtyyyymmdd']))
+        if len(str_time) < 6:
+            str_time = (6 - len(str_time))*'0' + str_time
+        df.loc[row[0], 'time'] = pd.Timestamp(str_date + str_time)
+    df.drop(columns=['ticker', 'vol', 'dtyyyymmdd'], inplace=True)
+    df.rename({'time': 'timestamp'}, axis='columns', inplace=True)
+    return df
+
+
+def timeit(func, df):
+    start = time.perf_counter()
+    func(df, len(df))
+    return time.perf_counter() - start
+
+
+def main(sizes):
+    print("{:>10} {:>12} {:>12} {:>10}".format(
+        'rows', 'legacy [s]', 'vector [s]', 'speedup'))
+    for rows in sizes:
+        raw = make_raw(rows)
+        vector = timeit(normalize_df, raw.copy())
+        legacy_rows = min(rows, LEGACY_CAP)
+        legacy = timeit(legacy_normalize_df, raw.iloc[:legacy_rows].copy())
+        legacy *= rows / legacy_rows
+        print("{:>10} {:>11.3f}{} {:>12.4f} {:>9.0f}x".format(
+            rows, legacy, '*' if legacy_rows < rows else ' ', vector,
+            legacy / vector))
+    print("* extrapolated from {} rows".format(LEGACY_CAP))
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or SIZES)
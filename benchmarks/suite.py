@@ -0,0 +1,189 @@
+"""
+benchmarks.suite
+~~~~~~~~~~~~~~~~
+
+Time and peak memory of the hot paths from raw data to the account, on
+synthetic data and offline.
+
+    $ python -m benchmarks.suite [--sizes 1000 100000] [--only sma]
+                                 [--out results.json]
+                                 [--baseline results.json]
+
+Each case runs `--repeat` times at every size, the best time is kept.
+Peak memory is taken by tracemalloc on one more run, apart from the timed
+ones. With a baseline, cases slower than it by more than `--tolerance`
+are reported and the exit status is 1, cases faster than `--min-time` in
+the baseline are only shown, their timings are mostly noise.
+"""
+
+import argparse
+import json
+import logging
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_indicators import make_bars
+from benchmarks.bench_normalize import make_raw
+from foreanalyzer._internal_utils import ACC_CURRENCIES, ACC_TIMEFRAMES, MODE
+from foreanalyzer.account import Account
+from foreanalyzer.algorithm import SMA, fix_timeframe
+from foreanalyzer.data_handler import ZipFeeder, normalize_df
+from foreanalyzer.rates import FixedRates
+from foreanalyzer.simulation import AccountSimulated
+from foreanalyzer.synthetic import write_zip
+
+SIZES = [10000, 100000, 1000000]
+EURUSD = ACC_CURRENCIES.EURUSD
+# archives of zip_feeder, removed at exit
+WORKDIR = tempfile.TemporaryDirectory(prefix='foreanalyzer-bench-')
+
+
+def make_zip(rows, folder=WORKDIR.name):
+    """synthetic archive of EURUSD with rows minutes, return its folder"""
+    write_zip(folder, EURUSD, rows, seed=0)
+    return folder
+
+
+def make_minutes(rows):
+    bars = make_bars(rows)
+    bars.insert(0, 'timestamp',
+                pd.date_range('2018-01-01', periods=rows, freq='min'))
+    return bars
+
+
+def make_account(rows):
+    acc = Account('beginner', 10 ** 12, rates=FixedRates(1.15))
+    acc.price_tables[EURUSD] = {'buy': 1.1302, 'sell': 1.13}
+    return acc
+
+
+def orders(acc, rows):
+    """open rows positions then close them"""
+    positions = [acc.make_order(MODE.BUY, EURUSD, 1000) for _ in range(rows)]
+    for pos in positions:
+        acc.close_position(pos)
+
+
+def make_prices(rows):
+    acc = AccountSimulated('beginner', 10 ** 12, FixedRates(1.15))
+    acc.price_tables[EURUSD] = {'buy': 1.1302, 'sell': 1.13}
+    acc.make_order(MODE.BUY, EURUSD, 1000)
+    mids = 1.1 + np.cumsum(np.random.normal(0, 1e-5, rows))
+    stamps = np.datetime64('2018-01-01', 'ns') + \
+        np.arange(rows) * np.timedelta64(1, 'm')
+    return acc, list(zip(stamps, (mids + 1e-4).tolist(),
+                         (mids - 1e-4).tolist()))
+
+
+def simulate(acc, prices):
+    for stamp, ask, bid in prices:
+        acc.simulate(EURUSD, ask, bid, stamp)
+
+
+# name: (setup(rows) returning the arguments, run(*arguments))
+# the account cases are slower per row, they run on a tenth of the rows
+CASES = {
+    'normalize_df': (lambda rows: (make_raw(rows), rows), normalize_df),
+    'zip_feeder': (
+        lambda rows: (ZipFeeder(make_zip(rows), stream=True), rows),
+        lambda feeder, rows: feeder.read_single(EURUSD, rows)),
+    'fix_timeframe': (lambda rows: (make_minutes(rows),
+                                    ACC_TIMEFRAMES.ONE_HOUR), fix_timeframe),
+    'sma': (lambda rows: (SMA(15), make_bars(rows)),
+            lambda tool, df: tool.eval(df)),
+    'account_orders': (lambda rows: (make_account(rows), rows // 10), orders),
+    'simulate': (lambda rows: make_prices(rows // 10), simulate),
+}
+
+
+def measure(setup, run, rows, repeat):
+    """best time in seconds and peak of traced memory in bytes"""
+    times = []
+    for _ in range(repeat):
+        np.random.seed(0)
+        args = setup(rows)
+        start = time.perf_counter()
+        run(*args)
+        times.append(time.perf_counter() - start)
+    np.random.seed(0)
+    args = setup(rows)
+    tracemalloc.start()
+    try:
+        run(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def run_suite(sizes, names=None, repeat=3):
+    results = []
+    for name, (setup, run) in CASES.items():
+        if names and name not in names:
+            continue
+        for rows in sizes:
+            elapsed, peak = measure(setup, run, rows, repeat)
+            results.append({'name': name, 'rows': rows, 'time': elapsed,
+                            'peak_bytes': peak})
+            print("{:>16} {:>10} {:>10.4f}s {:>10.1f}MiB".format(
+                name, rows, elapsed, peak / 1024 ** 2))
+    return {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__, 'pandas': pd.__version__,
+            'machine': platform.machine(),
+            'results': results}
+
+
+def compare(report, baseline, tolerance=0.2, min_time=1e-3):
+    """cases of report slower than baseline by more than tolerance"""
+    old = {(x['name'], x['rows']): x for x in baseline['results']}
+    regressions = []
+    print("{:>16} {:>10} {:>10} {:>10}".format(
+        'case', 'rows', 'time', 'memory'))
+    for result in report['results']:
+        base = old.get((result['name'], result['rows']))
+        if base is None:
+            continue
+        time_ratio = result['time'] / base['time']
+        memory_ratio = result['peak_bytes'] / max(base['peak_bytes'], 1)
+        slower = time_ratio > 1 + tolerance and base['time'] >= min_time
+        print("{:>16} {:>10} {:>9.2f}x {:>9.2f}x{}".format(
+            result['name'], result['rows'], time_ratio, memory_ratio,
+            ' slower' if slower else ''))
+        if slower:
+            regressions.append(result)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[4])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--only', nargs='+', choices=list(CASES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--out', help="write results as json")
+    parser.add_argument('--baseline', help="json of a previous run")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--min-time', type=float, default=1e-3)
+    args = parser.parse_args(argv)
+    # debug lines of the package would be timed too
+    logging.getLogger('foreanalyzer').setLevel(logging.WARNING)
+    report = run_suite(args.sizes, args.only, args.repeat)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.tolerance, args.min_time):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,10 +11,16 @@ import os.path
 import zipfile
 from enum import Enum
 
+from foreanalyzer import metrics
+
 
 # accepted currencies in analyzer
 # WARNING: if you add a currency update also tables.py values
 class ACC_CURRENCIES(Enum):
+    # members are singletons compared by identity, the C hash keeps dict
+    # lookups cheap in per bar loops
+    __hash__ = object.__hash__
+
     AUDUSD = "AUDUSD"
     EURCHF = "EURCHF"
     EURGBP = "EURGBP"
@@ -28,6 +34,8 @@ class ACC_CURRENCIES(Enum):
 
 # mode buy or sell
 class MODE(Enum):
+    __hash__ = object.__hash__
+
     BUY = 'buy'
     SELL = 'sell'
 
@@ -47,6 +55,8 @@ class ACC_TIMEFRAMES(Enum):
 FOLDER_PATH = os.path.dirname(__file__)
 OUTER_FOLDER_PATH = os.path.dirname(os.path.dirname(__file__))
 STR_CURRENCIES = [x.value for x in ACC_CURRENCIES]
+# position of instrument in arrays ordered as ACC_CURRENCIES
+INDEX_CURRENCIES = {x: i for i, x in enumerate(ACC_CURRENCIES)}
 INVERTED_MODE = {
     'buy': 'sell',
     'sell': 'buy'
@@ -82,6 +92,31 @@ class Singleton(type):
         return cls._instance
 
 
+class RingBuffer(object):
+    """fixed size buffer of floats, new values overwrite the oldest"""
+
+    def __init__(self, size):
+        self.size = size
+        self.values = [0.] * size
+        self.index = 0
+        self.count = 0
+
+    @property
+    def full(self):
+        return self.count >= self.size
+
+    def push(self, value):
+        """store value and return the dropped one (0. until full)"""
+        dropped = self.values[self.index]
+        self.values[self.index] = value
+        self.index += 1
+        if self.index == self.size:
+            self.index = 0
+        if self.count < self.size:
+            self.count += 1
+        return dropped
+
+
 def read_config():
     """read configuration file"""
     filename = os.path.join(OUTER_FOLDER_PATH, 'config.json')
@@ -101,9 +136,10 @@ def unzip_data(folder, zip_file_basename):
     if os.path.isfile(os.path.join(new_folder, zip_file_basename + '.csv')):
         return 0
     else:
-        zip_file = zipfile.ZipFile(filename, 'r')
-        zip_file.extractall(new_folder)
-        zip_file.close()
+        with metrics.stage('unzip'):
+            zip_file = zipfile.ZipFile(filename, 'r')
+            zip_file.extractall(new_folder)
+            zip_file.close()
         basename = os.path.join(new_folder, zip_file_basename)
         os.rename(basename + '.txt', basename + '.csv')
         return 1
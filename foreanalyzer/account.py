@@ -7,17 +7,21 @@ Store the simulated Account abstract object.
 
 import os.path
 
-from foreanalyzer import exceptions, tables
-from foreanalyzer._internal_utils import (ACC_CURRENCIES, INVERTED_MODE, MODE,
+import numpy as np
+import pandas as pd
+
+from foreanalyzer import exceptions, metrics, tables
+from foreanalyzer._internal_utils import (ACC_CURRENCIES, INDEX_CURRENCIES,
+                                          INVERTED_MODE, MODE, STR_CURRENCIES,
                                           Singleton, read_config)
-from forex_python.converter import CurrencyRates
-from trading212api.api import Client
+from foreanalyzer.quotes import BrokerQuotes, QuoteClient
+from foreanalyzer.rates import CachedRates, ForexPythonRates
 
 
 class Account(object):
     """abstract account"""
 
-    def __init__(self, margin_mode, initial_funds):
+    def __init__(self, margin_mode, initial_funds, rates=None, quotes=None):
         if not isinstance(initial_funds, int):
             raise ValueError("initial funds must be an int")
         if margin_mode not in ["beginner", "pro"]:
@@ -29,15 +33,80 @@ class Account(object):
         self.instruments = []
         # tables of prices for instruments
         self.price_tables = {}
-        self.api = Handler().api
+        # conversion rates of positions, at timestamp (None for latest)
+        if rates is None:
+            rates = CachedRates(ForexPythonRates())
+        self.rates = rates
+        self.timestamp = None
+        # snapshots of prices, see update_prices
+        self._quotes = quotes
+        self.prices_time = None
+        # slots and running sums of open positions
+        self.book = PositionBook()
+        # open positions by slot in the book
+        self.by_slot = {}
+        # closed positions
+        self.ledger = TradeLedger()
+        self.swap_paid = 0.
+        # changes of running sums by step, kept while replaying
+        self.journal = None
+        self.step = None
+
+    @property
+    def api(self):
+        """broker client, logs in on first use"""
+        return Handler().api
+
+    @property
+    def quotes(self):
+        """source of snapshots, created on first use
+
+        QuoteClient if a gateway is set as quotes_url in config, else
+        BrokerQuotes on the broker client.
+        """
+        if self._quotes is None:
+            url = read_config()['account'].get('quotes_url')
+            if url:
+                self._quotes = QuoteClient(url)
+            else:
+                self._quotes = BrokerQuotes(self.api)
+        return self._quotes
 
     @property
     def used_funds(self):
         """used funds"""
-        if len(self.positions) > 0:
-            return sum(x.used_funds for x in self.positions)
-        else:
-            return 0
+        return self.book.total_used_funds
+
+    @property
+    def unrealized(self):
+        """gain of open positions at current prices"""
+        return sum(self.unrealized_of(x) for x in self.instruments)
+
+    def unrealized_of(self, instrument):
+        """gain of open positions of instrument at current prices"""
+        if not self.book.slots(instrument):
+            return 0.
+        return self.book.unrealized(instrument, self.price_tables[instrument])
+
+    def swap(self):
+        """swap of open positions for one night, in EUR"""
+        return self.book.swap()
+
+    def accrue_swap(self, nights=1):
+        """pay swap of open positions for nights, return it"""
+        swap = self.swap() * nights
+        self.pay_swap(swap)
+        return swap
+
+    def pay_swap(self, swap):
+        """add swap (negative if a cost) to funds"""
+        self.swap_paid -= swap
+        self.realize(swap)
+
+    def exposure_of(self, instrument):
+        """units of open positions of instrument by mode"""
+        quantity = self.book.units(instrument)
+        return {MODE.BUY.value: quantity[0], MODE.SELL.value: quantity[1]}
 
     @property
     def free_funds(self):
@@ -50,8 +119,20 @@ class Account(object):
         self.price_tables[instrument] = price
         return price
 
-    def make_order(self, mode, instrument, quantity):
-        """make an order"""
+    def update_prices(self, instruments=None):
+        """update price_tables of instruments (all if None) at once
+
+        Prices come from one snapshot of quotes, its time is stored in
+        prices_time. Returns them by instrument.
+        """
+        if instruments is None:
+            instruments = list(ACC_CURRENCIES)
+        self.prices_time, prices = self.quotes.snapshot(instruments)
+        self.price_tables.update(prices)
+        return prices
+
+    def make_order(self, mode, instrument, quantity, conv_rate=None):
+        """make an order, at conv_rate or the rate at timestamp if None"""
         if instrument not in self.price_tables:
             raise exceptions.PriceNotUpdated()
         if mode not in MODE:
@@ -64,17 +145,105 @@ class Account(object):
             margin = tables.CURRENCIES[instrument.value].stnd_margin
         elif self.margin_mode == 'pro':
             margin = tables.CURRENCIES[instrument.value].pro_margin
-        pos = Position(self, instrument, mode, quantity, margin)
-        # WARNING: instrument needs to be in price_tables (need update price otherwise)
-        if pos.used_funds > self.free_funds:
+        with metrics.stage('order', 1) as stage:
+            pos = Position(self, instrument, mode, quantity, margin,
+                           conv_rate)
+            # WARNING: instrument needs to be in price_tables (need update price otherwise)
+            if pos.used_funds > self.free_funds:
+                raise exceptions.OrderAborted()
+            self._add(pos)
+            stage.rows_out = 1
+            return pos
+
+    def make_orders(self, modes, instruments, quantities, strict=False):
+        """make a batch of orders, as make_order called on each in turn
+
+        Margins and used funds of the batch are computed at once on
+        tables.CURRENCY_TABLE. Orders that would raise OrderAborted are
+        skipped and give None in the returned list, with strict nothing
+        is made and OrderAborted is raised instead.
+        """
+        for instrument in set(instruments):
+            if instrument not in self.price_tables:
+                raise exceptions.PriceNotUpdated()
+            if instrument not in ACC_CURRENCIES:
+                raise ValueError("{} not valid".format(instrument))
+        for mode in set(modes):
+            if mode not in MODE:
+                raise ValueError("{} nor buy or sell".format(mode))
+        index = np.array([INDEX_CURRENCIES[x] for x in instruments],
+                         dtype=np.intp)
+        side = np.array([PositionBook.SIDES[x] for x in modes], dtype=np.intp)
+        spec = tables.CURRENCY_TABLE[index]
+        quantity = np.asarray(quantities, dtype=np.float64)
+        quantity = np.where(quantity < spec['min_quantity'], 0., quantity)
+        if self.margin_mode == 'beginner':
+            margin = spec['stnd_margin']
+        elif self.margin_mode == 'pro':
+            margin = spec['pro_margin']
+        # prices by side and rates of the instruments in the batch
+        prices = np.zeros((len(ACC_CURRENCIES), 2))
+        rates = np.ones(len(ACC_CURRENCIES))
+        for instrument in set(instruments):
+            row = INDEX_CURRENCIES[instrument]
+            prices[row] = [self.price_tables[instrument][MODE.BUY.value],
+                           self.price_tables[instrument][MODE.SELL.value]]
+            rates[row] = self.rates.rate(instrument, self.timestamp)
+        conv_rate = rates[index]
+        used_funds = margin * quantity / conv_rate * prices[index, side]
+        accepted = fitting(used_funds, self.free_funds)
+        if strict and not accepted.all():
             raise exceptions.OrderAborted()
-        if instrument not in self.instruments:
-            self.instruments.append(instrument)
-        self.positions.append(pos)
-        return pos
+        with metrics.stage('order', len(accepted)) as stage:
+            positions = [None] * len(accepted)
+            for i in np.flatnonzero(accepted).tolist():
+                pos = Position(self, instruments[i], modes[i],
+                               quantities[i] if quantity[i] else 0,
+                               float(margin[i]), float(conv_rate[i]))
+                self._add(pos)
+                positions[i] = pos
+            stage.rows_out = int(accepted.sum())
+        return positions
+
+    def _add(self, position):
+        if position.instrument not in self.instruments:
+            self.instruments.append(position.instrument)
+        self.positions.append(position)
+        position.slot = self.book.open(
+            position.instrument, position.mode, position.quantity,
+            position.target_price, position.conv_rate, position.used_funds)
+        self.by_slot[position.slot] = position
+        self._log(position.instrument)
 
     def close_position(self, position):
-        gain = position.gain
+        """realize gain of position and move it to the ledger, return
+        the gain"""
+        if not position.active:
+            raise ValueError("position already closed")
+        with metrics.stage('close'):
+            gain = position.gain
+            position.active = False
+            self.positions.remove(position)
+            self.book.close(position.slot)
+            del self.by_slot[position.slot]
+            self._log(position.instrument)
+            self.ledger.record(
+                position.instrument, position.mode, position.quantity,
+                position.target_price, position.current_price,
+                position.conv_rate, gain, position.timestamp, self.timestamp)
+            self.realize(gain)
+            return gain
+
+    def _log(self, instrument):
+        """append running sums of instrument to the journal, if kept"""
+        if self.journal is not None:
+            index = INDEX_CURRENCIES[instrument]
+            self.journal.append(
+                (self.step, index) + tuple(self.book.exposure[index]) +
+                tuple(self.book.cost[index]))
+
+    def realize(self, gain):
+        """add gain of a closed position to funds"""
         if self.funds + gain < 0:
             self.funds = 0
             raise exceptions.FundsExhausted()
@@ -82,10 +251,31 @@ class Account(object):
             self.funds += gain
 
 
+def fitting(used_funds, free_funds):
+    """mask of orders made in turn while used_funds fit in free_funds"""
+    accepted = np.zeros(len(used_funds), dtype=bool)
+    start = 0
+    while start < len(used_funds):
+        spent = np.cumsum(used_funds[start:])
+        over = np.flatnonzero(spent > free_funds)
+        if not len(over):
+            accepted[start:] = True
+            break
+        # orders before the first one over the funds are made
+        stop = start + over[0]
+        accepted[start:stop] = True
+        if over[0]:
+            free_funds -= spent[over[0] - 1]
+        start = stop + 1
+    return accepted
+
+
 class Handler(metaclass=Singleton):
     """handler for api use"""
 
     def __init__(self):
+        # imported here, simulations and backtests never log in
+        from trading212api.api import Client
         # set up api
         config = read_config()
         self.api = Client()
@@ -96,7 +286,8 @@ class Handler(metaclass=Singleton):
 class Position(object):
     """position to do"""
 
-    def __init__(self, account, instrument, mode, quantity, margin):
+    def __init__(self, account, instrument, mode, quantity, margin,
+                 conv_rate=None):
         self.account = account
         self.instrument = instrument
         self.mode = mode
@@ -105,12 +296,15 @@ class Position(object):
         self.target_price = account.price_tables[instrument][mode.value]
         self.spread = abs(self.open_price - self.target_price)
         self.margin = margin
-        c = CurrencyRates()
-        eur_mult = c.get_rate('EUR', instrument.value[:3])
-        self.conv_rate = eur_mult * \
-            c.get_rate(instrument.value[:3], instrument.value[3:])
+        if conv_rate is None:
+            conv_rate = account.rates.rate(instrument, account.timestamp)
+        self.conv_rate = conv_rate
         self.used_funds = margin * quantity / \
             self.conv_rate * self.target_price
+        self.timestamp = account.timestamp
+        self.active = True
+        # slot in the book of the account
+        self.slot = None
 
     @property
     def current_price(self):
@@ -129,3 +323,175 @@ class Position(object):
 
     def close(self):
         self.account.close_position(self)
+
+
+class PositionBook(object):
+    """open positions stored as struct of arrays
+
+    Slots of closed positions are reused. Per instrument and side the book
+    keeps the sums of quantity / conv_rate and quantity * target_price /
+    conv_rate, so the unrealized gain of an instrument is O(1). Gains
+    follow Position: the price of the side of the position at open against
+    the current one.
+    """
+
+    SIDES = {MODE.BUY: 0, MODE.SELL: 1}
+
+    def __init__(self, capacity=256):
+        self.capacity = 0
+        self.instrument = np.zeros(0, dtype=np.int16)
+        self.side = np.zeros(0, dtype=np.int8)
+        self.quantity = np.zeros(0)
+        self.target_price = np.zeros(0)
+        self.conv_rate = np.zeros(0)
+        self.used_funds = np.zeros(0)
+        self.active = np.zeros(0, dtype=bool)
+        self.free_slots = []
+        self._grow(capacity)
+        # slots of open positions by instrument index
+        self.by_instrument = [set() for _ in ACC_CURRENCIES]
+        # running sums by instrument index and side, lists are faster
+        # than numpy on single items
+        self.exposure = [[0., 0.] for _ in ACC_CURRENCIES]
+        self.cost = [[0., 0.] for _ in ACC_CURRENCIES]
+        self.total_used_funds = 0.
+
+    def __len__(self):
+        return self.capacity - len(self.free_slots)
+
+    def _grow(self, capacity):
+        old = self.capacity
+        for name in ('instrument', 'side', 'quantity', 'target_price',
+                     'conv_rate', 'used_funds', 'active'):
+            array = getattr(self, name)
+            grown = np.zeros(capacity, dtype=array.dtype)
+            grown[:old] = array
+            setattr(self, name, grown)
+        self.free_slots.extend(range(capacity - 1, old - 1, -1))
+        self.capacity = capacity
+
+    def open(self, instrument, mode, quantity, target_price, conv_rate,
+             used_funds):
+        """store a position and return its slot"""
+        if not self.free_slots:
+            self._grow(self.capacity * 2)
+        slot = self.free_slots.pop()
+        index = INDEX_CURRENCIES[instrument]
+        side = self.SIDES[mode]
+        self.instrument[slot] = index
+        self.side[slot] = side
+        self.quantity[slot] = quantity
+        self.target_price[slot] = target_price
+        self.conv_rate[slot] = conv_rate
+        self.used_funds[slot] = used_funds
+        self.active[slot] = True
+        self.by_instrument[index].add(slot)
+        self.exposure[index][side] += quantity / conv_rate
+        self.cost[index][side] += quantity * target_price / conv_rate
+        self.total_used_funds += used_funds
+        return slot
+
+    def gain(self, slot, price_couple):
+        """gain of slot at prices {'buy': ask, 'sell': bid}"""
+        if self.side[slot] == 0:
+            pure_gain = price_couple['buy'] - self.target_price[slot]
+        else:
+            pure_gain = self.target_price[slot] - price_couple['sell']
+        return float(self.quantity[slot] * pure_gain / self.conv_rate[slot])
+
+    def close(self, slot):
+        """free slot, the position is no more in the sums"""
+        if not self.active[slot]:
+            raise ValueError("slot {} not open".format(slot))
+        index = int(self.instrument[slot])
+        side = int(self.side[slot])
+        quantity = float(self.quantity[slot])
+        conv_rate = float(self.conv_rate[slot])
+        self.exposure[index][side] -= quantity / conv_rate
+        self.cost[index][side] -= \
+            quantity * float(self.target_price[slot]) / conv_rate
+        self.total_used_funds -= float(self.used_funds[slot])
+        self.active[slot] = False
+        self.by_instrument[index].discard(slot)
+        self.free_slots.append(slot)
+        if not self.by_instrument[index]:
+            # no rounding left over on an empty instrument
+            self.exposure[index] = [0., 0.]
+            self.cost[index] = [0., 0.]
+        if not len(self):
+            self.total_used_funds = 0.
+
+    def slots(self, instrument):
+        return self.by_instrument[INDEX_CURRENCIES[instrument]]
+
+    def units(self, instrument):
+        """summed quantity of the open slots of instrument by side"""
+        slots = list(self.slots(instrument))
+        return np.bincount(self.side[slots], self.quantity[slots],
+                           minlength=2).tolist()
+
+    def swap(self):
+        """swap of open positions for one night, in EUR
+
+        Fee by unit of the table times quantity / conv_rate summed by
+        instrument and side, so all positions are in one product.
+        """
+        return float(np.sum(np.array(self.exposure) * tables.SWAP_TABLE))
+
+    def unrealized(self, instrument, price_couple):
+        """gain of the open slots of instrument at prices {'buy': ask,
+        'sell': bid}"""
+        index = INDEX_CURRENCIES[instrument]
+        exposure = self.exposure[index]
+        cost = self.cost[index]
+        return exposure[0] * price_couple['buy'] - cost[0] + cost[1] - \
+            exposure[1] * price_couple['sell']
+
+
+class TradeLedger(object):
+    """closed positions stored as struct of arrays
+
+    Columns grow by doubling, frame() gives the trades as a DataFrame.
+    """
+
+    COLUMNS = (('instrument', np.int16), ('side', np.int8),
+               ('quantity', np.float64), ('open_price', np.float64),
+               ('close_price', np.float64), ('conv_rate', np.float64),
+               ('gain', np.float64), ('opened', 'datetime64[ns]'),
+               ('closed', 'datetime64[ns]'))
+
+    def __init__(self, capacity=256):
+        self.columns = {name: np.zeros(capacity, dtype=dtype)
+                        for name, dtype in self.COLUMNS}
+        self.capacity = capacity
+        self.count = 0
+        self.total_gain = 0.
+
+    def __len__(self):
+        return self.count
+
+    def record(self, instrument, mode, quantity, open_price, close_price,
+               conv_rate, gain, opened=None, closed=None):
+        if self.count == self.capacity:
+            self.capacity *= 2
+            for name, column in self.columns.items():
+                grown = np.zeros(self.capacity, dtype=column.dtype)
+                grown[:self.count] = column
+                self.columns[name] = grown
+        values = (INDEX_CURRENCIES[instrument], PositionBook.SIDES[mode],
+                  quantity, open_price, close_price, conv_rate, gain,
+                  np.datetime64('NaT') if opened is None else opened,
+                  np.datetime64('NaT') if closed is None else closed)
+        for (name, _), value in zip(self.COLUMNS, values):
+            self.columns[name][self.count] = value
+        self.count += 1
+        self.total_gain += gain
+
+    def frame(self):
+        """trades as a DataFrame, instrument and mode by value"""
+        frame = pd.DataFrame({name: column[:self.count]
+                              for name, column in self.columns.items()})
+        frame['instrument'] = np.array(STR_CURRENCIES)[frame['instrument']]
+        frame['side'] = np.array([MODE.BUY.value, MODE.SELL.value])[
+            frame['side']]
+        return frame.rename(columns={'side': 'mode'})
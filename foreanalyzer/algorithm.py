@@ -6,13 +6,18 @@ Base algorithm module.
 """
 
 import abc
+import math
 
 import numpy as np
+import pandas as pd
 
+from foreanalyzer import metrics, tables
+from foreanalyzer.account import PositionBook
+from foreanalyzer.cache import INDICATOR_CACHE, data_key
 from foreanalyzer.data_handler import DataHandler
 from foreanalyzer._internal_utils import (
-    ACC_TIMEFRAMES, ACC_CURRENCIES, norm_timeframe)
-from foreanalyzer.exceptions import PeriodNotExpected
+    ACC_TIMEFRAMES, ACC_CURRENCIES, MODE, RingBuffer)
+from foreanalyzer.exceptions import OrderAborted, PeriodNotExpected
 
 # logger
 import logging
@@ -22,7 +27,8 @@ LOGGER = logging.getLogger("foreanalyzer.algo")
 class AbstractAlgorithm(metaclass=abc.ABCMeta):
     """abstract algo"""
 
-    def __init__(self, timeframe, acc_instrums, period, range_of_values):
+    def __init__(self, timeframe, acc_instrums, period, range_of_values,
+                 cache=None):
         # timeframe of algo (1h, 1d, 10m, ...)
         if timeframe not in ACC_TIMEFRAMES:
             raise ValueError("timeframe not accepted")
@@ -38,6 +44,8 @@ class AbstractAlgorithm(metaclass=abc.ABCMeta):
         self.period = period
         self.DH = DataHandler(range_of_values)
         self.data = self.DH.data
+        # bars and indicators shared between runs and algorithms
+        self.cache = INDICATOR_CACHE if cache is None else cache
 
     def check_period(self, period_of_values):
         if len(period_of_values) != self.period:
@@ -49,44 +57,122 @@ class AbstractAlgorithm(metaclass=abc.ABCMeta):
     def feed(self):
         pass
 
+    def signals(self, instr, bars):
+        """position held after each bar of instr, in signed units
+
+        Used by the vectorized backtest of EngineBridge.
+        """
+        raise NotImplementedError()
+
+    def on_bar(self, engine, instr, index):
+        """called by EngineBridge.replay after bar index of instr"""
+        raise NotImplementedError()
+
+    def on_live_bar(self, feed, instr, bar):
+        """called by live.LiveFeed when bar of instr closes"""
+        raise NotImplementedError()
+
     @abc.abstractmethod
     def analyse(self):
         pass
 
 
 class AlgorithmExample001(AbstractAlgorithm):
-    def __init__(self):
-        timeframe = ACC_TIMEFRAMES.ONE_HOUR
-        acc_instrums = [ACC_CURRENCIES.EURUSD]
-        period = 15
-        range_of_values = 50000
-        super().__init__(timeframe, acc_instrums, period, range_of_values)
+    """long above the sma of close, short below"""
+
+    def __init__(self, timeframe=ACC_TIMEFRAMES.ONE_HOUR, acc_instrums=None,
+                 period=15, range_of_values=50000, cache=None):
+        if acc_instrums is None:
+            acc_instrums = [ACC_CURRENCIES.EURUSD]
+        super().__init__(timeframe, acc_instrums, period, range_of_values,
+                         cache)
         # tools
         self.sma = SMA(self.period)
+        # units traded for each instrument
+        self.quantity = {x: tables.CURRENCIES[x.value].min_quantity
+                         for x in acc_instrums}
+        # state of live runs, by instrument
+        self.live_sma = {}
+        self.live_positions = {}
 
     def feed(self):
-        for instr in self.accepted_instruments:
+        """prepare bars of every instrument, return the first"""
+        bars = [self.prepare(instr) for instr in self.accepted_instruments]
+        return bars[0]
+
+    def prepare(self, instr, data=None):
+        """bars of instrument with sma, from data or from DataHandler"""
+        if data is None:
             # load data from csv
             LOGGER.debug("loading data...")
             self.DH.load_data(instr)
             data = self.data[instr.value]
-            # fix timeframe
-            LOGGER.debug("fixing timeframe...")
-            len_pre_removal = len(data)
-            fix_timeframe(data, self.timeframe)
-            entries_removed = len_pre_removal - len(data)
-            LOGGER.debug("{} entries removed from {} rows".format(
-                entries_removed, len_pre_removal))
-            # evaluate sma
-            LOGGER.debug("calcolating sma...")
-            data = self.sma.eval(data)
-            # drop NaN
-            len_pre_removal = len(data)
-            data.dropna(inplace=True)
-            nan_removed = len_pre_removal - len(data)
-            LOGGER.debug("NaN removed {} from {} rows".format(
-                nan_removed, len_pre_removal))
-            return data
+        key = data_key(instr, data) + (self.timeframe.value,)
+        # fix timeframe
+        LOGGER.debug("fixing timeframe...")
+        len_pre_resample = len(data)
+        with metrics.stage('resample', len_pre_resample) as stage:
+            data = self.cache.get(
+                key, lambda: fix_timeframe(data, self.timeframe))
+            stage.rows_out = len(data)
+        LOGGER.debug("{} rows resampled to {} bars".format(
+            len_pre_resample, len(data)))
+        # evaluate sma
+        LOGGER.debug("calcolating sma...")
+        with metrics.stage('indicator', len(data)) as stage:
+            data = self.cache.eval(key, self.sma, data)
+            stage.rows_out = len(data)
+        # drop NaN
+        len_pre_removal = len(data)
+        with metrics.stage('dropna', len_pre_removal) as stage:
+            data = data.dropna()
+            stage.rows_out = len(data)
+        nan_removed = len_pre_removal - len(data)
+        LOGGER.debug("NaN removed {} from {} rows".format(
+            nan_removed, len_pre_removal))
+        return data
+
+    def signals(self, instr, bars):
+        close = bars['close'].values
+        sma = bars['sma'].values
+        return self.quantity[instr] * np.sign(close - sma)
+
+    def on_bar(self, engine, instr, index):
+        """same rule of signals, one position per instrument"""
+        arrays = engine.arrays[instr]
+        close = arrays['close'][index]
+        sma = arrays['sma'][index]
+        mode = MODE.BUY if close > sma else MODE.SELL if close < sma else None
+        side = None if mode is None else PositionBook.SIDES[mode]
+        slots = engine.book.slots(instr)
+        for slot in list(slots):
+            if engine.book.side[slot] != side:
+                engine.close(slot)
+        if mode is not None and not slots:
+            try:
+                engine.open(mode, instr, self.quantity[instr])
+            except OrderAborted:
+                LOGGER.debug("order aborted at bar {}".format(index))
+
+    def on_live_bar(self, feed, instr, bar):
+        """same rule of signals, sma updated one bar at a time"""
+        if instr not in self.live_sma:
+            self.live_sma[instr] = SMA(self.period)
+        sma = self.live_sma[instr].update(bar)
+        if math.isnan(sma):
+            return
+        close = bar['close']
+        mode = MODE.BUY if close > sma else MODE.SELL if close < sma else None
+        position = self.live_positions.get(instr)
+        if position is not None and position.mode != mode:
+            del self.live_positions[instr]
+            position.close()
+        if mode is not None and instr not in self.live_positions:
+            try:
+                self.live_positions[instr] = feed.order(
+                    mode, instr, self.quantity[instr])
+            except OrderAborted:
+                LOGGER.debug("order aborted at {}".format(bar['timestamp']))
 
     def analyse(self):
         for instr in ACC_CURRENCIES:
@@ -98,42 +184,439 @@ class AlgorithmExample001(AbstractAlgorithm):
 #~~~~~~~~~~~~#
 
 def fix_timeframe(df, timeframe):
-    for i in range(len(df)):
-        if i+1 < len(df):
-            while calc_diff_tf(df, i) < norm_timeframe(timeframe):
-                df.drop(df.index[i+1], inplace=True)
-                if i+1 >= len(df):
-                    break
-
-
-def calc_diff_tf(df, index):
-    return (df.loc[df.index[index+1], 'timestamp'] - df.loc[df.index[index], 'timestamp']).total_seconds()
+    """return OHLC bars of timeframe built from df"""
+    return Resample(timeframe).eval(df)
 
 
 class base_tool(metaclass=abc.ABCMeta):
+    """a tool computes its columns on a whole frame with `eval` or one bar
+    at a time with `update`, replaying bars through `update` gives the
+    same values of `eval`
+    """
+
     def __init__(self):
         pass
 
+    @property
+    def key(self):
+        """identify tool class and parameters"""
+        return (type(self).__name__,) + self.params
+
     @abc.abstractmethod
     def eval(self):
         pass
 
+    @abc.abstractmethod
+    def update(self, bar):
+        pass
+
+    @abc.abstractmethod
+    def reset(self):
+        pass
+
+
+class Resample(base_tool):
+    """build open/high/low/close bars of timeframe from finer bars
+
+    Bars are labeled with their opening time, empty intervals (weekends,
+    holes in data) give no bar.
+    """
+
+    OFFSETS = {
+        ACC_TIMEFRAMES.ONE_MINUTE: pd.offsets.Minute(1),
+        ACC_TIMEFRAMES.FIVE_MINUTES: pd.offsets.Minute(5),
+        ACC_TIMEFRAMES.TEN_MINUTES: pd.offsets.Minute(10),
+        ACC_TIMEFRAMES.ONE_HOUR: pd.offsets.Hour(1),
+        ACC_TIMEFRAMES.FOUR_HOURS: pd.offsets.Hour(4),
+        ACC_TIMEFRAMES.ONE_DAY: pd.offsets.Day(1),
+        ACC_TIMEFRAMES.ONE_WEEK: pd.offsets.Week(weekday=0),
+        ACC_TIMEFRAMES.ONE_MONTH: pd.offsets.MonthBegin(1)}
+
+    def __init__(self, timeframe):
+        if timeframe not in ACC_TIMEFRAMES:
+            raise ValueError("timeframe not accepted")
+        self.timeframe = timeframe
+        self.params = (timeframe.value,)
+        self.reset()
+
+    def eval(self, df):
+        bars = df.resample(self.OFFSETS[self.timeframe], on='timestamp',
+                           closed='left', label='left').agg(
+            {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last'})
+        bars.dropna(subset=['open'], inplace=True)
+        return bars.reset_index()
+
+    def update(self, bar):
+        """add bar, return the previous bar once a new one starts"""
+        start = self.bar_start(bar['timestamp'])
+        done = None
+        if self.current is not None and start != self.current['timestamp']:
+            done = self.current
+            self.current = None
+        if self.current is None:
+            self.current = {'timestamp': start, 'open': bar['open'],
+                            'high': bar['high'], 'low': bar['low'],
+                            'close': bar['close']}
+        else:
+            self.current['high'] = max(self.current['high'], bar['high'])
+            self.current['low'] = min(self.current['low'], bar['low'])
+            self.current['close'] = bar['close']
+        return done
+
+    def reset(self):
+        # bar being built
+        self.current = None
+
+    def bar_start(self, timestamp):
+        """opening time of the bar holding timestamp"""
+        offset = self.OFFSETS[self.timeframe]
+        if self.timeframe in (ACC_TIMEFRAMES.ONE_WEEK,
+                              ACC_TIMEFRAMES.ONE_MONTH):
+            return offset.rollback(pd.Timestamp(timestamp).normalize())
+        return pd.Timestamp(timestamp).floor(offset)
+
 
 class SMA(base_tool):
+    """simple moving average of close"""
+
+    def __init__(self, period):
+        self.period = period
+        self.params = (period,)
+        self.reset()
+
+    def eval(self, df):
+        close = df['close'].values.astype(np.float64)
+        df['sma'] = sma_kernel(close, self.period)
+        return df
+
+    def update(self, bar):
+        return self.sum.update(bar['close'])
+
+    def reset(self):
+        self.sum = RunningMean(self.period)
+
+
+class EMA(base_tool):
+    """exponential moving average of close, alpha of 2 / (period + 1)"""
+
     def __init__(self, period):
         self.period = period
+        self.params = (period,)
+        self.reset()
+
+    def eval(self, df):
+        close = df['close'].values.astype(np.float64)
+        df['ema'] = ewm_kernel(close, 2 / (self.period + 1), self.period)
+        return df
+
+    def update(self, bar):
+        return self.ema.update(bar['close'])
+
+    def reset(self):
+        self.ema = RunningEWM(2 / (self.period + 1), self.period)
+
+
+class WMA(base_tool):
+    """linearly weighted moving average of close, last value weighs most"""
+
+    def __init__(self, period):
+        self.period = period
+        self.params = (period,)
+        self.reset()
+
+    def eval(self, df):
+        close = df['close'].values.astype(np.float64)
+        df['wma'] = wma_kernel(close, self.period)
+        return df
+
+    def update(self, bar):
+        close = bar['close']
+        # same steps of wma_kernel
+        self.weighted += self.period * close - self.sum.total
+        self.sum.update(close)
+        if not self.sum.full:
+            return np.nan
+        return self.weighted / (self.period * (self.period + 1) / 2)
+
+    def reset(self):
+        self.sum = RunningMean(self.period)
+        self.weighted = 0.
+
+
+class RSI(base_tool):
+    """relative strength index with Wilder smoothing, averages start at
+    the mean of the first period changes"""
+
+    def __init__(self, period=14):
+        self.period = period
+        self.params = (period,)
+        self.reset()
+
+    def eval(self, df):
+        close = df['close'].values.astype(np.float64)
+        delta = np.empty_like(close)
+        delta[0] = np.nan
+        np.subtract(close[1:], close[:-1], out=delta[1:])
+        gain = np.where(delta > 0, delta, 0.)
+        loss = np.where(delta < 0, -delta, 0.)
+        gain[0] = loss[0] = np.nan
+        df['rsi'] = rsi_kernel(wilder_kernel(gain, self.period),
+                               wilder_kernel(loss, self.period))
+        return df
+
+    def update(self, bar):
+        close = bar['close']
+        prev_close, self.prev_close = self.prev_close, close
+        if prev_close is None:
+            return np.nan
+        delta = close - prev_close
+        gain = self.gain.update(delta if delta > 0 else 0.)
+        loss = self.loss.update(-delta if delta < 0 else 0.)
+        total = gain + loss
+        if total != total:
+            return np.nan
+        return 100 * gain / total if total > 0 else 50.
+
+    def reset(self):
+        self.prev_close = None
+        self.gain = RunningWilder(self.period)
+        self.loss = RunningWilder(self.period)
+
+
+class BollingerBands(base_tool):
+    """sma of close plus and minus `width` standard deviations"""
+
+    def __init__(self, period=20, width=2):
+        self.period = period
+        self.width = width
+        self.params = (period, width)
+        self.reset()
 
     def eval(self, df):
-        df['sma'] = np.nan  # set NaN
-        for i in range(len(df)):
-            i += 1  # scale up
-            # calc other index margin
-            i_p = i - self.period
-            # if n (period) of values avaible
-            if i_p >= 0:
-                close_index = df.columns.get_loc('close')
-                # calc simple moving average sum(n1+n2+n3) / nn
-                sma = sum(df.iloc[i_p:i, close_index]) / self.period
-                # set sma
-                df.at[df.index[i - 1], 'sma'] = sma
+        close = df['close'].values.astype(np.float64)
+        middle = sma_kernel(close, self.period)
+        deviation = self.width * std_kernel(close, self.period)
+        df['bb_upper'] = middle + deviation
+        df['bb_middle'] = middle
+        df['bb_lower'] = middle - deviation
         return df
+
+    def update(self, bar):
+        """return upper, middle and lower band"""
+        close = bar['close']
+        if self.shift is None:
+            self.shift = close
+        middle = self.sum.update(close)
+        shifted = close - self.shift
+        mean = self.shifted_sum.update(shifted)
+        var = self.squared_sum.update(shifted * shifted) - mean * mean
+        deviation = self.width * math.sqrt(max(var, 0.)) \
+            if var == var else np.nan
+        return middle + deviation, middle, middle - deviation
+
+    def reset(self):
+        # first close, as in std_kernel
+        self.shift = None
+        self.sum = RunningMean(self.period)
+        self.shifted_sum = RunningMean(self.period)
+        self.squared_sum = RunningMean(self.period)
+
+
+class ATR(base_tool):
+    """average true range with Wilder smoothing, the average starts at
+    the mean of the first period true ranges"""
+
+    def __init__(self, period=14):
+        self.period = period
+        self.params = (period,)
+        self.reset()
+
+    def eval(self, df):
+        high = df['high'].values.astype(np.float64)
+        low = df['low'].values.astype(np.float64)
+        close = df['close'].values.astype(np.float64)
+        true_range = high - low
+        prev_close = close[:-1]
+        np.maximum(true_range[1:], np.abs(high[1:] - prev_close),
+                   out=true_range[1:])
+        np.maximum(true_range[1:], np.abs(low[1:] - prev_close),
+                   out=true_range[1:])
+        df['atr'] = wilder_kernel(true_range, self.period)
+        return df
+
+    def update(self, bar):
+        high, low = bar['high'], bar['low']
+        true_range = high - low
+        if self.prev_close is not None:
+            true_range = max(true_range, abs(high - self.prev_close),
+                             abs(low - self.prev_close))
+        self.prev_close = bar['close']
+        return self.atr.update(true_range)
+
+    def reset(self):
+        self.prev_close = None
+        self.atr = RunningWilder(self.period)
+
+
+class MACD(base_tool):
+    """difference of fast and slow ema of close and its signal line"""
+
+    def __init__(self, fast=12, slow=26, signal=9):
+        self.fast = fast
+        self.slow = slow
+        self.signal = signal
+        self.params = (fast, slow, signal)
+        self.reset()
+
+    def eval(self, df):
+        close = df['close'].values.astype(np.float64)
+        macd = ewm_kernel(close, 2 / (self.fast + 1), 1) - \
+            ewm_kernel(close, 2 / (self.slow + 1), 1)
+        macd[:self.slow - 1] = np.nan
+        signal = ewm_kernel(macd, 2 / (self.signal + 1), self.signal)
+        df['macd'] = macd
+        df['macd_signal'] = signal
+        df['macd_hist'] = macd - signal
+        return df
+
+    def update(self, bar):
+        """return macd, signal and histogram"""
+        close = bar['close']
+        macd = self.fast_ema.update(close) - self.slow_ema.update(close)
+        if self.slow_ema.count < self.slow:
+            return np.nan, np.nan, np.nan
+        signal = self.signal_ema.update(macd)
+        return macd, signal, macd - signal
+
+    def reset(self):
+        self.fast_ema = RunningEWM(2 / (self.fast + 1), 1)
+        self.slow_ema = RunningEWM(2 / (self.slow + 1), 1)
+        self.signal_ema = RunningEWM(2 / (self.signal + 1), self.signal)
+
+
+# -[ KERNELS ]-
+# Vectorized over the whole series, NaN where the window is not full.
+
+def window_sum(values, period):
+    """rolling sum as cumulative sum of (new value - dropped value)"""
+    diff = values.copy()
+    diff[period:] -= values[:-period]
+    return np.cumsum(diff)
+
+
+def sma_kernel(values, period):
+    result = window_sum(values, period) / period
+    result[:period - 1] = np.nan
+    return result
+
+
+def wma_kernel(values, period):
+    # next weighted sum adds period * new value and drops the last window
+    diff = period * values
+    diff[1:] -= window_sum(values, period)[:-1]
+    result = np.cumsum(diff) / (period * (period + 1) / 2)
+    result[:period - 1] = np.nan
+    return result
+
+
+def std_kernel(values, period):
+    """rolling population std, values shifted by the first one"""
+    shifted = values - values[0] if len(values) else values
+    mean = window_sum(shifted, period) / period
+    var = window_sum(shifted * shifted, period) / period - mean * mean
+    result = np.sqrt(np.maximum(var, 0.))
+    result[:period - 1] = np.nan
+    return result
+
+
+def ewm_kernel(values, alpha, min_periods):
+    """recursive exponential average starting from the first valid value"""
+    result = np.full(len(values), np.nan)
+    valid = np.flatnonzero(~np.isnan(values))
+    if len(valid):
+        start = valid[0]
+        result[start:] = pd.Series(values[start:]).ewm(
+            alpha=alpha, adjust=False, min_periods=min_periods).mean().values
+    return result
+
+
+def wilder_kernel(values, period):
+    """exponential average of alpha 1 / period seeded with the mean of the
+    first period valid values"""
+    result = np.full(len(values), np.nan)
+    valid = np.flatnonzero(~np.isnan(values))
+    if len(valid) >= period:
+        start = valid[0]
+        seed = start + period - 1
+        result[seed:] = ewm_kernel(
+            np.concatenate(([values[start:seed + 1].mean()],
+                            values[seed + 1:])), 1 / period, 1)
+    return result
+
+
+def rsi_kernel(gain, loss):
+    total = gain + loss
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rsi = np.where(total > 0, 100 * gain / total, 50.)
+    rsi[np.isnan(total)] = np.nan
+    return rsi
+
+
+# -[ STREAMING STATE ]-
+# One value per call with the same floating point steps of the kernels.
+
+class RunningMean(object):
+    """window mean updated as window_sum, dropped value from a ring"""
+
+    def __init__(self, period):
+        self.period = period
+        self.ring = RingBuffer(period)
+        self.total = 0.
+
+    @property
+    def full(self):
+        return self.ring.full
+
+    def update(self, value):
+        self.total += value - self.ring.push(value)
+        return self.total / self.period if self.ring.full else np.nan
+
+
+class RunningEWM(object):
+    """one step of the recursion of pandas ewm with adjust=False"""
+
+    def __init__(self, alpha, min_periods):
+        self.alpha = alpha
+        self.old_weight = 1. - alpha
+        self.min_periods = min_periods
+        self.value = None
+        self.count = 0
+
+    def update(self, value):
+        self.count += 1
+        if self.value is None:
+            self.value = value
+        elif self.value != value:
+            self.value = (self.old_weight * self.value + self.alpha * value) \
+                / (self.old_weight + self.alpha)
+        return self.value if self.count >= self.min_periods else np.nan
+
+
+class RunningWilder(RunningEWM):
+    """RunningEWM of alpha 1 / period seeded as wilder_kernel"""
+
+    def __init__(self, period):
+        super().__init__(1 / period, period)
+        self.seed = []
+
+    def update(self, value):
+        if self.value is not None:
+            return super().update(value)
+        self.count += 1
+        self.seed.append(value)
+        if self.count < self.min_periods:
+            return np.nan
+        # mean of an array, same summation of the kernel
+        self.value = float(np.mean(self.seed))
+        self.seed = []
+        return self.value
@@ -0,0 +1,156 @@
+"""
+foreanalyzer.cache
+~~~~~~~~~~~~~~~~~~
+
+In memory cache of resampled bars and indicator columns.
+"""
+
+import collections
+import hashlib
+import weakref
+
+import numpy as np
+import pandas as pd
+
+# logger
+import logging
+LOGGER = logging.getLogger("foreanalyzer.cache")
+
+
+def data_key(instrument, data):
+    """identify the window of data loaded for instrument
+
+    The span is not enough, frames of the same span with other prices or
+    dtypes (compact frames, a rebuilt cache) get another fingerprint of
+    their columns.
+    """
+    if len(data):
+        bounds = (data['timestamp'].iloc[0], data['timestamp'].iloc[-1])
+    else:
+        bounds = (None, None)
+    return (instrument.value, len(data)) + bounds + (fingerprint(data),)
+
+
+def fingerprint(data):
+    """hash of names, dtypes and values of the columns of data
+
+    The hash of a frame is kept while the frame is alive, frames are
+    taken as read only once hashed. Keys of a frame prepared again are
+    then a tuple to build, the hash is paid once per load.
+    """
+    entry = _FINGERPRINTS.get(id(data))
+    if entry is not None and entry[0]() is data:
+        return entry[1]
+    return tag(data, _digest(data))
+
+
+def tag(data, token):
+    """take token as fingerprint of data while it is alive
+
+    Loaders that know what a frame holds (source file, range, dtypes)
+    tag it when it is built, its values are never hashed.
+    """
+    key = id(data)
+    _FINGERPRINTS[key] = (
+        weakref.ref(data, lambda _: _FINGERPRINTS.pop(key, None)), token)
+    return token
+
+
+# (weak reference, hash) of frames by id
+_FINGERPRINTS = {}
+
+
+def _digest(data):
+    digest = hashlib.blake2b(digest_size=16)
+    for col in data.columns:
+        values = data[col].values
+        if values.dtype == object:
+            values = pd.util.hash_array(values)
+        values = np.ascontiguousarray(values)
+        digest.update('{}:{};'.format(col, values.dtype).encode())
+        digest.update(values.view(np.uint8))
+    return digest.hexdigest()
+
+
+def size_of(value):
+    """bytes held by a frame or a series"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True))
+    return 0
+
+
+class IndicatorCache(object):
+    """least recently used cache bounded by `max_bytes`
+
+    Keys are tuples starting with data_key() of the source data, then the
+    timeframe and, for indicators, the key of the tool. Cached values are
+    shared, callers must not modify them.
+    """
+
+    def __init__(self, max_bytes=512 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, build):
+        """return value of key, calling build() on miss"""
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+        self.misses += 1
+        value = build()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key)[1]
+        size = size_of(value)
+        if size > self.max_bytes:
+            LOGGER.debug("{} bytes over budget, not cached".format(size))
+            return
+        self.entries[key] = (value, size)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            old_key, (_, old_size) = self.entries.popitem(last=False)
+            self.nbytes -= old_size
+            LOGGER.debug("evicted {}".format(old_key))
+
+    def eval(self, key, tool, bars):
+        """bars with the columns of tool, computed once per key"""
+        def build():
+            # tool writes on a shallow copy, cached bars stay untouched
+            evaluated = tool.eval(bars.copy(deep=False))
+            return evaluated[[x for x in evaluated.columns
+                              if x not in bars.columns]]
+        columns = self.get(key + tool.key, build)
+        data = bars.copy(deep=False)
+        for col in columns.columns:
+            data[col] = columns[col]
+        return data
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes}
+
+
+# shared by every algorithm unless one is given
+INDICATOR_CACHE = IndicatorCache()
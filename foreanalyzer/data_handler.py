@@ -6,13 +6,25 @@ RAM eater, load RAM.
 """
 
 import abc
+import collections
+import io
+import json
+import os
 import os.path
+import shutil
 import time
+import warnings
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
 import pandas as pd
 
+from foreanalyzer import metrics
 from foreanalyzer._internal_utils import (
-    ACC_CURRENCIES, FOLDER_PATH, OUTER_FOLDER_PATH, unzip_data)
+    ACC_CURRENCIES, FOLDER_PATH, OUTER_FOLDER_PATH, STR_CURRENCIES,
+    unzip_data)
+from foreanalyzer.cache import size_of, tag
 
 # logger
 import logging
@@ -22,53 +34,425 @@ LOGGER = logging.getLogger("foreanalyzer.data")
 class DataHandler(object):
     """handler"""
 
-    def __init__(self, range_of_values):
+    def __init__(self, range_of_values, folder=None, cache_folder=None,
+                 use_cache=True, stream=True, workers=None, compact=False,
+                 max_bytes=None, mmap=False):
         self.FOLDER = os.path.join(FOLDER_PATH, 'data')
-        self.feeder = ZipFeeder(os.path.join(OUTER_FOLDER_PATH, 'data'))
+        if folder is None:
+            folder = os.path.join(OUTER_FOLDER_PATH, 'data')
+        self.feeder = ZipFeeder(folder, stream=stream)
         self.range_of_values = range_of_values
-        self.data = {}
+        # frames by instrument value, least recently used are unloaded
+        # over max_bytes
+        self.data = FrameStore(max_bytes)
+        # prices stored as float32
+        self.compact = compact
+        # processes used by get_data, all cores if None
+        self.workers = workers
+        # binary copy of normalized frames, skips unzip and parse
+        if use_cache:
+            if cache_folder is None:
+                cache_folder = os.path.join(folder, 'cache')
+            self.cache = DiskCache(cache_folder)
+        else:
+            self.cache = None
+        # frames are read only views of the cache files, shared through
+        # the page cache by every process opening them
+        if mmap and self.cache is None:
+            raise ValueError("mmap needs the cache")
+        self.mmap = mmap
 
-    def get_data(self):
-        """!INEFFICIENT!"""
+    def get_data(self, workers=None):
+        """load every instrument on a pool of `workers` processes
+
+        With the cache enabled workers only (re)build stale cache entries
+        and the frames are then read here from the memory mapped columns,
+        so nothing big is pickled back from the pool.
+        """
+        if workers is None:
+            workers = self.workers or os.cpu_count() or 1
+        if self.cache is None:
+            pending = list(ACC_CURRENCIES)
+        else:
+            pending = [x for x in ACC_CURRENCIES if not self.cache.is_valid(
+                x, self._source(x))]
+        results = {}
+        if workers > 1 and len(pending) > 1:
+            args = self._worker_args()
+            with ProcessPoolExecutor(min(workers, len(pending))) as pool:
+                futures = {instr: pool.submit(_load_worker, args, instr)
+                           for instr in pending}
+                results = {instr: x.result() for instr, x in futures.items()}
         for instr in ACC_CURRENCIES:
-            self.load_data(instr)
+            if results.get(instr) is None:
+                self.load_data(instr)
+            else:
+                self._store(instr, results[instr])
         return self.data
 
-    def unload_data(self):
-        self.data.clear()
+    def unload_data(self, instrument=None):
+        """free frame of instrument (all if None)"""
+        if instrument is None:
+            self.data.clear()
+        else:
+            self.data.pop(instrument.value, None)
+
+    def memory_stats(self):
+        """bytes held by each loaded frame and their sum, memory mapped
+        columns are counted apart"""
+        mapped = sum(size_of(x) for x in self.data.values()) - self.data.nbytes
+        return {'resident_bytes': self.data.nbytes,
+                'mapped_bytes': mapped,
+                'max_bytes': self.data.max_bytes,
+                'evictions': self.data.evictions,
+                'instruments': dict(self.data.sizes)}
 
     def load_data(self, instrument):
         if instrument not in ACC_CURRENCIES:
             raise ValueError("Instrument not accepted")
-        self.feeder.normalize_single(instrument)
-        file_path = os.path.join(self.FOLDER, instrument.value + '.csv')
-        df = normalize_df(pd.read_csv(file_path), self.range_of_values)
-        self.data[instrument.value] = df
-        return self.data[instrument.value]
+        if self.cache is None:
+            df = self._parse(instrument, self.range_of_values)
+        else:
+            source = self._source(instrument)
+            df = self.cache.load(instrument, source, self.range_of_values,
+                                 self.mmap)
+            if df is None:
+                df = self._build_cache(instrument)
+                if self.mmap:
+                    df = self.cache.load(instrument, source,
+                                         self.range_of_values, True)
+                else:
+                    df = df.iloc[-self.range_of_values:]
+                    df = df.reset_index(drop=True)
+        return self._store(instrument, df)
 
     def extract_all(self):
         self.feeder.normalize_data()
 
+    def price_at(self, instrument, timestamps):
+        """last close of instrument at or before each timestamp"""
+        if instrument.value not in self.data:
+            self.load_data(instrument)
+        data = self.data[instrument.value]
+        stamps = data['timestamp'].values
+        index = np.searchsorted(
+            stamps, np.asarray(timestamps, dtype=stamps.dtype), 'right') - 1
+        return data['close'].values[np.clip(index, 0, len(stamps) - 1)]
+
+    def conversion_rates(self, instrument, timestamps):
+        """EUR to quote currency rate of instrument at timestamps"""
+        base, quote = instrument.value[:3], instrument.value[3:]
+        if base == 'EUR':
+            return self.price_at(instrument, timestamps)
+        if 'EUR' + quote in STR_CURRENCIES:
+            return self.price_at(ACC_CURRENCIES['EUR' + quote], timestamps)
+        if 'EUR' + base in STR_CURRENCIES:
+            return self.price_at(ACC_CURRENCIES['EUR' + base], timestamps) * \
+                self.price_at(instrument, timestamps)
+        raise ValueError("no EUR rate for {}".format(instrument.value))
+
+    def invalidate_cache(self, instrument=None):
+        """remove cached frames of instrument (all if None)"""
+        if self.cache is None:
+            return
+        instruments = ACC_CURRENCIES if instrument is None else [instrument]
+        for instr in instruments:
+            self.cache.invalidate(instr)
+
+    def rebuild_cache(self, instrument=None):
+        """parse again from zip and store instrument (all if None)"""
+        if self.cache is None:
+            raise ValueError("cache not enabled")
+        instruments = ACC_CURRENCIES if instrument is None else [instrument]
+        for instr in instruments:
+            self.cache.invalidate(instr)
+            self._build_cache(instr)
+
+    def _worker_args(self):
+        return {'range_of_values': self.range_of_values,
+                'folder': self.feeder.basefolder,
+                'cache_folder': self.cache and self.cache.folder,
+                'use_cache': self.cache is not None,
+                'stream': self.feeder.stream}
+
+    def _store(self, instrument, df):
+        if self.compact:
+            df = compact_df(df)
+        source = self.feeder.source(instrument)
+        if os.path.isfile(source):
+            stat = os.stat(source)
+            tag(df, (source, stat.st_size, stat.st_mtime_ns,
+                     self.range_of_values, self.compact))
+        self.data[instrument.value] = df
+        return df
+
+    def _source(self, instrument):
+        """zip of instrument, None if only its cache was shipped"""
+        source = self.feeder.source(instrument)
+        if self.cache is not None and not os.path.isfile(source):
+            return None
+        return source
+
+    def _parse(self, instrument, range_of_values):
+        return self.feeder.read_single(instrument, range_of_values)
+
+    def _build_cache(self, instrument):
+        # cache holds the whole history, range is applied on load
+        df = self._parse(instrument, 0)
+        self.cache.save(instrument, self.feeder.source(instrument), df)
+        return df
+
+
+def _load_worker(args, instrument):
+    """load instrument in a pool process, with the cache only build it"""
+    handler = DataHandler(**args)
+    if handler.cache is None:
+        return handler.load_data(instrument)
+    handler._build_cache(instrument)
+
+
+class FrameStore(dict):
+    """dict of frames that unloads the least recently used over max_bytes
+
+    Reading a frame with [] makes it the most recent, the frame just
+    stored is never unloaded even if alone over the budget.
+    """
+
+    def __init__(self, max_bytes=None):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.sizes = collections.OrderedDict()
+        self.evictions = 0
+
+    @property
+    def nbytes(self):
+        return sum(self.sizes.values())
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.sizes.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.sizes[key] = resident_bytes(value)
+        self.sizes.move_to_end(key)
+        while self.max_bytes is not None and len(self.sizes) > 1 and \
+                self.nbytes > self.max_bytes:
+            old_key = next(iter(self.sizes))
+            del self[old_key]
+            self.evictions += 1
+            LOGGER.debug("{} unloaded, over memory budget".format(old_key))
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        del self.sizes[key]
+
+    def pop(self, key, *default):
+        self.sizes.pop(key, None)
+        return super().pop(key, *default)
+
+    def clear(self):
+        super().clear()
+        self.sizes.clear()
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+
+class DiskCache(object):
+    """normalized frames stored as one .npy file per column
+
+    An entry is valid while size and mtime of the source zip are the ones
+    recorded in its meta.json. With no source, a dataset built elsewhere,
+    any complete entry is valid.
+    """
+
+    META = 'meta.json'
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def path(self, instrument):
+        return os.path.join(self.folder, instrument.value)
+
+    @staticmethod
+    def source_key(source):
+        stat = os.stat(source)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+    def is_valid(self, instrument, source):
+        try:
+            with open(os.path.join(self.path(instrument), self.META)) as f:
+                meta = json.load(f)
+            return source is None or \
+                meta['source'] == self.source_key(source)
+        except (OSError, ValueError):
+            return False
+
+    def load(self, instrument, source, rows=0, mmap=False):
+        """return cached frame or None if missing or stale
+
+        With rows only the last rows are read, columns are memory mapped
+        and sliced before being copied. With mmap they are not copied,
+        the frame is made of read only views of the files.
+        """
+        folder = self.path(instrument)
+        try:
+            with open(os.path.join(folder, self.META), 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if source is not None and meta['source'] != self.source_key(source):
+            LOGGER.debug("cache of {} is stale".format(instrument.value))
+            return None
+        columns = {}
+        for col in meta['columns']:
+            column = np.load(os.path.join(folder, col + '.npy'), mmap_mode='r')
+            columns[col] = column[-rows:] if mmap else np.array(column[-rows:])
+        LOGGER.debug("{} loaded from cache".format(instrument.value))
+        return pd.DataFrame(columns, copy=False)
+
+    def save(self, instrument, source, df):
+        folder = self.path(instrument)
+        os.makedirs(folder, exist_ok=True)
+        # an old entry is invalid while its columns are replaced
+        try:
+            os.remove(os.path.join(folder, self.META))
+        except FileNotFoundError:
+            pass
+        for col in df.columns:
+            # new files replace the old ones, frames memory mapped on
+            # them keep reading the old inode
+            path = os.path.join(folder, col + '.npy')
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, df[col].values)
+            os.replace(path + '.tmp', path)
+        meta = {'source': self.source_key(source),
+                'columns': list(df.columns),
+                'rows': len(df)}
+        # meta is written last, a half written entry is never valid
+        tmp_file = os.path.join(folder, self.META + '.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_file, os.path.join(folder, self.META))
+
+    def invalidate(self, instrument):
+        shutil.rmtree(self.path(instrument), ignore_errors=True)
+
 
-def normalize_df(df, range_of_values, time_of_log=10):
-    df.drop(df.index[:-range_of_values], inplace=True)
-    df.rename(columns=lambda x: x.strip('<>').lower(), inplace=True)
+def normalize_df(df, range_of_values, time_of_log=None):
+    """keep the last `range_of_values` rows and build the timestamp column
+
+    The timestamp is computed in one pass over the whole `dtyyyymmdd` and
+    `time` columns instead of parsing a string per row. `time_of_log` is
+    deprecated and ignored, there is no progress left to log.
+    """
+    if time_of_log is not None:
+        warnings.warn("time_of_log is deprecated and ignored",
+                      DeprecationWarning, stacklevel=2)
     old_t = time.time()
-    for i, row in enumerate(df.iterrows()):
-        if time.time() - old_t > time_of_log:
-            LOGGER.debug("{:.3f}% normalized".format(i / len(df) * 100))
-            old_t = time.time()
-        str_time = str(int(row[1].loc['time']))
-        str_date = str(int(row[1].loc['dtyyyymmdd']))
-        if len(str_time) < 6:
-            str_time = (6 - len(str_time))*'0' + str_time
-        timestamp = pd.Timestamp(str_date + str_time)
-        df.loc[row[0],'time'] = timestamp
-    df.drop(columns=['ticker', 'vol', 'dtyyyymmdd'], inplace=True)
-    df.rename({'time': 'timestamp'}, axis='columns', inplace=True)
+    with metrics.stage('normalize', len(df)) as stage:
+        df = df.iloc[-range_of_values:]
+        df = df.rename(columns=lambda x: x.strip('<>').lower())
+        timestamps = parse_timestamps(df['dtyyyymmdd'].values,
+                                      df['time'].values)
+        df = df.drop(columns=['ticker', 'vol', 'dtyyyymmdd', 'time'])
+        df.insert(0, 'timestamp', timestamps)
+        df.reset_index(drop=True, inplace=True)
+        stage.rows_out = len(df)
+    LOGGER.debug("{} rows normalized in {:.3f}s".format(
+        len(df), time.time() - old_t))
     return df
 
 
+def resident_bytes(df):
+    """bytes of df not backed by memory mapped files"""
+    total = size_of(df)
+    if isinstance(df, pd.DataFrame):
+        for col in df.columns:
+            array = df[col].values
+            base = array
+            while base is not None and not isinstance(base, np.memmap):
+                base = getattr(base, 'base', None)
+            if base is not None:
+                total -= array.nbytes
+    return total
+
+
+def compact_df(df):
+    """df with float32 prices, timestamps are already int64 epoch ns"""
+    prices = [x for x in ('open', 'high', 'low', 'close') if x in df]
+    return df.astype({x: np.float32 for x in prices})
+
+
+def parse_timestamps(dates, times):
+    """convert YYYYMMDD and HHMMSS integer arrays to datetime64[ns]"""
+    dates = np.asarray(dates, dtype=np.int64)
+    times = np.asarray(times, dtype=np.int64)
+    # calendar part, from years since epoch down to days
+    months = (dates // 10000 - 1970) * 12 + dates // 100 % 100 - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]')
+    days += (dates % 100 - 1).astype('timedelta64[D]')
+    # clock part, HHMMSS with leading zeros stripped by the csv parser
+    seconds = times // 10000 * 3600 + times // 100 % 100 * 60 + times % 100
+    return (days.astype('datetime64[ns]') +
+            seconds.astype('timedelta64[s]').astype('timedelta64[ns]'))
+
+
+def read_csv_tail(file_path, rows, block_size=1 << 20):
+    """parse only the last rows of a csv, reading the file from the end"""
+    with open(file_path, 'rb') as f:
+        header = f.readline()
+        start = f.tell()
+        end = f.seek(0, os.SEEK_END)
+        data = b''
+        pos = end
+        # rows + 1 newlines guarantee rows complete lines (and a trailing one)
+        while pos > start and data.count(b'\n') <= rows:
+            step = min(block_size, pos - start)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    return _parse_tail(header, data, rows, pos > start)
+
+
+def read_stream_tail(stream, rows, block_size=1 << 20):
+    """parse only the last rows of a csv stream read from the start
+
+    Blocks of raw bytes are dropped as soon as the later ones hold rows
+    lines, only the tail is parsed.
+    """
+    header = stream.readline()
+    kept = collections.deque()
+    newlines = 0
+    cut = False
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        count = block.count(b'\n')
+        kept.append((block, count))
+        newlines += count
+        # rows + 1 newlines left guarantee rows complete lines
+        while newlines - kept[0][1] > rows:
+            newlines -= kept.popleft()[1]
+            cut = True
+    return _parse_tail(header, b''.join(x[0] for x in kept), rows, cut)
+
+
+def _parse_tail(header, data, rows, cut):
+    """frame of the last rows lines of data, first line is partial if
+    cut"""
+    lines = data.split(b'\n')
+    if cut:
+        lines = lines[1:]
+    lines = [x for x in lines if x.strip()]
+    return pd.read_csv(io.BytesIO(b'\n'.join([header.rstrip()] +
+                                              lines[-rows:])))
+
+
 class Feeder(metaclass=abc.ABCMeta):
     """abstract implementation of Feeder of data"""
 
@@ -79,12 +463,26 @@ class Feeder(metaclass=abc.ABCMeta):
     def normalize_data(self):
         pass
 
+    @abc.abstractmethod
+    def read_single(self, instr, range_of_values):
+        pass
+
 
 class ZipFeeder(Feeder):
-    """create data from zip file outer folder"""
+    """create data from zip file outer folder
 
-    def __init__(self, folder):
+    In stream mode the csv is read straight from the archive member,
+    nothing is extracted, and with a range only its last rows are parsed.
+    """
+
+    def __init__(self, folder, stream=False, chunksize=1000000):
         self.basefolder = folder
+        self.stream = stream
+        self.chunksize = chunksize
+
+    def source(self, instr):
+        """path of the zip file of instrument"""
+        return os.path.join(self.basefolder, instr.value + '.zip')
 
     def normalize_single(self, instr):
         unzip_data(self.basefolder, instr.value)
@@ -92,3 +490,34 @@ class ZipFeeder(Feeder):
     def normalize_data(self):
         for instr in ACC_CURRENCIES:
             self.normalize_single(instr)
+
+    def read_single(self, instr, range_of_values):
+        """return normalized frame of instrument"""
+        if not self.stream:
+            self.normalize_single(instr)
+            file_path = os.path.join(FOLDER_PATH, 'data', instr.value + '.csv')
+            with metrics.stage('parse') as stage:
+                if range_of_values:
+                    raw = read_csv_tail(file_path, range_of_values)
+                else:
+                    raw = pd.read_csv(file_path)
+                stage.rows_out = len(raw)
+            return normalize_df(raw, range_of_values)
+        with metrics.stage('parse') as stage:
+            with zipfile.ZipFile(self.source(instr), 'r') as zip_file:
+                with zip_file.open(self.member(zip_file)) as member:
+                    if range_of_values:
+                        raw = read_stream_tail(member, range_of_values)
+                    else:
+                        raw = pd.concat(
+                            pd.read_csv(member, chunksize=self.chunksize))
+            stage.rows_out = len(raw)
+        return normalize_df(raw, range_of_values)
+
+    @staticmethod
+    def member(zip_file):
+        """name of the csv inside the archive"""
+        for name in zip_file.namelist():
+            if name.endswith(('.txt', '.csv')):
+                return name
+        raise ValueError("no csv in {}".format(zip_file.filename))
@@ -5,10 +5,14 @@ foreanalyzer.engine
 Main engine for the simulation.
 """
 
-from foreanalyzer._internal_utils import (ACC_CURRENCIES, OUTER_FOLDER_PATH,
-                                          unzip_data)
+import numpy as np
+import pandas as pd
+
+from foreanalyzer import exceptions, tables
+from foreanalyzer._internal_utils import read_config
 from foreanalyzer.data_handler import DataHandler
-from foreanalyzer.simulation import AccountSimulated
+from foreanalyzer.rates import HistoricalRates
+from foreanalyzer.simulation import AccountSimulated, nights
 
 # logger
 import logging
@@ -18,8 +22,198 @@ LOGGER = logging.getLogger("foreanalyzer.engine")
 class EngineBridge(object):
     """engine"""
 
-    def __init__(self):
-        # data to feed
-        self.handler = DataHandler()
-        # init simulation components
-        self.account = AccountSimulated()
+    def __init__(self, range_of_values, margin_mode=None, initial_funds=None):
+        # data to feed, also source of conversion rates
+        self.handler = DataHandler(range_of_values)
+        if margin_mode is None or initial_funds is None:
+            config = read_config()['simulation']
+            margin_mode = margin_mode or config['margin_mode']
+            if initial_funds is None:
+                initial_funds = config['initial_funds']
+        if margin_mode not in ["beginner", "pro"]:
+            raise ValueError("margin_mode not recognized")
+        self.margin_mode = margin_mode
+        self.initial_funds = initial_funds
+        self._account = None
+        # state of replay, bars of the current run
+        self.arrays = {}
+        self.conv_rates = {}
+        # last bar replayed of each instrument
+        self.indexes = {}
+
+    @property
+    def account(self):
+        """simulated account, created on first use"""
+        if self._account is None:
+            self._account = AccountSimulated(
+                self.margin_mode, self.initial_funds,
+                HistoricalRates(self.handler))
+        return self._account
+
+    @property
+    def book(self):
+        """open positions of the account"""
+        return self.account.book
+
+    def backtest(self, algorithm, data=None):
+        """vectorized run of algorithm on each of its instruments
+
+        Every instrument starts from initial_funds, returns a dict of
+        BacktestResult by instrument value. Frames in `data` (by
+        instrument value) are used instead of loading them.
+        """
+        results = {}
+        for instr in algorithm.accepted_instruments:
+            if data is None:
+                bars = algorithm.prepare(instr)
+            else:
+                bars = algorithm.prepare(instr, data[instr.value])
+            position = algorithm.signals(instr, bars)
+            conv_rate = self.handler.conversion_rates(
+                instr, bars['timestamp'].values)
+            results[instr.value] = self.backtest_bars(
+                instr, bars, position, conv_rate)
+        return results
+
+    def replay(self, algorithm):
+        """event driven run on a fresh account
+
+        Bars of all instruments are replayed through
+        AccountSimulated.replay, after every bar the engine calls
+        algorithm.on_bar(engine, instrument, index), which can use open()
+        and close(). Open positions pay their swap at the first bar after
+        each rollover. Returns timestamp, instrument and equity after each
+        bar.
+        """
+        self._account = None
+        account = self.account
+        self.arrays = {}
+        self.conv_rates = {}
+        self.indexes = indexes = {}
+        feeds = {}
+        for instr in algorithm.accepted_instruments:
+            bars = algorithm.prepare(instr)
+            self.arrays[instr] = {x: bars[x].values for x in bars.columns}
+            close = bars['close'].values
+            half_spread = tables.CURRENCIES[instr.value].spread / 2
+            stamps = bars['timestamp'].values
+            self.conv_rates[instr] = self.handler.conversion_rates(
+                instr, stamps).tolist()
+            feeds[instr] = (stamps, close + half_spread, close - half_spread)
+        on_bar = algorithm.on_bar
+
+        def on_step(account, instr, index):
+            indexes[instr] = index
+            on_bar(self, instr, index)
+        return account.replay(feeds, on_step)
+
+    def open(self, mode, instrument, quantity):
+        """order on the account at the current bar of instrument, return
+        the slot of the position"""
+        if instrument not in self.indexes:
+            raise exceptions.PriceNotUpdated()
+        conv_rate = self.conv_rates[instrument][self.indexes[instrument]]
+        return self.account.make_order(mode, instrument, quantity,
+                                       conv_rate).slot
+
+    def close(self, slot):
+        """close the position of slot, return its gain"""
+        return self.account.close_position(self.account.by_slot[slot])
+
+    def backtest_bars(self, instrument, bars, position, conv_rate):
+        currency = tables.CURRENCIES[instrument.value]
+        if self.margin_mode == 'beginner':
+            margin = currency.stnd_margin
+        elif self.margin_mode == 'pro':
+            margin = currency.pro_margin
+        arrays = vector_backtest(
+            bars['close'].values, position, currency.spread, margin,
+            conv_rate, self.initial_funds, nights(bars['timestamp'].values),
+            (currency.long_swap, currency.short_swap))
+        frame = pd.DataFrame(arrays)
+        frame.insert(0, 'timestamp', bars['timestamp'].values)
+        return BacktestResult(instrument, frame, self.initial_funds)
+
+
+class BacktestResult(object):
+    """equity curve and trades of a vectorized backtest"""
+
+    def __init__(self, instrument, frame, initial_funds):
+        self.instrument = instrument
+        self.frame = frame
+        self.initial_funds = initial_funds
+
+    @property
+    def equity(self):
+        return self.frame['equity']
+
+    @property
+    def final_equity(self):
+        if not len(self.frame):
+            return self.initial_funds
+        return self.frame['equity'].iloc[-1]
+
+    @property
+    def trades(self):
+        return int(np.count_nonzero(self.frame['trade'].values))
+
+    @property
+    def max_drawdown(self):
+        """deepest fall of equity from its previous high"""
+        equity = np.concatenate(
+            [[self.initial_funds], self.frame['equity'].values])
+        return float(np.max(np.maximum.accumulate(equity) - equity))
+
+    @property
+    def margin_call(self):
+        """first timestamp with used funds over equity, None if never"""
+        over = np.flatnonzero(self.frame['free_funds'].values < 0)
+        if not len(over):
+            return None
+        return self.frame['timestamp'].iloc[over[0]]
+
+    def stats(self):
+        return {'instrument': self.instrument.value,
+                'final_equity': self.final_equity,
+                'profit': self.final_equity - self.initial_funds,
+                'trades': self.trades,
+                'max_drawdown': self.max_drawdown,
+                'margin_call': self.margin_call}
+
+
+def vector_backtest(close, position, spread, margin, conv_rate,
+                    initial_funds, nights=None, swap=(0., 0.)):
+    """simulate holding position[i] units from bar i to bar i + 1
+
+    Units are bought at ask (close + spread / 2) and sold at bid
+    (close - spread / 2), results are converted to EUR dividing by
+    conv_rate as in account.Position. Units held over nights[i + 1]
+    rollovers pay the (long, short) swap fee by unit and night. Returns
+    a dict of arrays.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    position = np.asarray(position, dtype=np.float64)
+    conv_rate = np.broadcast_to(
+        np.asarray(conv_rate, dtype=np.float64), close.shape)
+    trade = np.diff(position, prepend=0.)
+    # mark to market on mid price, half spread paid on every unit traded
+    pnl = np.zeros_like(close)
+    pnl[1:] = position[:-1] * np.diff(close)
+    pnl -= np.abs(trade) * spread / 2
+    swaps = np.zeros_like(close)
+    if nights is not None:
+        held = position[:-1]
+        swaps[1:] = np.where(held > 0, held * swap[0], -held * swap[1]) * \
+            np.asarray(nights, dtype=np.float64)[1:]
+    pnl += swaps
+    pnl /= conv_rate
+    equity = initial_funds + np.cumsum(pnl)
+    used_funds = margin * np.abs(position) / conv_rate * close
+    return {'close': close,
+            'position': position,
+            'trade': trade,
+            'pnl': pnl,
+            'swap': swaps / conv_rate,
+            'equity': equity,
+            'used_funds': used_funds,
+            'free_funds': equity - used_funds}
@@ -0,0 +1,201 @@
+"""
+foreanalyzer.live
+~~~~~~~~~~~~~~~~~
+
+Live feed of quotes, bars of the algorithm timeframe built on arrival.
+"""
+
+import abc
+import asyncio
+import collections
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from foreanalyzer.algorithm import Resample
+
+# logger
+import logging
+LOGGER = logging.getLogger("foreanalyzer.live")
+
+
+class QuoteSource(metaclass=abc.ABCMeta):
+    """asynchronous source of quotes"""
+
+    @abc.abstractmethod
+    async def quotes(self, instruments):
+        """epoch seconds and {instrument: {'buy': ask, 'sell': bid}}"""
+        pass
+
+
+class PollingSource(QuoteSource):
+    """snapshots of a quotes.QuoteClient, requests run in a thread"""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def quotes(self, instruments):
+        loop = asyncio.get_running_loop()
+        stamp, prices = await loop.run_in_executor(
+            None, self.client.snapshot, instruments)
+        return stamp.astype('datetime64[ms]').astype(np.int64) / 1e3, prices
+
+
+class FakeQuoteSource(QuoteSource):
+    """random walk quotes, for tests and paper runs without a broker"""
+
+    def __init__(self, clock=time.time, start=1.1, spread=0.0002,
+                 volatility=1e-4, seed=None):
+        self.clock = clock
+        self.spread = spread
+        self.volatility = volatility
+        self.rand = np.random.RandomState(seed)
+        self.mid = collections.defaultdict(lambda: start)
+        self.requests = 0
+
+    async def quotes(self, instruments):
+        self.requests += 1
+        prices = {}
+        for instr in instruments:
+            self.mid[instr] += self.rand.normal(0, self.volatility)
+            prices[instr] = {'buy': self.mid[instr] + self.spread / 2,
+                             'sell': self.mid[instr] - self.spread / 2}
+        return self.clock(), prices
+
+
+class LiveFeed(object):
+    """poll source every `interval` seconds for all accepted instruments
+    of algorithm and wake it at timeframe boundaries
+
+    Mid prices are resampled to bars of algorithm.timeframe, boundaries
+    are the bar starts of Resample (mondays for weeks, first days for
+    months). At each boundary the bars closed since the last one are
+    given to algorithm.on_live_bar(feed, instrument, bar) in time order,
+    orders go through order() on account, an AccountSimulated for paper
+    trading. The last `history` bars of each instrument are kept. Delay
+    of the wake up and decision latency, from bar close to order, are
+    kept for metrics().
+    """
+
+    def __init__(self, algorithm, source, account, interval=1.,
+                 clock=time.time, sleep=asyncio.sleep, history=10000):
+        self.algorithm = algorithm
+        self.instruments = list(algorithm.accepted_instruments)
+        self.source = source
+        self.account = account
+        self.interval = interval
+        self.clock = clock
+        self.sleep = sleep
+        self.builders = {x: Resample(algorithm.timeframe)
+                         for x in self.instruments}
+        self.offset = Resample.OFFSETS[algorithm.timeframe]
+        # closed bars by instrument
+        self.bars = {x: collections.deque(maxlen=history)
+                     for x in self.instruments}
+        self.prices = {}
+        # close time of the bars being decided, epoch seconds
+        self.bar_close = None
+        # opening time of the last bar decided by instrument
+        self.decided = {}
+        self.polls = 0
+        self.wake_delays = collections.deque(maxlen=history)
+        self.latencies = collections.deque(maxlen=history)
+
+    async def run(self, bars=None):
+        """poll and wake until `bars` boundaries passed, forever if None"""
+        now = self.clock()
+        next_poll = now
+        next_bar = self.next_boundary(now)
+        passed = 0
+        while bars is None or passed < bars:
+            now = self.clock()
+            # quotes at the boundary go to the next bar
+            if now >= next_bar:
+                self.wake(next_bar, now)
+                passed += 1
+                next_bar = self.next_boundary(next_bar)
+                continue
+            if now >= next_poll:
+                await self.poll()
+                # missed polls are skipped
+                next_poll = max(next_poll + self.interval, now)
+            await self.sleep(max(0., min(next_poll, next_bar) - self.clock()))
+
+    async def poll(self):
+        """one snapshot of quotes of all instruments"""
+        stamp, prices = await self.source.quotes(self.instruments)
+        self.polls += 1
+        self.prices.update(prices)
+        self.account.price_tables.update(prices)
+        timestamp = pd.Timestamp(stamp, unit='s')
+        for instr, couple in prices.items():
+            mid = (couple['buy'] + couple['sell']) / 2
+            done = self.builders[instr].update({
+                'timestamp': timestamp, 'open': mid, 'high': mid,
+                'low': mid, 'close': mid})
+            if done is not None:
+                # bar left open by a late wake up
+                self.bars[instr].append(done)
+
+    def wake(self, boundary, now):
+        """close bars started before boundary and call the algorithm"""
+        self.wake_delays.append(now - boundary)
+        self.bar_close = boundary
+        start = pd.Timestamp(boundary, unit='s')
+        closed = []
+        for instr, builder in self.builders.items():
+            if builder.current is not None and \
+                    builder.current['timestamp'] < start:
+                self.bars[instr].append(builder.current)
+                builder.reset()
+            # bars closed after the last decided, once
+            decided = self.decided.get(instr)
+            new = []
+            for bar in reversed(self.bars[instr]):
+                if decided is not None and bar['timestamp'] <= decided:
+                    break
+                new.append(bar)
+            if new:
+                self.decided[instr] = new[0]['timestamp']
+            closed.extend((instr, x) for x in reversed(new))
+        # stable, instruments keep their order on the same time
+        closed.sort(key=lambda x: x[1]['timestamp'])
+        for instr, bar in closed:
+            self.algorithm.on_live_bar(self, instr, bar)
+
+    def next_boundary(self, now):
+        """epoch seconds of the first bar start after now"""
+        builder = next(iter(self.builders.values()))
+        start = builder.bar_start(pd.Timestamp(now, unit='s')) + self.offset
+        return start.value / 1e9
+
+    def order(self, mode, instrument, quantity):
+        """make order on account, latency is recorded"""
+        self.latencies.append(self.clock() - self.bar_close)
+        return self.account.make_order(mode, instrument, quantity)
+
+    def metrics(self):
+        """counts and latency percentiles in seconds"""
+        return {'polls': self.polls,
+                'bars': sum(len(x) for x in self.bars.values()),
+                'orders': len(self.latencies),
+                'wake_delay': summary(self.wake_delays),
+                'decision_latency': summary(self.latencies)}
+
+    def export(self, path):
+        """write metrics() to path as json"""
+        with open(path, 'w') as f:
+            json.dump(self.metrics(), f, indent=2)
+
+
+def summary(values):
+    if not len(values):
+        return {'count': 0}
+    values = np.fromiter(values, dtype=np.float64)
+    return {'count': len(values),
+            'mean': float(values.mean()),
+            'p50': float(np.percentile(values, 50)),
+            'p99': float(np.percentile(values, 99)),
+            'max': float(values.max())}
@@ -0,0 +1,182 @@
+"""
+foreanalyzer.metrics
+~~~~~~~~~~~~~~~~~~~~
+
+Wall time, rows and memory of the pipeline stages.
+
+    from foreanalyzer.metrics import REGISTRY
+    REGISTRY.enable()
+    ...
+    REGISTRY.get('normalize')
+    REGISTRY.export('metrics.json')
+"""
+
+import collections
+import json
+import time
+import tracemalloc
+
+# logger
+import logging
+LOGGER = logging.getLogger("foreanalyzer.metrics")
+
+
+class StageStats(object):
+    """totals of the calls of a stage"""
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.
+        self.max_seconds = 0.
+        self.rows_in = 0
+        self.rows_out = 0
+        # net bytes allocated, only with memory tracing
+        self.memory = 0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class Stage(object):
+    """time a block, rows_out can be set inside it"""
+
+    def __init__(self, registry, name, rows_in):
+        self.registry = registry
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+
+    def __enter__(self):
+        if self.registry.memory:
+            self.start_memory = tracemalloc.get_traced_memory()[0]
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        memory = 0
+        if self.registry.memory:
+            memory = tracemalloc.get_traced_memory()[0] - self.start_memory
+        self.registry.record(self.name, elapsed, self.rows_in, self.rows_out,
+                             memory)
+        return False
+
+
+class NullStage(object):
+    """stage of a disabled registry, does nothing"""
+
+    rows_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+NULL_STAGE = NullStage()
+
+
+class Registry(object):
+    """stats of stages and counters by name
+
+    Disabled, stage() returns NULL_STAGE and count() returns at once, the
+    cost left is the call. With memory the net bytes allocated in each
+    stage are taken from tracemalloc, which slows everything down.
+    """
+
+    PREFIX = 'foreanalyzer'
+
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.stages = collections.defaultdict(StageStats)
+        self.counters = collections.Counter()
+        self._tracing = False
+
+    def enable(self, memory=False):
+        self.enabled = True
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+
+    def disable(self):
+        self.enabled = False
+        self.memory = False
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    def stage(self, name, rows_in=None):
+        """context timing stage name"""
+        if not self.enabled:
+            return NULL_STAGE
+        return Stage(self, name, rows_in)
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] += value
+
+    def record(self, name, seconds, rows_in=None, rows_out=None, memory=0):
+        stats = self.stages[name]
+        stats.calls += 1
+        stats.seconds += seconds
+        stats.max_seconds = max(stats.max_seconds, seconds)
+        stats.rows_in += rows_in or 0
+        stats.rows_out += rows_out or 0
+        stats.memory += memory
+
+    def get(self, name):
+        """stats of stage name as dict, None if never run"""
+        if name not in self.stages:
+            return None
+        return self.stages[name].as_dict()
+
+    def snapshot(self):
+        return {'stages': {x: y.as_dict() for x, y in self.stages.items()},
+                'counters': dict(self.counters)}
+
+    def reset(self):
+        self.stages.clear()
+        self.counters.clear()
+
+    def export(self, path):
+        """write snapshot() to path as json"""
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def prometheus(self):
+        """snapshot() in the prometheus text format"""
+        lines = []
+        fields = [('calls', 'counter', 'calls of the stage'),
+                  ('seconds', 'counter', 'wall time in the stage'),
+                  ('max_seconds', 'gauge', 'longest call of the stage'),
+                  ('rows_in', 'counter', 'rows given to the stage'),
+                  ('rows_out', 'counter', 'rows made by the stage'),
+                  ('memory', 'gauge', 'net bytes allocated in the stage')]
+        for field, kind, text in fields:
+            metric = '{}_stage_{}'.format(self.PREFIX, field)
+            if kind == 'counter':
+                metric += '_total'
+            lines.append('# HELP {} {}'.format(metric, text))
+            lines.append('# TYPE {} {}'.format(metric, kind))
+            for name, stats in sorted(self.stages.items()):
+                lines.append('{}{{stage="{}"}} {}'.format(
+                    metric, name, getattr(stats, field)))
+        if self.counters:
+            metric = '{}_events_total'.format(self.PREFIX)
+            lines.append('# HELP {} counted events'.format(metric))
+            lines.append('# TYPE {} counter'.format(metric))
+            for name, value in sorted(self.counters.items()):
+                lines.append('{}{{name="{}"}} {}'.format(metric, name, value))
+        return '\n'.join(lines) + '\n'
+
+
+# used by the pipeline, disabled until enabled
+REGISTRY = Registry()
+stage = REGISTRY.stage
+count = REGISTRY.count
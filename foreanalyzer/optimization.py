@@ -0,0 +1,269 @@
+"""
+foreanalyzer.optimization
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Run algorithms over grids of parameters.
+"""
+
+import itertools
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from foreanalyzer.data_handler import DataHandler
+from foreanalyzer.engine import EngineBridge
+
+# logger
+import logging
+LOGGER = logging.getLogger("foreanalyzer.optimization")
+
+# state of a sweep worker, set once by _init_worker
+_WORKER = {}
+
+
+class SharedFrames(object):
+    """frames copied once in shared memory, one block per frame
+
+    `spec` is small and picklable, attach() gives back read only frames
+    that use the shared block without copying it.
+    """
+
+    def __init__(self, frames):
+        self.blocks = []
+        self.spec = {}
+        for name, frame in frames.items():
+            columns = [(col, frame[col].values) for col in frame.columns]
+            size = sum(x.nbytes for _, x in columns)
+            block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+            self.blocks.append(block)
+            layout = []
+            offset = 0
+            for col, values in columns:
+                target = np.ndarray(values.shape, values.dtype,
+                                    buffer=block.buf, offset=offset)
+                target[:] = values
+                layout.append((col, values.dtype.str, offset))
+                offset += values.nbytes
+            self.spec[name] = (block.name, len(frame), layout)
+
+    def close(self):
+        """release and remove the blocks"""
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @staticmethod
+    def attach(spec):
+        """return blocks and frames by name of spec"""
+        blocks, frames = [], {}
+        for name, (block_name, rows, layout) in spec.items():
+            block = shared_memory.SharedMemory(name=block_name)
+            blocks.append(block)
+            columns = {}
+            for col, dtype, offset in layout:
+                values = np.ndarray(rows, np.dtype(dtype), buffer=block.buf,
+                                    offset=offset)
+                values.flags.writeable = False
+                columns[col] = values
+            frames[name] = pd.DataFrame(columns, copy=False)
+        return blocks, frames
+
+
+class SweepRunner(object):
+    """backtest algorithm_class on every combination of grid
+
+    Grid maps keyword arguments of algorithm_class to lists of values,
+    the key 'instrument' is given as acc_instrums=[instrument]. Data of
+    every instrument (and of those used for conversion rates) is loaded
+    once and shared with `workers` processes, all cores if None.
+    """
+
+    def __init__(self, algorithm_class, grid, range_of_values,
+                 margin_mode=None, initial_funds=None, workers=None,
+                 handler=None):
+        self.algorithm_class = algorithm_class
+        self.grid = grid
+        self.range_of_values = range_of_values
+        self.engine_args = (range_of_values, margin_mode, initial_funds)
+        self.workers = workers or os.cpu_count() or 1
+        if handler is None:
+            handler = DataHandler(range_of_values)
+        self.handler = handler
+
+    def combinations(self):
+        """list of kwargs, instrument and timeframe change slowest
+
+        Neighbour runs share resampled bars in the cache of a worker.
+        """
+        first = [x for x in ('instrument', 'timeframe') if x in self.grid]
+        names = first + sorted(x for x in self.grid if x not in first)
+        return [dict(zip(names, values)) for values in
+                itertools.product(*[self.grid[x] for x in names])]
+
+    def load(self):
+        """frames of instruments in grid and of their conversion rates"""
+        instruments = set(self.grid.get('instrument', []))
+        if not instruments:
+            instruments = set(self.algorithm_class().accepted_instruments)
+        for instr in instruments:
+            data = self.handler.load_data(instr)
+            # loads the instruments needed for conversion
+            self.handler.conversion_rates(instr, data['timestamp'].values[:1])
+        return dict(self.handler.data)
+
+    def run(self, metric='profit'):
+        """results of every combination sorted by metric, best first"""
+        table = pd.DataFrame(self._map(_run, self.combinations(), self.load()))
+        if not len(table):
+            return table
+        return table.sort_values(metric, ascending=False, kind='stable') \
+            .reset_index(drop=True)
+
+    def _map(self, job, combinations, frames, **state):
+        """rows of job on every combination, on the pool if workers > 1
+
+        Keyword arguments are added to the state of the workers.
+        """
+        LOGGER.debug("{} runs on {} workers".format(
+            len(combinations), self.workers))
+        if self.workers == 1:
+            _setup(self.algorithm_class, self.engine_args, frames, state)
+            rows = [job(x) for x in combinations]
+        else:
+            chunksize = max(1, math.ceil(len(combinations) / self.workers / 4))
+            with SharedFrames(frames) as shared, ProcessPoolExecutor(
+                    self.workers, initializer=_init_worker,
+                    initargs=(self.algorithm_class, self.engine_args,
+                              shared.spec, state)) as pool:
+                rows = list(pool.map(job, combinations, chunksize=chunksize))
+        return [x for run in rows for x in run]
+
+
+class WalkForward(SweepRunner):
+    """walk forward analysis of algorithm_class over grid
+
+    History is split in folds of `in_sample` followed by `out_sample`
+    (anything pd.Timedelta accepts), each fold starts `out_sample` after
+    the previous one. For every fold the parameters with the best metric
+    in sample are evaluated on the out of sample window.
+
+    Bars, indicators and signals of a combination are computed once on
+    the whole history and sliced for every fold, the indicators only
+    look back so a slice sees the same values of a run on the fold.
+    """
+
+    def __init__(self, algorithm_class, grid, range_of_values, in_sample,
+                 out_sample, margin_mode=None, initial_funds=None,
+                 workers=None, handler=None):
+        super().__init__(algorithm_class, grid, range_of_values, margin_mode,
+                         initial_funds, workers, handler)
+        self.in_sample = pd.Timedelta(in_sample)
+        self.out_sample = pd.Timedelta(out_sample)
+        # every run of the last call of run(), by fold and sample
+        self.runs = None
+
+    def folds(self, frames):
+        """list of (in_start, out_start, out_end) on the history of frames
+
+        Only whole folds are kept.
+        """
+        first = min(x['timestamp'].iloc[0] for x in frames.values())
+        last = max(x['timestamp'].iloc[-1] for x in frames.values())
+        folds = []
+        start = first
+        while start + self.in_sample + self.out_sample <= last:
+            out_start = start + self.in_sample
+            folds.append((start.to_datetime64(), out_start.to_datetime64(),
+                          (out_start + self.out_sample).to_datetime64()))
+            start += self.out_sample
+        return folds
+
+    def run(self, metric='profit'):
+        """out of sample stats of the best parameters of every fold"""
+        frames = self.load()
+        folds = self.folds(frames)
+        if not folds:
+            raise ValueError("history shorter than a fold")
+        combinations = self.combinations()
+        self.runs = pd.DataFrame(
+            self._map(_run_folds, combinations, frames, folds=folds))
+        in_sample = self.runs[self.runs['sample'] == 'in']
+        out_sample = self.runs[self.runs['sample'] == 'out']
+        # stats always name the instrument, a grid may not
+        keys = ['fold', 'instrument'] + [
+            x for x in combinations[0] if x != 'instrument']
+        best = in_sample.sort_values(metric, ascending=False, kind='stable') \
+            .groupby(['fold', 'instrument']).head(1)
+        table = best[keys + [metric]] \
+            .rename(columns={metric: 'in_' + metric}) \
+            .merge(out_sample.drop(columns='sample'), on=keys)
+        table.insert(1, 'out_start', [folds[x][1] for x in table['fold']])
+        return table.sort_values(['fold', 'instrument'], kind='stable') \
+            .reset_index(drop=True)
+
+
+def _setup(algorithm_class, engine_args, frames, state):
+    engine = EngineBridge(*engine_args)
+    engine.handler.data.update(frames)
+    _WORKER.update(state, algorithm_class=algorithm_class, engine=engine,
+                   frames=frames)
+
+
+def _init_worker(algorithm_class, engine_args, spec, state):
+    blocks, frames = SharedFrames.attach(spec)
+    # blocks must live as long as the frames using them
+    _WORKER['blocks'] = blocks
+    _setup(algorithm_class, engine_args, frames, state)
+
+
+def _algorithm(params):
+    kwargs = dict(params)
+    if 'instrument' in kwargs:
+        kwargs['acc_instrums'] = [kwargs.pop('instrument')]
+    return _WORKER['algorithm_class'](**kwargs)
+
+
+def _row(params, result, **extra):
+    row = {key: getattr(value, 'value', value)
+           for key, value in params.items()}
+    row.update(extra)
+    row.update(result.stats())
+    return row
+
+
+def _run(params):
+    """rows of stats of one combination, one by instrument"""
+    results = _WORKER['engine'].backtest(_algorithm(params), _WORKER['frames'])
+    return [_row(params, x) for x in results.values()]
+
+
+def _run_folds(params):
+    """rows of stats of one combination by instrument, fold and sample"""
+    algorithm = _algorithm(params)
+    engine = _WORKER['engine']
+    rows = []
+    for instr in algorithm.accepted_instruments:
+        bars = algorithm.prepare(instr, _WORKER['frames'][instr.value])
+        position = np.asarray(algorithm.signals(instr, bars))
+        stamps = bars['timestamp'].values
+        conv_rate = engine.handler.conversion_rates(instr, stamps)
+        for fold, bounds in enumerate(_WORKER['folds']):
+            start, middle, end = np.searchsorted(stamps, bounds)
+            for sample, first, last in (('in', start, middle),
+                                        ('out', middle, end)):
+                result = engine.backtest_bars(
+                    instr, bars.iloc[first:last], position[first:last],
+                    conv_rate[first:last])
+                rows.append(_row(params, result, fold=fold, sample=sample))
+    return rows
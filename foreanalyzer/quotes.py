@@ -0,0 +1,121 @@
+"""
+foreanalyzer.quotes
+~~~~~~~~~~~~~~~~~~~
+
+Snapshots of the quotes of many instruments.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from foreanalyzer import exceptions
+
+# logger
+import logging
+LOGGER = logging.getLogger("foreanalyzer.quotes")
+
+
+class BrokerQuotes(object):
+    """quotes of a snapshot of instruments from the broker client
+
+    trading212 has no bulk quote call, the update_price of each
+    instrument is requested at once from a pool of threads on the logged
+    in session of `api`. The snapshot is stamped with the time the
+    requests were sent.
+    """
+
+    def __init__(self, api, workers=8):
+        self.api = api
+        self.pool = ThreadPoolExecutor(workers)
+        # count and seconds of the snapshots taken
+        self.requests = 0
+        self.total_latency = 0.
+        self.max_latency = 0.
+
+    def snapshot(self, instruments):
+        """time and {instrument: {'buy': ask, 'sell': bid}} of instruments"""
+        stamp = np.datetime64(int(time.time() * 1000), 'ms')
+        start = time.perf_counter()
+        futures = [self.pool.submit(self.api.update_price, x.value)
+                   for x in instruments]
+        prices = {}
+        for instr, future in zip(instruments, futures):
+            try:
+                price = future.result().price
+            except Exception:
+                LOGGER.exception("no quote of {}".format(instr.value))
+                price = None
+            if not price:
+                raise exceptions.PriceNotUpdated()
+            prices[instr] = {'buy': price['buy'], 'sell': price['sell']}
+        latency = time.perf_counter() - start
+        self.requests += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        LOGGER.debug("{} quotes in {:.4f}s".format(len(prices), latency))
+        return stamp, prices
+
+    def stats(self):
+        return {'requests': self.requests,
+                'mean_latency': self.total_latency / max(self.requests, 1),
+                'max_latency': self.max_latency}
+
+    def close(self):
+        self.pool.shutdown()
+
+
+class QuoteClient(object):
+    """quotes of a snapshot of instruments from a bulk quote gateway
+
+    The broker has no such endpoint, this is for a gateway of our own in
+    front of it, set as account.quotes_url in config. GET
+    url?instruments=EURUSD,GBPUSD answers with the prices of all of them
+    taken at the same time:
+
+        {"time": <epoch ms>,
+         "quotes": {"EURUSD": {"buy": 1.1302, "sell": 1.13}, ...}}
+
+    The session keeps its connection open between requests.
+    """
+
+    def __init__(self, url, session=None, timeout=5.):
+        self.url = url
+        self.session = requests.Session() if session is None else session
+        self.timeout = timeout
+        # count and seconds of the requests made
+        self.requests = 0
+        self.total_latency = 0.
+        self.max_latency = 0.
+
+    def snapshot(self, instruments):
+        """time and {instrument: {'buy': ask, 'sell': bid}} of instruments"""
+        start = time.perf_counter()
+        response = self.session.get(
+            self.url, timeout=self.timeout,
+            params={'instruments': ','.join(x.value for x in instruments)})
+        latency = time.perf_counter() - start
+        self.requests += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        response.raise_for_status()
+        body = response.json()
+        quotes = body['quotes']
+        prices = {}
+        for instr in instruments:
+            if instr.value not in quotes:
+                raise exceptions.PriceNotUpdated()
+            quote = quotes[instr.value]
+            prices[instr] = {'buy': quote['buy'], 'sell': quote['sell']}
+        LOGGER.debug("{} quotes in {:.4f}s".format(len(prices), latency))
+        return np.datetime64(body['time'], 'ms'), prices
+
+    def stats(self):
+        return {'requests': self.requests,
+                'mean_latency': self.total_latency / max(self.requests, 1),
+                'max_latency': self.max_latency}
+
+    def close(self):
+        self.session.close()
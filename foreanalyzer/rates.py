@@ -0,0 +1,119 @@
+"""
+foreanalyzer.rates
+~~~~~~~~~~~~~~~~~~
+
+Providers of EUR conversion rates used by positions.
+"""
+
+import abc
+import time
+
+import numpy as np
+import pandas as pd
+
+# logger
+import logging
+LOGGER = logging.getLogger("foreanalyzer.rates")
+
+
+class RateProvider(metaclass=abc.ABCMeta):
+    """rate of EUR in the quote currency of an instrument
+
+    Gains of a position on instrument are divided by this rate to get
+    EUR, `timestamp` is the time of the rate, None for the latest.
+    """
+
+    @abc.abstractmethod
+    def rate(self, instrument, timestamp=None):
+        pass
+
+
+class ForexPythonRates(RateProvider):
+    """live rates from forex_python, one request each"""
+
+    def __init__(self):
+        self._converter = None
+
+    @property
+    def converter(self):
+        """CurrencyRates, created on first use"""
+        if self._converter is None:
+            # imported here, offline runs never need it
+            from forex_python.converter import CurrencyRates
+            self._converter = CurrencyRates()
+        return self._converter
+
+    def rate(self, instrument, timestamp=None):
+        if timestamp is not None:
+            timestamp = pd.Timestamp(timestamp).to_pydatetime()
+        return self.converter.get_rate('EUR', instrument.value[3:], timestamp)
+
+
+class FixedRates(RateProvider):
+    """same rate for every instrument, no network"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def rate(self, instrument, timestamp=None):
+        return self.value
+
+
+class HistoricalRates(RateProvider):
+    """rates at a bar from instruments loaded in a DataHandler"""
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def rate(self, instrument, timestamp=None):
+        if timestamp is None:
+            # latest rate, after the last bar of any instrument
+            timestamp = np.datetime64('2262-01-01')
+        return float(self.rates(instrument, [timestamp])[0])
+
+    def rates(self, instrument, timestamps):
+        """array of rates at each of timestamps"""
+        return self.handler.conversion_rates(
+            instrument, np.asarray(timestamps, dtype='datetime64[ns]'))
+
+
+class CachedRates(RateProvider):
+    """keep rates of provider for `ttl` seconds
+
+    At most `max_entries` rates are kept, expired ones go first then the
+    oldest.
+    """
+
+    def __init__(self, provider, ttl=3600, max_entries=4096,
+                 clock=time.monotonic):
+        self.provider = provider
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def rate(self, instrument, timestamp=None):
+        key = (instrument, timestamp)
+        now = self.clock()
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > now:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        value = self.provider.rate(instrument, timestamp)
+        if key not in self.entries and len(self.entries) >= self.max_entries:
+            self._purge(now)
+        self.entries[key] = (now + self.ttl, value)
+        return value
+
+    def _purge(self, now):
+        for key in [x for x, y in self.entries.items() if y[0] <= now]:
+            del self.entries[key]
+        while len(self.entries) >= self.max_entries:
+            del self.entries[next(iter(self.entries))]
+
+    def clear(self):
+        self.entries.clear()
+
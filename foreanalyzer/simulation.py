@@ -5,28 +5,248 @@ foreanalyzer.simulation
 Store the simulation objects.
 """
 
-from foreanalyzer._internal_utils import ACC_CURRENCIES, read_config
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from foreanalyzer import exceptions
+from foreanalyzer._internal_utils import (ACC_CURRENCIES, INDEX_CURRENCIES,
+                                          read_config)
 from foreanalyzer.account import Account
 
 # logger
 import logging
 LOGGER = logging.getLogger("foreanalyzer.simulation")
 
+# swap is paid by positions open at 21:00 GMT
+ROLLOVER = np.timedelta64(21, 'h').astype('timedelta64[ns]').astype(np.int64)
+DAY = np.timedelta64(1, 'D').astype('timedelta64[ns]').astype(np.int64)
+
+
+def rollover_days(timestamps):
+    """number of the last rollover at or before timestamps (GMT)"""
+    stamps = np.asarray(timestamps, dtype='datetime64[ns]').astype(np.int64)
+    return (stamps - ROLLOVER) // DAY
+
+
+def nights(timestamps):
+    """rollovers passed since the previous of timestamps, 0 for the first"""
+    days = rollover_days(timestamps)
+    return np.diff(days, prepend=days[:1])
+
+
+def unrealized_series(journal, steps, asks, bids, initial=None):
+    """unrealized gain after each step from a journal of running sums
+
+    Journal rows are (step, instrument index, long exposure, short
+    exposure, long cost, short cost), the sums of the instrument from
+    that step on. `steps` is the instrument index of each step, priced
+    at asks and bids. Before the first price of an instrument in steps
+    its (ask, bid) in `initial` by instrument index is used.
+    """
+    total = np.zeros(len(steps))
+    if not len(journal):
+        return total
+    journal = np.asarray(journal, dtype=np.float64)
+    positions = np.arange(len(steps))
+    for index in np.unique(journal[:, 1]).astype(int):
+        rows = journal[journal[:, 1] == index]
+        # sums in force at each step, zero before the first change
+        state = np.searchsorted(rows[:, 0], positions, side='right') - 1
+        sums = np.vstack([np.zeros(4), rows[:, 2:]])[state + 1]
+        # last prices of the instrument at each step
+        last = np.maximum.accumulate(
+            np.where(steps == index, positions, -1))
+        ask, bid = (initial or {}).get(index, (0., 0.))
+        ask = np.where(last >= 0, asks[last], ask)
+        bid = np.where(last >= 0, bids[last], bid)
+        total += sums[:, 0] * ask - sums[:, 2] + sums[:, 3] - sums[:, 1] * bid
+    return total
+
 
 class AccountSimulated(Account):
     """simulation of account"""
 
-    def __init__(self):
-        self.config = read_config()
-        margin_mode = self.config['simulation']['margin_mode']
-        initial_funds = self.config['simulation']['initial_funds']
-        super().__init__(margin_mode, initial_funds)
-
-    def simulate(self, instrument, buy_ask_price, sell_bid_price):
-        """update price_couple in account"""
-        if instrument not in ACC_CURRENCIES:
-            raise ValueError("Instrument not accepted")
-        if instrument not in self.price_tables:
-            self.price_tables[instrument] = {}
-        self.price_tables[instrument]['buy'] = buy_ask_price
-        self.price_tables[instrument]['sell'] = sell_bid_price
+    def __init__(self, margin_mode=None, initial_funds=None, rates=None):
+        if margin_mode is None or initial_funds is None:
+            self.config = read_config()
+        else:
+            self.config = {'simulation': {'margin_mode': margin_mode,
+                                          'initial_funds': initial_funds}}
+        if margin_mode is None:
+            margin_mode = self.config['simulation']['margin_mode']
+        if initial_funds is None:
+            initial_funds = self.config['simulation']['initial_funds']
+        super().__init__(margin_mode, initial_funds, rates)
+        # last rollover seen by simulate
+        self.rollover = None
+
+    def simulate(self, instrument, buy_ask_price, sell_bid_price,
+                 timestamp=None):
+        """update price_couple in account, and its time if given
+
+        Positions open when timestamp passes a rollover pay their swap.
+        """
+        if timestamp is not None:
+            self.timestamp = timestamp
+            day = int(rollover_days(timestamp))
+            if self.rollover is not None and day > self.rollover and \
+                    self.positions:
+                self.accrue_swap(day - self.rollover)
+            self.rollover = day
+        price_couple = self.price_tables.get(instrument)
+        if price_couple is None:
+            # checked once, then the same dict is updated in place
+            if instrument not in ACC_CURRENCIES:
+                raise ValueError("Instrument not accepted")
+            price_couple = self.price_tables[instrument] = {}
+        price_couple['buy'] = buy_ask_price
+        price_couple['sell'] = sell_bid_price
+
+    def replay(self, feeds, on_step=None, events=None):
+        """step the account through prices of feeds, return its equity
+
+        `feeds` maps instrument to (timestamps, asks, bids) arrays, steps
+        of all instruments are merged by timestamp. After each step
+        on_step(account, instrument, index) is called, index in the
+        arrays of instrument. With sorted `events` timestamps on_step is
+        only called at the last step at or before each of them and the
+        steps in between are applied in vectorized chunks. Positions pay
+        swap at rollovers. Returns timestamp, instrument and equity after
+        each step, the replay stops on FundsExhausted.
+        """
+        instruments = list(feeds)
+        arrays = [[np.asarray(x) for x in feeds[instr]]
+                  for instr in instruments]
+        sizes = [len(x[0]) for x in arrays]
+        stamps = np.concatenate(
+            [x[0].astype('datetime64[ns]') for x in arrays])
+        order = np.argsort(stamps, kind='stable')
+        stamps = stamps[order]
+        local = np.repeat(np.arange(len(instruments)), sizes)[order]
+        indexes = np.concatenate([np.arange(x) for x in sizes])[order]
+        asks = np.concatenate([x[1] for x in arrays]).astype(np.float64)[
+            order]
+        bids = np.concatenate([x[2] for x in arrays]).astype(np.float64)[
+            order]
+        days = rollover_days(stamps)
+        # a feed from before the last rollover seen pays from its own start
+        nights = np.maximum(np.diff(
+            days, prepend=days[:1] if self.rollover is None
+            else self.rollover), 0)
+        # prices and running sums from before the replay
+        initial = {INDEX_CURRENCIES[x]: (y['buy'], y['sell'])
+                   for x, y in self.price_tables.items()}
+        self.journal = [
+            (-1, i) + tuple(self.book.exposure[i]) + tuple(self.book.cost[i])
+            for i in range(len(ACC_CURRENCIES)) if self.book.by_instrument[i]]
+        funds = np.zeros(len(stamps))
+        args = (instruments, stamps, local, indexes, asks, bids, nights,
+                funds)
+        try:
+            if on_step is not None and events is None:
+                end, exhausted = self._replay_steps(on_step, *args)
+            else:
+                calls = []
+                if on_step is not None:
+                    calls = np.searchsorted(
+                        stamps, np.asarray(events, dtype='datetime64[ns]'),
+                        'right') - 1
+                    calls = np.unique(calls[calls >= 0]).tolist()
+                end, exhausted = self._replay_chunks(on_step, calls, *args)
+        finally:
+            journal, self.journal = self.journal, None
+        if len(stamps) and end:
+            self.timestamp = stamps[end - 1]
+            self.rollover = int(days[end - 1])
+        steps = np.array([INDEX_CURRENCIES[x] for x in instruments])[local]
+        equity = funds[:end] + unrealized_series(
+            journal, steps[:end], asks[:end], bids[:end], initial)
+        if exhausted:
+            equity[-1] = 0.
+        return pd.DataFrame({
+            'timestamp': stamps[:end],
+            'instrument': np.array([x.value for x in instruments])[
+                local[:end]],
+            'equity': equity})
+
+    def _replay_steps(self, on_step, instruments, stamps, local, indexes,
+                      asks, bids, nights, funds):
+        """call on_step after every step, return steps done and if funds
+        were exhausted"""
+        simulate = self.simulate
+        rollovers = [x for x in np.flatnonzero(nights).tolist() if x]
+        steps = enumerate(zip(
+            np.array(instruments, dtype=object)[local].tolist(),
+            indexes.tolist(), asks.tolist(), bids.tolist(), stamps))
+        k = -1
+        try:
+            # days between rollovers are replayed without checks
+            for start, stop in zip([0] + rollovers,
+                                   rollovers + [len(stamps)]):
+                if nights[start] and self.positions:
+                    # paid before the step, which is the last if it fails
+                    k = start
+                    self.accrue_swap(int(nights[start]))
+                for k, (instr, j, ask, bid, stamp) in itertools.islice(
+                        steps, stop - start):
+                    simulate(instr, ask, bid)
+                    self.step = k
+                    self.timestamp = stamp
+                    on_step(self, instr, j)
+                    funds[k] = self.funds
+        except exceptions.FundsExhausted:
+            LOGGER.info("funds exhausted, replay stopped")
+            return k + 1, True
+        return k + 1, False
+
+    def _replay_chunks(self, on_step, calls, instruments, stamps, local,
+                       indexes, asks, bids, nights, funds):
+        """apply steps in chunks ending at calls, return steps done and
+        if funds were exhausted"""
+        chunks = [(x, True) for x in calls]
+        if not calls or calls[-1] < len(stamps) - 1:
+            chunks.append((len(stamps) - 1, False))
+        start = 0
+        for stop, call in chunks:
+            if stop < start:
+                continue
+            # swap of the chunk, running sums change only at calls
+            paid = np.cumsum(nights[start:stop + 1]) * self.swap()
+            funds[start:stop + 1] = self.funds + paid
+            over = np.flatnonzero(funds[start:stop + 1] < 0)
+            if len(over):
+                # as _replay_steps, prices up to the step before and the
+                # swap of the step raising FundsExhausted
+                failed = start + over[0]
+                self._simulate_last(instruments, local, asks, bids, start,
+                                    failed - 1)
+                try:
+                    self.pay_swap(paid[over[0]])
+                except exceptions.FundsExhausted:
+                    LOGGER.info("funds exhausted, replay stopped")
+                return failed + 1, True
+            if paid[-1]:
+                self.pay_swap(paid[-1])
+            self._simulate_last(instruments, local, asks, bids, start, stop)
+            self.timestamp = stamps[stop]
+            if call:
+                self.step = stop
+                try:
+                    on_step(self, instruments[local[stop]],
+                            int(indexes[stop]))
+                except exceptions.FundsExhausted:
+                    LOGGER.info("funds exhausted, replay stopped")
+                    return stop + 1, True
+                funds[stop] = self.funds
+            start = stop + 1
+        return len(stamps), False
+
+    def _simulate_last(self, instruments, local, asks, bids, start, stop):
+        """simulate the last prices of each instrument in steps start to
+        stop included"""
+        seen = local[start:stop + 1][::-1]
+        found, first = np.unique(seen, return_index=True)
+        for i, last in zip(found.tolist(), (stop - first).tolist()):
+            self.simulate(instruments[i], asks[last], bids[last])
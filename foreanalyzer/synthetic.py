@@ -0,0 +1,176 @@
+"""
+foreanalyzer.synthetic
+~~~~~~~~~~~~~~~~~~~~~~
+
+Synthetic HistData archives, minute bars of random walk prices.
+
+    $ python -m foreanalyzer.synthetic data --rows 1000000 [--seed 0]
+"""
+
+import argparse
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from foreanalyzer._internal_utils import ACC_CURRENCIES
+
+# logger
+import logging
+LOGGER = logging.getLogger("foreanalyzer.synthetic")
+
+HEADER = ['<TICKER>', '<DTYYYYMMDD>', '<TIME>', '<OPEN>', '<HIGH>', '<LOW>',
+          '<CLOSE>', '<VOL>']
+# first open of each instrument
+START_PRICES = {
+    'AUDUSD': 0.75, 'EURCHF': 1.15, 'EURGBP': 0.88, 'EURJPY': 130.,
+    'EURUSD': 1.15, 'GBPUSD': 1.30, 'USDCAD': 1.30, 'USDCHF': 0.99,
+    'USDJPY': 112.}
+# placeholder of the leading zeros, dropped from the text
+FILL = 0
+
+
+def is_open(minutes):
+    """market is closed from friday 22:00 to sunday 22:00 GMT
+
+    `minutes` are minutes from the epoch, a thursday.
+    """
+    days = minutes // 1440
+    weekday = (days + 3) % 7
+    hour = minutes % 1440 // 60
+    return ~(((weekday == 4) & (hour >= 22)) | (weekday == 5) |
+             ((weekday == 6) & (hour < 22)))
+
+
+def open_minutes(first, rows):
+    """`rows` open minutes from epoch minute first on, as int64"""
+    # a week has 5 open days out of 7
+    candidates = np.arange(first, first + rows * 7 // 5 + 7 * 1440,
+                           dtype=np.int64)
+    return candidates[is_open(candidates)][:rows]
+
+
+def make_bars(instrument, minutes, price, rand, volatility=1e-4):
+    """frame of bars at epoch minutes in HistData layout, first opening
+    at price"""
+    rows = len(minutes)
+    date = pd.DatetimeIndex((minutes // 1440).astype('datetime64[D]'))
+    clock = minutes % 1440
+    # log returns of the closes, each bar opens at the previous close
+    closes = price * np.exp(np.cumsum(rand.normal(0, volatility, rows)))
+    opens = np.concatenate(([price], closes[:-1]))
+    wicks = np.abs(rand.normal(0, volatility / 2, (2, rows))) * closes
+    decimals = 3 if instrument.value.endswith('JPY') else 5
+    return pd.DataFrame({
+        '<TICKER>': instrument.value,
+        '<DTYYYYMMDD>': date.year * 10000 + date.month * 100 + date.day,
+        '<TIME>': clock // 60 * 10000 + clock % 60 * 100,
+        '<OPEN>': opens.round(decimals),
+        '<HIGH>': (np.maximum(opens, closes) + wicks[0]).round(decimals),
+        '<LOW>': (np.minimum(opens, closes) - wicks[1]).round(decimals),
+        '<CLOSE>': closes.round(decimals),
+        '<VOL>': rand.randint(1, 10, rows)}, columns=HEADER)
+
+
+def to_csv(df, decimals):
+    """csv lines of a make_bars frame as bytes, no header
+
+    Rows are written as a matrix of ascii codes, columns of digits
+    computed at once on the whole frame, a python format per value would
+    be the bottleneck at millions of rows.
+    """
+    rows = len(df)
+    scale = 10 ** decimals
+    blocks = [np.frombuffer(df['<TICKER>'].iat[0].encode(), np.uint8)
+              .reshape(1, -1).repeat(rows, 0)]
+    for col, width in (('<DTYYYYMMDD>', 8), ('<TIME>', 6)):
+        blocks.append(_digits(df[col].values, width))
+    for col in HEADER[3:7]:
+        units = np.rint(df[col].values * scale).astype(np.int64)
+        blocks.append(_digits(units // scale, 5))
+        blocks.append(np.full((rows, 1), ord('.'), np.uint8))
+        blocks.append(_digits(units % scale, decimals, False))
+    blocks.append(_digits(df['<VOL>'].values, 2))
+    comma = np.full((rows, 1), ord(','), np.uint8)
+    lines = [blocks[0]]
+    for i, block in enumerate(blocks[1:]):
+        # no comma around the decimal points
+        if i < 2 or i % 3 == 2 or i == len(blocks) - 2:
+            lines.append(comma)
+        lines.append(block)
+    lines.append(np.full((rows, 1), ord('\n'), np.uint8))
+    text = np.concatenate(lines, axis=1).ravel()
+    return text[text != FILL].tobytes()
+
+
+def _digits(values, width, strip=True):
+    """ascii digits of non negative ints, right aligned on width columns,
+    leading zeros are FILL if strip"""
+    powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+    values = np.asarray(values, dtype=np.int64)[:, None]
+    out = (values // powers % 10 + ord('0')).astype(np.uint8)
+    if strip:
+        out[(values < powers) & (powers > 1)] = FILL
+    return out
+
+
+def write_zip(folder, instrument, rows, start='2001-01-02', seed=None,
+              chunksize=1000000, volatility=1e-4, compresslevel=1):
+    """write folder/<PAIR>.zip with rows minute bars, return its path
+
+    Bars are made and compressed `chunksize` at a time, memory does not
+    grow with rows. The archive is zip64, it can hold more than 4GB.
+    """
+    rand = np.random.RandomState(seed)
+    price = START_PRICES[instrument.value]
+    first = np.datetime64(start, 'm').astype(np.int64)
+    path = os.path.join(folder, instrument.value + '.zip')
+    decimals = 3 if instrument.value.endswith('JPY') else 5
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED,
+                         compresslevel=compresslevel) as zip_file:
+        with zip_file.open(instrument.value + '.txt', 'w',
+                           force_zip64=True) as member:
+            member.write((','.join(HEADER) + '\n').encode())
+            for done in range(0, rows, chunksize):
+                minutes = open_minutes(first, min(chunksize, rows - done))
+                df = make_bars(instrument, minutes, price, rand, volatility)
+                member.write(to_csv(df, decimals))
+                # next chunk opens at the last close
+                price = df['<CLOSE>'].iat[-1]
+                first = minutes[-1] + 1
+    LOGGER.debug("{} rows of {} written".format(rows, instrument.value))
+    return path
+
+
+def generate(folder, rows, instruments=None, start='2001-01-02', seed=None,
+             chunksize=1000000):
+    """write an archive for each of instruments (all if None)"""
+    if instruments is None:
+        instruments = list(ACC_CURRENCIES)
+    os.makedirs(folder, exist_ok=True)
+    seeds = np.random.RandomState(seed).randint(2 ** 31, size=len(instruments))
+    return [write_zip(folder, instr, rows, start, int(x), chunksize)
+            for instr, x in zip(instruments, seeds)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="write synthetic HistData archives")
+    parser.add_argument('folder')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--instruments', nargs='+',
+                        choices=[x.value for x in ACC_CURRENCIES])
+    parser.add_argument('--start', default='2001-01-02')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--chunksize', type=int, default=1000000)
+    args = parser.parse_args(argv)
+    instruments = None if args.instruments is None else \
+        [ACC_CURRENCIES[x] for x in args.instruments]
+    for path in generate(args.folder, args.rows, instruments, args.start,
+                         args.seed, args.chunksize):
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,10 @@ foreanalyzer.tables
 Contains the table fot spread, min, margin, swap, ....
 """
 
+import numpy as np
+
+from foreanalyzer._internal_utils import STR_CURRENCIES
+
 
 # currency store model
 class Currency(object):
@@ -30,3 +34,16 @@ CURRENCIES = {
     "USDCHF": Currency(0.00023, 2500, 0.0333, 0.0050, -0.000001, -0.000072),
     "USDJPY": Currency(0.01500, 2500, 0.0333, 0.0033, -0.001578, -0.005208)
 }
+
+
+# same values as a structured array, rows in the order of ACC_CURRENCIES
+CURRENCY_DTYPE = np.dtype([
+    ('spread', np.float64), ('min_quantity', np.int64),
+    ('stnd_margin', np.float64), ('pro_margin', np.float64),
+    ('long_swap', np.float64), ('short_swap', np.float64)])
+CURRENCY_TABLE = np.array(
+    [tuple(getattr(CURRENCIES[x], name) for name in CURRENCY_DTYPE.names)
+     for x in STR_CURRENCIES], dtype=CURRENCY_DTYPE)
+# swap fee for one night by instrument row, long then short
+SWAP_TABLE = np.column_stack(
+    [CURRENCY_TABLE['long_swap'], CURRENCY_TABLE['short_swap']])
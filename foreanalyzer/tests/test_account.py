@@ -6,9 +6,11 @@ Test account.
 """
 
 import time
+import numpy as np
 import pytest
 from foreanalyzer._internal_utils import ACC_CURRENCIES, MODE
-from foreanalyzer.account import Account, Position
+from foreanalyzer.account import Account, Position, PositionBook
+from foreanalyzer.rates import FixedRates
 from foreanalyzer.exceptions import FundsExhausted, OrderAborted
 from foreanalyzer.tables import CURRENCIES
 
@@ -125,3 +127,105 @@ def test_close_positon():
     LOGGER.debug("RESULT acc.funds - {}".format(acc.funds))
     assert acc.funds != funds
     LOGGER.debug("PASSED test_close_position")
+
+
+def test_PositionBook():
+    """test open, close and unrealized gain of the book"""
+    LOGGER.debug("RUN test_PositionBook")
+    book = PositionBook(capacity=2)
+    EURUSD, USDJPY = ACC_CURRENCIES.EURUSD, ACC_CURRENCIES.USDJPY
+    prices = {EURUSD: {'buy': 1.1302, 'sell': 1.1300},
+              USDJPY: {'buy': 113.05, 'sell': 113.02}}
+    orders = [(EURUSD, MODE.BUY, 5000, 1.1290, 1.13),
+              (EURUSD, MODE.SELL, 2500, 1.1310, 1.13),
+              (USDJPY, MODE.BUY, 3000, 112.90, 128.0),
+              (USDJPY, MODE.SELL, 4000, 113.50, 128.0)]
+    slots = [book.open(instr, mode, qty, price, conv, 10.)
+             for instr, mode, qty, price, conv in orders]
+    assert len(book) == 4 and book.capacity == 4
+    assert book.slots(EURUSD) == set(slots[:2])
+    assert book.total_used_funds == 40.
+    gains = [book.gain(x, prices[orders[i][0]]) for i, x in enumerate(slots)]
+    assert book.unrealized(EURUSD, prices[EURUSD]) == pytest.approx(
+        sum(gains[:2]))
+    assert book.unrealized(USDJPY, prices[USDJPY]) == pytest.approx(
+        sum(gains[2:]))
+    book.close(slots[0])
+    assert book.unrealized(EURUSD, prices[EURUSD]) == pytest.approx(gains[1])
+    # freed slot is reused
+    assert book.open(EURUSD, MODE.BUY, 5000, 1.1290, 1.13, 10.) == slots[0]
+    for slot in slots:
+        book.close(slot)
+    assert len(book) == 0
+    assert book.total_used_funds == 0
+    assert book.unrealized(EURUSD, prices[EURUSD]) == 0
+    with pytest.raises(ValueError):
+        book.close(slots[0])
+    LOGGER.debug("PASSED test_PositionBook")
+
+
+def test_running_sums():
+    """test aggregates of open positions and the trade ledger"""
+    LOGGER.debug("RUN test_running_sums")
+    acc = Account('beginner', 1000, rates=FixedRates(1.25))
+    EURUSD, GBPUSD = ACC_CURRENCIES.EURUSD, ACC_CURRENCIES.GBPUSD
+    acc.price_tables[EURUSD] = {'buy': 1.1302, 'sell': 1.1300}
+    acc.price_tables[GBPUSD] = {'buy': 1.3004, 'sell': 1.3000}
+    positions = [acc.make_order(MODE.BUY, EURUSD, 2500),
+                 acc.make_order(MODE.SELL, EURUSD, 5000),
+                 acc.make_order(MODE.BUY, GBPUSD, 2500)]
+    acc.price_tables[EURUSD] = {'buy': 1.1352, 'sell': 1.1350}
+    acc.price_tables[GBPUSD] = {'buy': 1.2904, 'sell': 1.2900}
+    assert acc.used_funds == pytest.approx(
+        sum(x.used_funds for x in positions))
+    assert acc.unrealized == pytest.approx(sum(x.gain for x in positions))
+    assert acc.exposure_of(EURUSD) == {'buy': 2500, 'sell': 5000}
+    gain = positions[1].gain
+    positions[1].close()
+    assert positions[1] not in acc.positions
+    assert acc.funds == pytest.approx(1000 + gain)
+    assert acc.exposure_of(EURUSD) == {'buy': 2500, 'sell': 0}
+    assert acc.unrealized == pytest.approx(
+        positions[0].gain + positions[2].gain)
+    with pytest.raises(ValueError):
+        positions[1].close()
+    positions[0].close()
+    positions[2].close()
+    assert acc.used_funds == 0 and acc.unrealized == 0
+    trades = acc.ledger.frame()
+    assert list(trades['instrument']) == ['EURUSD', 'EURUSD', 'GBPUSD']
+    assert list(trades['mode']) == ['sell', 'buy', 'buy']
+    assert acc.ledger.total_gain == pytest.approx(acc.funds - 1000)
+    LOGGER.debug("PASSED test_running_sums")
+
+
+@pytest.mark.parametrize("margin_mode", ["beginner", "pro"])
+def test_make_orders(margin_mode):
+    """test a batch gives the orders of make_order in a loop"""
+    LOGGER.debug("RUN test_make_orders")
+    rand = np.random.RandomState(0)
+    prices = {x: {'buy': CURRENCIES[x.value].spread + 1.1, 'sell': 1.1}
+              for x in ACC_CURRENCIES}
+    instruments = list(rand.choice(list(ACC_CURRENCIES), 200))
+    modes = list(rand.choice(list(MODE), 200))
+    quantities = list(rand.choice([1000, 2500, 5000, 40000], 200))
+    batch = Account(margin_mode, 1000, rates=FixedRates(1.25))
+    single = Account(margin_mode, 1000, rates=FixedRates(1.25))
+    batch.price_tables = prices
+    single.price_tables = prices
+    positions = batch.make_orders(modes, instruments, quantities)
+    for mode, instr, qty, pos in zip(modes, instruments, quantities,
+                                     positions):
+        try:
+            expected = single.make_order(mode, instr, qty)
+        except OrderAborted:
+            assert pos is None
+            continue
+        assert pos.quantity == expected.quantity
+        assert pos.used_funds == pytest.approx(expected.used_funds)
+    assert None in positions and len(batch.positions) > 10
+    assert batch.used_funds == pytest.approx(single.used_funds)
+    with pytest.raises(OrderAborted):
+        batch.make_orders(modes, instruments, quantities, strict=True)
+    assert len(batch.positions) == len(single.positions)
+    LOGGER.debug("PASSED test_make_orders")
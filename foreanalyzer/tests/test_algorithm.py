@@ -9,8 +9,12 @@ from io import StringIO
 
 import numpy as np
 import pandas as pd
+import pytest
 
-from foreanalyzer.algorithm import SMA, AlgorithmExample001
+from foreanalyzer._internal_utils import ACC_TIMEFRAMES
+from foreanalyzer.algorithm import (
+    ATR, EMA, MACD, RSI, SMA, WMA, AlgorithmExample001, BollingerBands,
+    Resample)
 from foreanalyzer.data_handler import normalize_df
 
 # logger
@@ -63,11 +67,171 @@ def test_SMA():
     sma_values = pd.Series(sma_values).dropna()
     calc_sma = pd.Series(calc_sma).dropna()
     for i in range(len(sma_values)):
-        assert sma_values.iloc[i] == calc_sma.iloc[i]
+        assert sma_values.iloc[i] == pytest.approx(calc_sma.iloc[i], rel=1e-12)
     LOGGER.debug(calc_sma.head())
     LOGGER.debug("PASSED test_SMA")
 
 
+def random_bars(rows=500, seed=0):
+    """random walk bars for indicators"""
+    rand = np.random.RandomState(seed)
+    close = 1.1 + np.cumsum(rand.normal(0, 1e-3, rows))
+    spread = np.abs(rand.normal(0, 5e-4, (2, rows)))
+    return pd.DataFrame({'open': np.roll(close, 1), 'high': close + spread[0],
+                         'low': close - spread[1], 'close': close})
+
+
+def naive_ema(values, alpha, min_periods):
+    result, ema = [], None
+    for i, val in enumerate(values):
+        ema = val if ema is None else ema + alpha * (val - ema)
+        result.append(ema if i + 1 >= min_periods else np.nan)
+    return result
+
+
+def naive_wilder(values, period):
+    """mean of the first period values, then (avg * (period - 1) + x) /
+    period"""
+    result = [np.nan] * (period - 1)
+    avg = sum(values[:period]) / period
+    result.append(avg)
+    for val in values[period:]:
+        avg = (avg * (period - 1) + val) / period
+        result.append(avg)
+    return result
+
+
+def naive_rsi(close, period):
+    gains = [max(b - a, 0) for a, b in zip(close[:-1], close[1:])]
+    losses = [max(a - b, 0) for a, b in zip(close[:-1], close[1:])]
+    avg_gain = naive_wilder(gains, period)
+    avg_loss = naive_wilder(losses, period)
+    return [np.nan] + [100 * g / (g + l) for g, l in zip(avg_gain, avg_loss)]
+
+
+def naive_wma(close, period):
+    weights = list(range(1, period + 1))
+    result = []
+    for i in range(len(close)):
+        if i + 1 < period:
+            result.append(np.nan)
+        else:
+            window = close[i + 1 - period:i + 1]
+            result.append(sum(w * x for w, x in zip(weights, window)) /
+                          sum(weights))
+    return result
+
+
+def naive_bollinger(close, period, width):
+    upper, lower = [], []
+    for i in range(len(close)):
+        if i + 1 < period:
+            upper.append(np.nan)
+            lower.append(np.nan)
+            continue
+        window = close[i + 1 - period:i + 1]
+        mean = sum(window) / period
+        std = (sum((x - mean) ** 2 for x in window) / period) ** 0.5
+        upper.append(mean + width * std)
+        lower.append(mean - width * std)
+    return upper, lower
+
+
+def naive_atr(high, low, close, period):
+    ranges = [high[0] - low[0]]
+    for i in range(1, len(close)):
+        ranges.append(max(high[i] - low[i], abs(high[i] - close[i - 1]),
+                          abs(low[i] - close[i - 1])))
+    return naive_wilder(ranges, period)
+
+
+def naive_macd(close, fast, slow, signal):
+    fast_ema = naive_ema(close, 2 / (fast + 1), 1)
+    slow_ema = naive_ema(close, 2 / (slow + 1), 1)
+    macd = [f - s for f, s in zip(fast_ema, slow_ema)][slow - 1:]
+    sig = naive_ema(macd, 2 / (signal + 1), signal)
+    pad = [np.nan] * (slow - 1)
+    return pad + macd, pad + sig
+
+
+def assert_series(values, expected):
+    np.testing.assert_allclose(np.asarray(values, dtype=float),
+                               np.asarray(expected, dtype=float),
+                               rtol=1e-9, atol=1e-12)
+
+
+@pytest.mark.parametrize("period", [1, 4, 15, 50])
+def test_indicators(period):
+    LOGGER.debug("RUN test_indicators with period {}".format(period))
+    df = random_bars()
+    close = list(df['close'])
+    high, low = list(df['high']), list(df['low'])
+    assert_series(SMA(period).eval(df)['sma'],
+                  [np.nan] * (period - 1) + [sum(close[i - period:i]) / period
+                                             for i in range(period, 501)])
+    assert_series(EMA(period).eval(df)['ema'],
+                  naive_ema(close, 2 / (period + 1), period))
+    assert_series(WMA(period).eval(df)['wma'], naive_wma(close, period))
+    assert_series(RSI(period).eval(df)['rsi'], naive_rsi(close, period))
+    upper, lower = naive_bollinger(close, period, 2)
+    BollingerBands(period).eval(df)
+    assert_series(df['bb_upper'], upper)
+    assert_series(df['bb_lower'], lower)
+    assert_series(df['bb_middle'], df['sma'])
+    assert_series(ATR(period).eval(df)['atr'],
+                  naive_atr(high, low, close, period))
+    macd, signal = naive_macd(close, period, 2 * period + 1, 9)
+    MACD(period, 2 * period + 1).eval(df)
+    assert_series(df['macd'], macd)
+    assert_series(df['macd_signal'], signal)
+    assert_series(df['macd_hist'], np.subtract(macd, signal))
+    LOGGER.debug("PASSED test_indicators with period {}".format(period))
+
+
+@pytest.mark.parametrize("tool,columns", [
+    (SMA(15), ['sma']), (EMA(15), ['ema']), (WMA(15), ['wma']),
+    (RSI(14), ['rsi']), (ATR(14), ['atr']),
+    (BollingerBands(20), ['bb_upper', 'bb_middle', 'bb_lower']),
+    (MACD(12, 26, 9), ['macd', 'macd_signal', 'macd_hist'])])
+def test_update(tool, columns):
+    LOGGER.debug("RUN test_update of {}".format(type(tool).__name__))
+    df = tool.eval(random_bars(2000))
+    tool.reset()
+    streamed = [tool.update(bar) for bar in df.to_dict('records')]
+    streamed = np.array(streamed).reshape(len(df), len(columns))
+    for i, col in enumerate(columns):
+        np.testing.assert_array_equal(streamed[:, i], df[col].values)
+    LOGGER.debug("PASSED test_update of {}".format(type(tool).__name__))
+
+
+@pytest.mark.parametrize("timeframe", [x for x in ACC_TIMEFRAMES])
+def test_Resample(timeframe):
+    LOGGER.debug("RUN test_Resample")
+    df = normalize_df(pd.read_csv(StringIO(csv_example.getvalue())), 1000)
+    bars = Resample(timeframe).eval(df)
+    # naive grouping on the bar opening time
+    freq = Resample.OFFSETS[timeframe]
+    groups = {}
+    for row in df.itertuples():
+        start = freq.rollback(row.timestamp.floor('D')) \
+            if freq.freqstr[0] in 'WM' else row.timestamp.floor(freq)
+        groups.setdefault(start, []).append(row)
+    assert list(bars['timestamp']) == sorted(groups)
+    for bar in bars.itertuples():
+        rows = groups[bar.timestamp]
+        assert bar.open == rows[0].open
+        assert bar.high == max(x.high for x in rows)
+        assert bar.low == min(x.low for x in rows)
+        assert bar.close == rows[-1].close
+    # replay bar by bar, the last bar is still open
+    resample = Resample(timeframe)
+    streamed = [resample.update(bar) for bar in df.to_dict('records')]
+    streamed = [x for x in streamed if x is not None] + [resample.current]
+    pd.testing.assert_frame_equal(pd.DataFrame(streamed), bars,
+                                  check_dtype=False)
+    LOGGER.debug("PASSED test_Resample")
+
+
 def test_feed():
     LOGGER.debug("RUN test_feed")
     algo = AlgorithmExample001()
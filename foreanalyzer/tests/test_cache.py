@@ -0,0 +1,114 @@
+"""
+tests.test_cache
+~~~~~~~~~~~~~~~~
+
+Test the cache module.
+"""
+
+import numpy as np
+import pandas as pd
+
+from foreanalyzer._internal_utils import ACC_CURRENCIES, ACC_TIMEFRAMES
+from foreanalyzer.algorithm import AlgorithmExample001, SMA, fix_timeframe
+from foreanalyzer import cache as cache_module
+from foreanalyzer.cache import IndicatorCache, data_key, size_of
+from foreanalyzer.data_handler import DataHandler
+from foreanalyzer.synthetic import generate
+
+# logger
+import logging
+LOGGER = logging.getLogger("foreanalyzer.tests.test_cache")
+LOGGER.info("TESTING test_cache.py module")
+
+
+def minute_data(rows=2000):
+    close = 1.1 + np.cumsum(np.random.RandomState(0).normal(0, 1e-4, rows))
+    return pd.DataFrame({
+        'timestamp': pd.date_range('2018-01-01', periods=rows, freq='min'),
+        'open': close, 'high': close, 'low': close, 'close': close})
+
+
+def test_hits_and_misses():
+    LOGGER.debug("RUN test_hits_and_misses")
+    cache = IndicatorCache()
+    data = minute_data()
+    key = data_key(ACC_CURRENCIES.EURUSD, data) + ('1h',)
+    calls = []
+
+    def build():
+        calls.append(1)
+        return fix_timeframe(data, ACC_TIMEFRAMES.ONE_HOUR)
+    bars = cache.get(key, build)
+    assert cache.get(key, build) is bars
+    assert len(calls) == 1
+    # sweep of periods over the same bars
+    for period in [5, 10, 5, 10]:
+        result = cache.eval(key, SMA(period), bars)
+        expected = SMA(period).eval(bars.copy())
+        pd.testing.assert_frame_equal(result, expected)
+    assert 'sma' not in bars.columns
+    assert cache.stats()['hits'] == 3
+    assert cache.stats()['misses'] == 3
+    LOGGER.debug("PASSED test_hits_and_misses")
+
+
+def test_lru_eviction():
+    LOGGER.debug("RUN test_lru_eviction")
+    data = minute_data()
+    size = size_of(data)
+    cache = IndicatorCache(max_bytes=2 * size)
+    cache.put('a', data)
+    cache.put('b', data.copy())
+    cache.get('a', lambda: None)  # a is now the most recent
+    cache.put('c', data.copy())
+    assert 'a' in cache and 'c' in cache
+    assert 'b' not in cache
+    assert cache.nbytes == 2 * size
+    # a value bigger than the budget is not stored
+    cache.put('d', pd.concat([data] * 3))
+    assert 'd' not in cache
+    assert len(cache) == 2
+    LOGGER.debug("PASSED test_lru_eviction")
+
+
+def test_same_span_other_data():
+    LOGGER.debug("RUN test_same_span_other_data")
+    algo = AlgorithmExample001(cache=IndicatorCache())
+    data = minute_data()
+    moved = data.assign(close=data['close'] + 0.2)
+    compact = data.astype({'close': np.float32})
+    keys = {data_key(ACC_CURRENCIES.EURUSD, x) for x in (data, moved, compact)}
+    assert len(keys) == 3
+    first = algo.prepare(ACC_CURRENCIES.EURUSD, data)
+    second = algo.prepare(ACC_CURRENCIES.EURUSD, moved)
+    np.testing.assert_allclose(second['sma'], first['sma'] + 0.2)
+    LOGGER.debug("PASSED test_same_span_other_data")
+
+
+def test_warm_prepare_skips_hash(tmp_path, monkeypatch):
+    LOGGER.debug("RUN test_warm_prepare_skips_hash")
+    hashed = []
+    digest = cache_module._digest
+
+    def counting(data):
+        hashed.append(len(data))
+        return digest(data)
+    monkeypatch.setattr(cache_module, '_digest', counting)
+    algo = AlgorithmExample001(cache=IndicatorCache())
+    data = minute_data()
+    first = algo.prepare(ACC_CURRENCIES.EURUSD, data)
+    second = algo.prepare(ACC_CURRENCIES.EURUSD, data)
+    pd.testing.assert_frame_equal(first, second)
+    assert hashed == [len(data)]
+    # a new frame of the same values is hashed again
+    algo.prepare(ACC_CURRENCIES.EURUSD, data.copy())
+    assert len(hashed) == 2
+    # frames of DataHandler are tagged by their source, never hashed
+    generate(str(tmp_path), 3000, [ACC_CURRENCIES.EURUSD], seed=0)
+    algo.DH = DataHandler(2000, folder=str(tmp_path))
+    algo.data = algo.DH.data
+    first = algo.prepare(ACC_CURRENCIES.EURUSD)
+    pd.testing.assert_frame_equal(algo.prepare(ACC_CURRENCIES.EURUSD), first)
+    assert len(hashed) == 2
+    assert len(algo.cache) == 4
+    LOGGER.debug("PASSED test_warm_prepare_skips_hash")
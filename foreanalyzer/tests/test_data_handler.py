@@ -6,13 +6,16 @@ Test the data_handler module.
 """
 
 import os
+import zipfile
+from io import StringIO
 import pytest
 
 import pandas as pd
 
 from foreanalyzer._internal_utils import (ACC_CURRENCIES, FOLDER_PATH,
                                           OUTER_FOLDER_PATH, unzip_data)
-from foreanalyzer.data_handler import DataHandler, ZipFeeder
+from foreanalyzer.data_handler import (DataHandler, ZipFeeder, normalize_df,
+                                       read_csv_tail, read_stream_tail)
 
 # logger
 import logging
@@ -21,6 +24,13 @@ LOGGER.info("TESTING test_data_handler.py module")
 
 OUTER_FOLDER_PATH = os.path.join(OUTER_FOLDER_PATH, 'data')
 RANGE_OF_VALUES = 10000
+CSV_EXAMPLE = '''<TICKER>,<DTYYYYMMDD>,<TIME>,<OPEN>,<HIGH>,<LOW>,<CLOSE>,<VOL>
+EURUSD,20010102,230100,0.9507,0.9507,0.9507,0.9507,4
+EURUSD,20010102,230200,0.9506,0.9506,0.9505,0.9505,4
+EURUSD,20010102,230300,0.9505,0.9507,0.9505,0.9506,4
+EURUSD,20010103,5000,0.9495,0.9496,0.9495,0.9496,4
+EURUSD,20010103,5100,0.9496,0.9496,0.9496,0.9496,4
+'''
 
 
 def cleaning():
@@ -31,6 +41,14 @@ def cleaning():
     LOGGER.debug("cleaning completed...")
 
 
+def make_zip(folder, instr, text=CSV_EXAMPLE):
+    """write a HistData like archive in folder"""
+    path = os.path.join(str(folder), instr.value + '.zip')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr(instr.value + '.txt', text)
+    return path
+
+
 def test_unzip_data():
     """extract and test again"""
     LOGGER.debug("RUN test_unzip_data")
@@ -92,3 +110,187 @@ def test_loadedData_unload():
         assert instr.value not in handle.data.keys()
     LOGGER.debug("PASSED test_loadedData_unload")
     cleaning()
+
+
+def test_normalize_df():
+    LOGGER.debug("RUN test_normalize_df")
+    csv = StringIO('''<TICKER>,<DTYYYYMMDD>,<TIME>,<OPEN>,<HIGH>,<LOW>,<CLOSE>,<VOL>
+EURUSD,20010102,230100,0.9507,0.9507,0.9507,0.9507,4
+EURUSD,20010103,5000,0.9495,0.9496,0.9495,0.9496,4
+EURUSD,20040229,000059,0.9496,0.9496,0.9496,0.9496,4
+EURUSD,20181231,235900,0.9495,0.9495,0.9495,0.9495,4''')
+    data = normalize_df(pd.read_csv(csv), 3)
+    assert list(data.columns) == ['timestamp', 'open', 'high', 'low', 'close']
+    assert len(data) == 3
+    expected = [pd.Timestamp('2001-01-03 00:50:00'),
+                pd.Timestamp('2004-02-29 00:00:59'),
+                pd.Timestamp('2018-12-31 23:59:00')]
+    assert list(data['timestamp']) == expected
+    # old keyword still accepted
+    csv.seek(0)
+    with pytest.warns(DeprecationWarning):
+        again = normalize_df(pd.read_csv(csv), 3, time_of_log=10)
+    pd.testing.assert_frame_equal(again, data)
+    LOGGER.debug("PASSED test_normalize_df")
+
+
+def test_cache(tmp_path):
+    LOGGER.debug("RUN test_cache")
+    EURUSD = ACC_CURRENCIES.EURUSD
+    make_zip(tmp_path, EURUSD)
+    handle = DataHandler(3, folder=str(tmp_path))
+    data = handle.load_data(EURUSD)
+    cleaning()
+    # second load never touches the zip or the csv
+    cached = handle.cache.load(EURUSD, handle.feeder.source(EURUSD))
+    assert cached is not None
+    assert len(cached) == 5
+    warm = DataHandler(3, folder=str(tmp_path)).load_data(EURUSD)
+    assert not os.path.isfile(os.path.join(FOLDER_PATH, 'data', 'EURUSD.csv'))
+    pd.testing.assert_frame_equal(data.reset_index(drop=True),
+                                  warm.reset_index(drop=True))
+    # a new zip makes the entry stale
+    make_zip(tmp_path, EURUSD, CSV_EXAMPLE.replace('0.9496,4', '0.9400,4'))
+    os.utime(handle.feeder.source(EURUSD), ns=(0, 0))
+    assert handle.cache.load(EURUSD, handle.feeder.source(EURUSD)) is None
+    handle.rebuild_cache(EURUSD)
+    cleaning()
+    assert handle.load_data(EURUSD)['close'].iloc[-1] == 0.94
+    handle.invalidate_cache()
+    assert handle.cache.load(EURUSD, handle.feeder.source(EURUSD)) is None
+    LOGGER.debug("PASSED test_cache")
+
+
+def test_ZipFeeder_stream(tmp_path):
+    LOGGER.debug("RUN test_ZipFeeder_stream")
+    EURUSD = ACC_CURRENCIES.EURUSD
+    make_zip(tmp_path, EURUSD)
+    streamed = ZipFeeder(str(tmp_path), stream=True, chunksize=2)
+    data = streamed.read_single(EURUSD, 4)
+    path = os.path.join(FOLDER_PATH, 'data', 'EURUSD.csv')
+    assert not os.path.isfile(path)
+    extracted = ZipFeeder(str(tmp_path)).read_single(EURUSD, 4)
+    assert os.path.isfile(path)
+    pd.testing.assert_frame_equal(data, extracted)
+    LOGGER.debug("PASSED test_ZipFeeder_stream")
+    cleaning()
+
+
+@pytest.mark.parametrize("rows", [1, 2, 5, 10])
+def test_read_csv_tail(tmp_path, rows):
+    LOGGER.debug("RUN test_read_csv_tail")
+    path = os.path.join(str(tmp_path), 'EURUSD.csv')
+    with open(path, 'w') as f:
+        f.write(CSV_EXAMPLE)
+    expected = pd.read_csv(path).iloc[-rows:].reset_index(drop=True)
+    # blocks starting on a line start or in the middle of it
+    for block_size in range(1, len(CSV_EXAMPLE) + 2):
+        tail = read_csv_tail(path, rows, block_size=block_size)
+        pd.testing.assert_frame_equal(tail, expected)
+        with open(path, 'rb') as f:
+            tail = read_stream_tail(f, rows, block_size=block_size)
+        pd.testing.assert_frame_equal(tail, expected)
+    # stream mode parses only the tail of the archive member
+    make_zip(tmp_path, ACC_CURRENCIES.EURUSD)
+    feeder = ZipFeeder(str(tmp_path), stream=True, chunksize=2)
+    data = feeder.read_single(ACC_CURRENCIES.EURUSD, rows)
+    assert len(data) == min(rows, 5)
+    assert data['close'].iloc[0] == expected['<CLOSE>'].iloc[0]
+    LOGGER.debug("PASSED test_read_csv_tail")
+
+
+@pytest.mark.parametrize("use_cache", [True, False])
+def test_loadedData_parallel(tmp_path, use_cache):
+    LOGGER.debug("RUN test_loadedData_parallel")
+    for instr in ACC_CURRENCIES:
+        make_zip(tmp_path, instr, CSV_EXAMPLE.replace('EURUSD', instr.value))
+    handle = DataHandler(3, folder=str(tmp_path), use_cache=use_cache)
+    data = handle.get_data(workers=3)
+    sequential = DataHandler(3, folder=str(tmp_path), use_cache=False)
+    expected = sequential.get_data(workers=1)
+    assert data is handle.data
+    for instr in ACC_CURRENCIES:
+        pd.testing.assert_frame_equal(data[instr.value],
+                                      expected[instr.value])
+    LOGGER.debug("PASSED test_loadedData_parallel")
+
+
+def test_loadedData_compact(tmp_path):
+    LOGGER.debug("RUN test_loadedData_compact")
+    make_zip(tmp_path, ACC_CURRENCIES.EURUSD)
+    full = DataHandler(5, folder=str(tmp_path), use_cache=False)
+    compact = DataHandler(5, folder=str(tmp_path), use_cache=False,
+                          compact=True)
+    df = full.load_data(ACC_CURRENCIES.EURUSD)
+    small = compact.load_data(ACC_CURRENCIES.EURUSD)
+    assert small['close'].dtype == 'float32'
+    assert small['timestamp'].dtype == 'datetime64[ns]'
+    assert (small['timestamp'] == df['timestamp']).all()
+    assert abs(small['close'] - df['close']).max() < 1e-6
+    assert compact.memory_stats()['resident_bytes'] < \
+        full.memory_stats()['resident_bytes']
+    LOGGER.debug("PASSED test_loadedData_compact")
+
+
+def test_loadedData_budget(tmp_path):
+    LOGGER.debug("RUN test_loadedData_budget")
+    instrs = list(ACC_CURRENCIES)[:3]
+    for instr in instrs:
+        make_zip(tmp_path, instr, CSV_EXAMPLE.replace('EURUSD', instr.value))
+    handle = DataHandler(5, folder=str(tmp_path), use_cache=False)
+    handle.load_data(instrs[0])
+    size = handle.memory_stats()['resident_bytes']
+    # room for two frames
+    handle.data.max_bytes = size * 2
+    handle.load_data(instrs[1])
+    handle.data[instrs[0].value]
+    handle.load_data(instrs[2])
+    # the least recently used went away
+    assert list(handle.data) == [instrs[0].value, instrs[2].value]
+    stats = handle.memory_stats()
+    assert stats['evictions'] == 1
+    assert stats['resident_bytes'] == size * 2
+    assert set(stats['instruments']) == {instrs[0].value, instrs[2].value}
+    handle.unload_data(instrs[0])
+    assert list(handle.data) == [instrs[2].value]
+    assert handle.memory_stats()['resident_bytes'] == size
+    handle.unload_data()
+    assert handle.memory_stats()['resident_bytes'] == 0
+    LOGGER.debug("PASSED test_loadedData_budget")
+
+
+def test_loadedData_mmap(tmp_path):
+    LOGGER.debug("RUN test_loadedData_mmap")
+    source = make_zip(tmp_path, ACC_CURRENCIES.EURUSD)
+    private = DataHandler(3, folder=str(tmp_path))
+    expected = private.load_data(ACC_CURRENCIES.EURUSD)
+    # the dataset is opened without its zip
+    os.remove(source)
+    handle = DataHandler(3, folder=str(tmp_path), mmap=True)
+    df = handle.load_data(ACC_CURRENCIES.EURUSD)
+    pd.testing.assert_frame_equal(df, expected)
+    assert not df['close'].values.flags.writeable
+    stats = handle.memory_stats()
+    assert stats['mapped_bytes'] == df['close'].values.nbytes * df.shape[1]
+    # only the index is private
+    assert stats['resident_bytes'] == df.index.memory_usage()
+    with pytest.raises(ValueError):
+        DataHandler(3, folder=str(tmp_path), use_cache=False, mmap=True)
+    LOGGER.debug("PASSED test_loadedData_mmap")
+
+
+def test_loadedData_mmap_rebuild(tmp_path):
+    LOGGER.debug("RUN test_loadedData_mmap_rebuild")
+    make_zip(tmp_path, ACC_CURRENCIES.EURUSD)
+    handle = DataHandler(3, folder=str(tmp_path), mmap=True)
+    old = handle.load_data(ACC_CURRENCIES.EURUSD)
+    expected = old.copy()
+    # new data, one row less, rebuilds the entry under the old frame
+    make_zip(tmp_path, ACC_CURRENCIES.EURUSD,
+             CSV_EXAMPLE.replace('0.9496,4\n', '0.9499,4\n', 1)
+             .rsplit('\n', 2)[0] + '\n')
+    other = DataHandler(3, folder=str(tmp_path), mmap=True)
+    new = other.load_data(ACC_CURRENCIES.EURUSD)
+    assert new['close'].iloc[-1] == 0.9499
+    pd.testing.assert_frame_equal(old, expected)
+    LOGGER.debug("PASSED test_loadedData_mmap_rebuild")
@@ -5,7 +5,184 @@ tests.test_engine
 Test the engine module.
 """
 
+import numpy as np
+import pandas as pd
+import pytest
+
+from foreanalyzer._internal_utils import ACC_CURRENCIES, ACC_TIMEFRAMES, MODE
+from foreanalyzer.algorithm import AbstractAlgorithm, AlgorithmExample001
+from foreanalyzer.data_handler import DataHandler
+from foreanalyzer.engine import EngineBridge, vector_backtest
+from foreanalyzer.simulation import nights
+from foreanalyzer.synthetic import write_zip
+from foreanalyzer.tables import CURRENCIES
+
 # logger
 import logging
 LOGGER = logging.getLogger("foreanalyzer.tests.test_engine")
 LOGGER.info("TESTING test_engine.py module")
+
+
+def naive_backtest(close, position, spread, conv_rate, funds):
+    """fill every trade at bid or ask, value units at mid price"""
+    cash, units, equity = 0., 0., []
+    for price, target in zip(close, position):
+        trade = target - units
+        fill = price + spread / 2 if trade > 0 else price - spread / 2
+        cash -= trade * fill
+        units = target
+        equity.append(funds + (cash + units * price) / conv_rate)
+    return equity
+
+
+@pytest.mark.parametrize("conv_rate", [1., 1.25])
+def test_vector_backtest(conv_rate):
+    LOGGER.debug("RUN test_vector_backtest")
+    rand = np.random.RandomState(1)
+    close = 1.1 + np.cumsum(rand.normal(0, 1e-3, 1000))
+    position = rand.choice([-5000, 0, 2500, 5000], 1000)
+    result = vector_backtest(close, position, 0.0002, 0.0333, conv_rate, 1000)
+    expected = naive_backtest(close, position, 0.0002, conv_rate, 1000)
+    np.testing.assert_allclose(result['equity'], expected, rtol=1e-12)
+    np.testing.assert_allclose(
+        result['used_funds'], 0.0333 * np.abs(position) / conv_rate * close)
+    LOGGER.debug("PASSED test_vector_backtest")
+
+
+def test_vector_backtest_swap():
+    LOGGER.debug("RUN test_vector_backtest_swap")
+    stamps = pd.date_range('2018-01-01 18:00', periods=8, freq='6h')
+    position = np.array([2500, 2500, -5000, -5000, -5000, 5000, 5000, 0])
+    close = np.full(8, 1.1)
+    result = vector_backtest(close, position, 0., 0.0333, 1.25, 1000,
+                             nights(stamps), (-0.0001, 0.00002))
+    # rollovers of the 1st and of the 2nd, long 2500 then short 5000
+    expected = np.zeros(8)
+    expected[1] = 2500 * -0.0001 / 1.25
+    expected[5] = 5000 * 0.00002 / 1.25
+    np.testing.assert_allclose(result['swap'], expected)
+    np.testing.assert_allclose(result['pnl'], expected)
+    LOGGER.debug("PASSED test_vector_backtest_swap")
+
+
+def test_backtest(tmp_path):
+    LOGGER.debug("RUN test_backtest")
+    write_zip(str(tmp_path), ACC_CURRENCIES.EURUSD, 5000, '2018-01-01', 0)
+    engine = EngineBridge(5000, 'beginner', 1000)
+    engine.handler = DataHandler(5000, folder=str(tmp_path))
+    algo = AlgorithmExample001()
+    algo.DH = engine.handler
+    algo.data = algo.DH.data
+    result = engine.backtest(algo)['EURUSD']
+    frame = result.frame
+    assert len(frame) == 5000 // 60 + 1 - 14
+    assert set(np.abs(frame['position'])) <= {0, 2500}
+    # results of each bar converted with the EURUSD rate of the bar
+    spread = CURRENCIES['EURUSD'].spread
+    quote = naive_backtest(frame['close'], frame['position'], spread, 1., 0.)
+    conv_rate = engine.handler.conversion_rates(
+        ACC_CURRENCIES.EURUSD, frame['timestamp'].values)
+    np.testing.assert_allclose((frame['pnl'] - frame['swap']) * conv_rate,
+                               np.diff(quote, prepend=0.), atol=1e-12)
+    # 5000 minutes from midnight pass three rollovers
+    assert np.count_nonzero(frame['swap']) <= 3
+    assert result.final_equity == pytest.approx(1000 + frame['pnl'].sum())
+    assert result.trades > 0
+    assert result.max_drawdown >= 0
+    assert result.margin_call is None
+    LOGGER.debug("PASSED test_backtest")
+
+
+def test_replay(tmp_path):
+    LOGGER.debug("RUN test_replay")
+    for seed, instr in enumerate((ACC_CURRENCIES.EURUSD,
+                                  ACC_CURRENCIES.GBPUSD)):
+        write_zip(str(tmp_path), instr, 5000, '2018-01-01', seed)
+    engine = EngineBridge(5000, 'beginner', 1000)
+    engine.handler = DataHandler(5000, folder=str(tmp_path))
+    algo = AlgorithmExample001()
+    algo.accepted_instruments.append(ACC_CURRENCIES.GBPUSD)
+    algo.quantity[ACC_CURRENCIES.GBPUSD] = 2500
+    algo.DH = engine.handler
+    algo.data = algo.DH.data
+    frame = engine.replay(algo)
+    assert len(frame) == 2 * (5000 // 60 + 1 - 14)
+    assert (np.diff(frame['timestamp'].values) >= np.timedelta64(0)).all()
+    assert list(frame['instrument'][:2]) == ['EURUSD', 'GBPUSD']
+    # one position per instrument, on the side of the last signal
+    for instr in algo.accepted_instruments:
+        slots = engine.book.slots(instr)
+        assert len(slots) == 1
+        bars = engine.arrays[instr]
+        side = 0 if bars['close'][-1] > bars['sma'][-1] else 1
+        assert engine.book.side[list(slots)[0]] == side
+    gains = sum(engine.book.gain(x, engine.account.price_tables[instr])
+                for instr in algo.accepted_instruments
+                for x in engine.book.slots(instr))
+    assert frame['equity'].iloc[-1] == pytest.approx(
+        engine.account.funds + gains)
+    assert engine.account.funds != 1000
+    assert engine.account.swap_paid > 0
+    assert engine.account.ledger.total_gain == pytest.approx(
+        engine.account.funds - 1000 + engine.account.swap_paid)
+    # trades are stamped with the bars of open and close
+    trades = engine.account.ledger.frame()
+    assert len(trades) and not trades[['opened', 'closed']].isna().any(
+        axis=None)
+    assert (trades['opened'] < trades['closed']).all()
+    assert trades['closed'].isin(frame['timestamp']).all()
+    LOGGER.debug("PASSED test_replay")
+
+
+class CrossOrder(AbstractAlgorithm):
+    """on bar 5 of EURUSD buy GBPUSD"""
+
+    def __init__(self, bars):
+        super().__init__(ACC_TIMEFRAMES.ONE_HOUR, list(bars), 1, 10)
+        self.bars = bars
+        self.slot = None
+        self.state = None
+
+    def feed(self):
+        pass
+
+    def prepare(self, instr, data=None):
+        return self.bars[instr]
+
+    def analyse(self):
+        pass
+
+    def on_bar(self, engine, instr, index):
+        if instr is ACC_CURRENCIES.EURUSD and index == 5:
+            self.slot = engine.open(MODE.BUY, ACC_CURRENCIES.GBPUSD, 2500)
+        if instr is ACC_CURRENCIES.EURUSD and index == 8:
+            account = engine.account
+            self.state = (len(account.positions), account.used_funds,
+                          account.free_funds)
+
+
+def test_replay_cross_instrument():
+    LOGGER.debug("RUN test_replay_cross_instrument")
+
+    def bars(start, close):
+        return pd.DataFrame({
+            'timestamp': pd.date_range(start, periods=len(close), freq='h'),
+            'open': close, 'high': close, 'low': close, 'close': close})
+
+    data = {ACC_CURRENCIES.EURUSD: bars('2018-01-01',
+                                        1.1 + 0.01 * np.arange(10)),
+            ACC_CURRENCIES.GBPUSD: bars('2018-01-01 00:30',
+                                        np.array([1.3, 1.31, 1.32]))}
+    engine = EngineBridge(10, 'beginner', 1000)
+    engine.handler.data['EURUSD'] = data[ACC_CURRENCIES.EURUSD]
+    algo = CrossOrder(data)
+    engine.replay(algo)
+    # rate of the last GBPUSD bar, 02:30, is the EURUSD close of 02:00
+    assert engine.book.conv_rate[algo.slot] == pytest.approx(1.12)
+    assert engine.book.target_price[algo.slot] == pytest.approx(
+        1.32 + CURRENCIES['GBPUSD'].spread / 2)
+    # the position is on the account while replaying
+    used_funds = engine.book.used_funds[algo.slot]
+    assert used_funds > 0
+    assert algo.state == (1, used_funds, engine.account.funds - used_funds)
+    LOGGER.debug("PASSED test_replay_cross_instrument")
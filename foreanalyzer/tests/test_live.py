@@ -0,0 +1,136 @@
+"""
+tests.test_live
+~~~~~~~~~~~~~~~
+
+Test the live module on a virtual clock.
+"""
+
+import asyncio
+import json
+
+import numpy as np
+import pandas as pd
+
+from foreanalyzer._internal_utils import ACC_CURRENCIES, ACC_TIMEFRAMES
+from foreanalyzer.algorithm import AlgorithmExample001
+from foreanalyzer.live import FakeQuoteSource, LiveFeed
+from foreanalyzer.rates import FixedRates
+from foreanalyzer.simulation import AccountSimulated
+
+# logger
+import logging
+LOGGER = logging.getLogger("foreanalyzer.tests.test_live")
+LOGGER.info("TESTING test_live.py module")
+
+INSTRUMENTS = [ACC_CURRENCIES.EURUSD, ACC_CURRENCIES.GBPUSD]
+
+
+class VirtualClock(object):
+    """time that passes only sleeping"""
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    async def sleep(self, delay):
+        self.now += delay
+        await asyncio.sleep(0)
+
+
+class Recorder(AlgorithmExample001):
+    """keep the bars given by the feed"""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.decided = []
+
+    def on_live_bar(self, feed, instr, bar):
+        self.decided.append((instr, bar['timestamp']))
+        super().on_live_bar(feed, instr, bar)
+
+
+def run_feed(interval, bars, timeframe=ACC_TIMEFRAMES.ONE_MINUTE):
+    # 30 seconds after a minute boundary, a thursday
+    clock = VirtualClock(1541678430.)
+    algo = Recorder(timeframe, INSTRUMENTS, 3)
+    source = FakeQuoteSource(clock.time, seed=0)
+    account = AccountSimulated('beginner', 1000, FixedRates(1.25))
+    feed = LiveFeed(algo, source, account, interval, clock.time, clock.sleep)
+    asyncio.run(feed.run(bars))
+    return clock, algo, source, feed
+
+
+def test_LiveFeed(tmp_path):
+    LOGGER.debug("RUN test_LiveFeed")
+    clock, algo, source, feed = run_feed(10., 20)
+    # stops at the 20th boundary, the first 30 seconds after the start
+    assert clock.now == 1541678460. + 19 * 60
+    # polls every 10 seconds, all instruments in each
+    assert source.requests == feed.polls == 3 + 19 * 6
+    for instr in INSTRUMENTS:
+        bars = pd.DataFrame(feed.bars[instr])
+        assert len(bars) == 20
+        # bars open on minutes, one each
+        stamps = bars['timestamp'].values.astype('datetime64[s]')
+        assert (np.diff(stamps) == np.timedelta64(60, 's')).all()
+        assert stamps[0].astype(np.int64) % 60 == 0
+        assert (bars['high'] >= bars['low']).all()
+    metrics = feed.metrics()
+    assert metrics['wake_delay']['max'] == 0
+    assert metrics['orders'] > 0
+    assert metrics['decision_latency']['count'] == metrics['orders']
+    assert algo.live_positions
+    path = str(tmp_path / 'metrics.json')
+    feed.export(path)
+    with open(path) as f:
+        assert json.load(f)['orders'] == metrics['orders']
+    LOGGER.debug("RESULT metrics - {}".format(metrics))
+    LOGGER.debug("PASSED test_LiveFeed")
+
+
+def test_LiveFeed_slow_poll():
+    LOGGER.debug("RUN test_LiveFeed_slow_poll")
+    # a poll every 90 seconds leaves minutes without quotes
+    clock, algo, source, feed = run_feed(90., 10)
+    for instr in INSTRUMENTS:
+        stamps = [x['timestamp'] for x in feed.bars[instr]]
+        assert len(stamps) == len(set(stamps))
+    assert feed.metrics()['wake_delay']['count'] == 10
+    LOGGER.debug("PASSED test_LiveFeed_slow_poll")
+
+
+def test_LiveFeed_week():
+    LOGGER.debug("RUN test_LiveFeed_week")
+    clock, algo, source, feed = run_feed(6 * 3600., 4, ACC_TIMEFRAMES.ONE_WEEK)
+    # wakes on mondays, the fourth on 3 december
+    assert clock.now == pd.Timestamp('2018-12-03').value / 1e9
+    for instr in INSTRUMENTS:
+        stamps = [x['timestamp'] for x in feed.bars[instr]]
+        assert stamps == list(pd.date_range('2018-11-05', periods=4,
+                                            freq='7D'))
+        assert [x[1] for x in algo.decided if x[0] is instr] == stamps
+    LOGGER.debug("PASSED test_LiveFeed_week")
+
+
+def test_LiveFeed_catch_up():
+    LOGGER.debug("RUN test_LiveFeed_catch_up")
+    clock, algo, source, feed = run_feed(10., 2)
+    algo.decided.clear()
+    # bars closed while the feed was not woken
+    last = feed.bars[INSTRUMENTS[0]][-1]
+    for instr in INSTRUMENTS:
+        for i in (1, 2, 3):
+            feed.bars[instr].append(dict(
+                last, timestamp=last['timestamp'] + pd.Timedelta(minutes=i)))
+    feed.wake(clock.now + 240, clock.now + 240)
+    stamps = [last['timestamp'] + pd.Timedelta(minutes=i) for i in (1, 2, 3)]
+    assert algo.decided == [(instr, x) for x in stamps
+                            for instr in INSTRUMENTS]
+    # history is bounded
+    feed = LiveFeed(algo, source, feed.account, history=2)
+    for bar in stamps:
+        feed.bars[INSTRUMENTS[0]].append({'timestamp': bar})
+    assert len(feed.bars[INSTRUMENTS[0]]) == 2
+    LOGGER.debug("PASSED test_LiveFeed_catch_up")
@@ -0,0 +1,95 @@
+"""
+tests.test_metrics
+~~~~~~~~~~~~~~~~~~
+
+Test the metrics module.
+"""
+
+import json
+
+import pytest
+
+from foreanalyzer._internal_utils import ACC_CURRENCIES, MODE
+from foreanalyzer.account import Account
+from foreanalyzer.algorithm import AlgorithmExample001
+from foreanalyzer.cache import IndicatorCache
+from foreanalyzer.data_handler import DataHandler
+from foreanalyzer.metrics import NULL_STAGE, REGISTRY, Registry
+from foreanalyzer.rates import FixedRates
+from foreanalyzer.synthetic import generate
+
+# logger
+import logging
+LOGGER = logging.getLogger("foreanalyzer.tests.test_metrics")
+LOGGER.info("TESTING test_metrics.py module")
+
+
+@pytest.fixture(scope="function")
+def registry():
+    REGISTRY.reset()
+    REGISTRY.enable(memory=True)
+    yield REGISTRY
+    REGISTRY.disable()
+    REGISTRY.reset()
+
+
+def test_Registry():
+    LOGGER.debug("RUN test_Registry")
+    reg = Registry()
+    # disabled nothing is kept
+    assert reg.stage('parse') is NULL_STAGE
+    with reg.stage('parse') as stage:
+        stage.rows_out = 10
+    reg.count('ticks')
+    assert reg.snapshot() == {'stages': {}, 'counters': {}}
+    reg.enable()
+    for rows in (10, 20):
+        with reg.stage('parse', rows) as stage:
+            stage.rows_out = rows // 2
+    reg.count('ticks', 3)
+    stats = reg.get('parse')
+    assert stats['calls'] == 2
+    assert stats['rows_in'] == 30 and stats['rows_out'] == 15
+    assert 0 < stats['max_seconds'] <= stats['seconds']
+    assert reg.get('missing') is None
+    text = reg.prometheus()
+    assert '# TYPE foreanalyzer_stage_seconds_total counter' in text
+    assert 'foreanalyzer_stage_rows_in_total{stage="parse"} 30' in text
+    assert 'foreanalyzer_events_total{name="ticks"} 3' in text
+    # a failing block is recorded too
+    with pytest.raises(ValueError):
+        with reg.stage('parse'):
+            raise ValueError()
+    assert reg.get('parse')['calls'] == 3
+    LOGGER.debug("PASSED test_Registry")
+
+
+def test_pipeline(tmp_path, registry):
+    LOGGER.debug("RUN test_pipeline")
+    instr = ACC_CURRENCIES.EURUSD
+    generate(str(tmp_path), 3000, [instr], seed=0)
+    handler = DataHandler(2000, folder=str(tmp_path), use_cache=False)
+    algo = AlgorithmExample001(cache=IndicatorCache())
+    algo.prepare(instr, handler.load_data(instr))
+    acc = Account('beginner', 10000, rates=FixedRates(1.15))
+    acc.price_tables[instr] = {'buy': 1.1302, 'sell': 1.13}
+    acc.close_position(acc.make_order(MODE.BUY, instr, 1000))
+    stages = registry.snapshot()['stages']
+    assert set(stages) == {'parse', 'normalize', 'resample', 'indicator',
+                           'dropna', 'order', 'close'}
+    # only the range is parsed
+    assert stages['parse']['rows_out'] == 2000
+    assert stages['normalize']['rows_in'] == 2000
+    assert stages['normalize']['rows_out'] == 2000
+    assert stages['resample']['rows_in'] == 2000
+    bars = stages['resample']['rows_out']
+    assert 2000 // 60 <= bars <= 2000 // 60 + 2
+    assert stages['indicator']['rows_in'] == bars
+    # first 14 bars have no sma
+    assert stages['dropna']['rows_out'] == bars - 14
+    assert stages['normalize']['memory'] > 0
+    path = str(tmp_path / 'metrics.json')
+    registry.export(path)
+    with open(path) as f:
+        assert json.load(f)['stages']['order']['calls'] == 1
+    LOGGER.debug("PASSED test_pipeline")
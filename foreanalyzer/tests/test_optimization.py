@@ -0,0 +1,108 @@
+"""
+tests.test_optimization
+~~~~~~~~~~~~~~~~~~~~~~~
+
+Test the optimization module.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from foreanalyzer._internal_utils import ACC_CURRENCIES, ACC_TIMEFRAMES
+from foreanalyzer.algorithm import AlgorithmExample001
+from foreanalyzer.data_handler import DataHandler
+from foreanalyzer.engine import EngineBridge
+from foreanalyzer.optimization import SharedFrames, SweepRunner, WalkForward
+from foreanalyzer.synthetic import write_zip
+
+# logger
+import logging
+LOGGER = logging.getLogger("foreanalyzer.tests.test_optimization")
+LOGGER.info("TESTING test_optimization.py module")
+
+INSTRUMENTS = [ACC_CURRENCIES.EURUSD, ACC_CURRENCIES.GBPUSD]
+
+
+def test_SharedFrames():
+    LOGGER.debug("RUN test_SharedFrames")
+    frame = pd.DataFrame({
+        'timestamp': pd.date_range('2018-01-01', periods=100, freq='min'),
+        'close': np.random.RandomState(0).normal(1.1, 1e-3, 100)})
+    with SharedFrames({'EURUSD': frame}) as shared:
+        blocks, frames = SharedFrames.attach(shared.spec)
+        pd.testing.assert_frame_equal(frames['EURUSD'], frame)
+        assert not frames['EURUSD']['close'].values.flags.writeable
+        del frames
+        for block in blocks:
+            block.close()
+    LOGGER.debug("PASSED test_SharedFrames")
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_SweepRunner(tmp_path, workers):
+    LOGGER.debug("RUN test_SweepRunner")
+    for seed, instr in enumerate(INSTRUMENTS):
+        write_zip(str(tmp_path), instr, 5000, '2018-01-01', seed)
+    grid = {'period': [5, 10],
+            'timeframe': [ACC_TIMEFRAMES.TEN_MINUTES, ACC_TIMEFRAMES.ONE_HOUR],
+            'instrument': INSTRUMENTS}
+    runner = SweepRunner(AlgorithmExample001, grid, 5000, 'beginner', 1000,
+                         workers=workers,
+                         handler=DataHandler(5000, folder=str(tmp_path)))
+    table = runner.run()
+    assert len(table) == 8
+    assert (np.diff(table['profit'].values) <= 0).all()
+    # any run is the same of a single backtest
+    row = table.iloc[-1]
+    engine = EngineBridge(5000, 'beginner', 1000)
+    engine.handler = DataHandler(5000, folder=str(tmp_path))
+    algo = AlgorithmExample001(ACC_TIMEFRAMES(row['timeframe']),
+                               [ACC_CURRENCIES[row['instrument']]],
+                               int(row['period']))
+    algo.DH = engine.handler
+    algo.data = algo.DH.data
+    result = engine.backtest(algo)[row['instrument']]
+    assert row['final_equity'] == pytest.approx(result.final_equity)
+    assert row['trades'] == result.trades
+    LOGGER.debug("PASSED test_SweepRunner")
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_WalkForward(tmp_path, workers):
+    LOGGER.debug("RUN test_WalkForward")
+    for seed, instr in enumerate(INSTRUMENTS):
+        write_zip(str(tmp_path), instr, 5000, '2018-01-01', seed)
+    grid = {'period': [5, 10, 20], 'instrument': INSTRUMENTS}
+    walk = WalkForward(AlgorithmExample001, grid, 5000, '1D', '12h',
+                       'beginner', 1000, workers=workers,
+                       handler=DataHandler(5000, folder=str(tmp_path)))
+    folds = walk.folds(walk.load())
+    # 5000 minutes hold four whole folds
+    assert len(folds) == 4
+    table = walk.run()
+    assert list(table['fold']) == [0, 0, 1, 1, 2, 2, 3, 3]
+    runs = walk.runs
+    assert len(runs) == 3 * 2 * 4 * 2
+    for _, row in table.iterrows():
+        in_sample = runs[(runs['sample'] == 'in') &
+                         (runs['fold'] == row['fold']) &
+                         (runs['instrument'] == row['instrument'])]
+        assert row['in_profit'] == in_sample['profit'].max()
+    # out of sample run of a fold is the backtest of its bars only
+    row = table.iloc[-1]
+    instr = ACC_CURRENCIES[row['instrument']]
+    engine = EngineBridge(5000, 'beginner', 1000)
+    engine.handler = DataHandler(5000, folder=str(tmp_path))
+    algo = AlgorithmExample001(acc_instrums=[instr], period=int(row['period']))
+    algo.DH = engine.handler
+    algo.data = algo.DH.data
+    bars = algo.prepare(instr)
+    bars = bars[(bars['timestamp'] >= folds[-1][1]) &
+                (bars['timestamp'] < folds[-1][2])]
+    result = engine.backtest_bars(
+        instr, bars, algo.signals(instr, bars),
+        engine.handler.conversion_rates(instr, bars['timestamp'].values))
+    assert row['final_equity'] == pytest.approx(result.final_equity)
+    assert row['trades'] == result.trades
+    LOGGER.debug("PASSED test_WalkForward")
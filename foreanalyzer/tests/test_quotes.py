@@ -0,0 +1,132 @@
+"""
+tests.test_quotes
+~~~~~~~~~~~~~~~~~
+
+Test the quotes module against a local stub of the broker.
+"""
+
+import json
+import threading
+import time
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pytest
+
+from foreanalyzer._internal_utils import ACC_CURRENCIES
+from foreanalyzer.account import Account
+from foreanalyzer.exceptions import PriceNotUpdated
+from foreanalyzer.quotes import BrokerQuotes, QuoteClient
+
+# logger
+import logging
+LOGGER = logging.getLogger("foreanalyzer.tests.test_quotes")
+LOGGER.info("TESTING test_quotes.py module")
+
+
+class StubBroker(BaseHTTPRequestHandler):
+    """answers quotes of the asked instruments, counts requests and
+    connections"""
+
+    protocol_version = 'HTTP/1.1'
+    latency = 0.002
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests += 1
+        query = parse_qs(urlparse(self.path).query)
+        instruments = query['instruments'][0].split(',')
+        time.sleep(self.latency)
+        body = json.dumps({
+            'time': 1541678400000,
+            'quotes': {x: {'buy': 1.1302, 'sell': 1.13}
+                       for x in instruments if x != 'USDJPY'}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="function")
+def broker():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubBroker)
+    server.requests = 0
+    server.connections = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_update_prices(broker):
+    LOGGER.debug("RUN test_update_prices")
+    url = 'http://127.0.0.1:{}/quotes'.format(broker.server_address[1])
+    client = QuoteClient(url)
+    acc = Account('beginner', 1000, quotes=client)
+    instruments = [x for x in ACC_CURRENCIES if x.value != 'USDJPY']
+    for _ in range(5):
+        prices = acc.update_prices(instruments)
+    assert set(prices) == set(instruments)
+    assert acc.price_tables[ACC_CURRENCIES.EURUSD] == \
+        {'buy': 1.1302, 'sell': 1.13}
+    assert acc.prices_time == np.datetime64('2018-11-08T12:00')
+    # one request for each snapshot, all on the same connection
+    assert broker.requests == 5
+    assert broker.connections == 1
+    stats = client.stats()
+    assert stats['requests'] == 5
+    assert stats['mean_latency'] >= StubBroker.latency
+    LOGGER.debug("RESULT latency - {}".format(stats))
+    # a missing quote leaves price_tables untouched
+    with pytest.raises(PriceNotUpdated):
+        acc.update_prices()
+    assert ACC_CURRENCIES.USDJPY not in acc.price_tables
+    client.close()
+    LOGGER.debug("PASSED test_update_prices")
+
+
+class SlowClient(object):
+    """answers update_price as the broker client, one slow call each"""
+
+    latency = 0.05
+
+    def __init__(self):
+        self.calls = 0
+
+    def update_price(self, name):
+        self.calls += 1
+        time.sleep(self.latency)
+        if name == 'USDJPY':
+            raise RuntimeError("no quote")
+        return SimpleNamespace(price={'buy': 1.1302, 'sell': 1.13})
+
+
+def test_BrokerQuotes():
+    LOGGER.debug("RUN test_BrokerQuotes")
+    api = SlowClient()
+    quotes = BrokerQuotes(api)
+    acc = Account('beginner', 1000, quotes=quotes)
+    instruments = [x for x in ACC_CURRENCIES if x.value != 'USDJPY']
+    start = time.perf_counter()
+    prices = acc.update_prices(instruments)
+    elapsed = time.perf_counter() - start
+    assert set(prices) == set(instruments)
+    assert api.calls == len(instruments)
+    # requests run together, not one after the other
+    assert elapsed < len(instruments) * SlowClient.latency / 2
+    assert isinstance(acc.prices_time, np.datetime64)
+    with pytest.raises(PriceNotUpdated):
+        acc.update_prices()
+    assert ACC_CURRENCIES.USDJPY not in acc.price_tables
+    quotes.close()
+    LOGGER.debug("PASSED test_BrokerQuotes")
@@ -0,0 +1,98 @@
+"""
+tests.test_rates
+~~~~~~~~~~~~~~~~
+
+Test the rates module.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from foreanalyzer._internal_utils import ACC_CURRENCIES, MODE
+from foreanalyzer.account import Account
+from foreanalyzer.data_handler import DataHandler
+from foreanalyzer.rates import CachedRates, HistoricalRates, RateProvider
+
+# logger
+import logging
+LOGGER = logging.getLogger("foreanalyzer.tests.test_rates")
+LOGGER.info("TESTING test_rates.py module")
+
+EURUSD = ACC_CURRENCIES.EURUSD
+GBPUSD = ACC_CURRENCIES.GBPUSD
+EURGBP = ACC_CURRENCIES.EURGBP
+
+
+class Counter(RateProvider):
+    """constant rate, counts requests"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def rate(self, instrument, timestamp=None):
+        self.calls += 1
+        return 1.25
+
+
+def make_handler():
+    """handler with minute bars of EURUSD, GBPUSD and EURGBP"""
+    handler = DataHandler(100)
+    stamps = pd.date_range('2018-01-01', periods=100, freq='min')
+    for instr, price in ((EURUSD, 1.2), (GBPUSD, 1.4), (EURGBP, 0.88)):
+        close = price + np.arange(100) * 1e-4
+        handler.data[instr.value] = pd.DataFrame({
+            'timestamp': stamps, 'open': close, 'high': close, 'low': close,
+            'close': close})
+    return handler
+
+
+def test_CachedRates():
+    LOGGER.debug("RUN test_CachedRates")
+    now = [0.]
+    provider = Counter()
+    rates = CachedRates(provider, ttl=10, max_entries=2, clock=lambda: now[0])
+    assert rates.rate(EURUSD) == 1.25
+    assert rates.rate(EURUSD) == 1.25
+    assert provider.calls == 1
+    now[0] = 11.
+    rates.rate(EURUSD)
+    assert provider.calls == 2
+    # full cache drops the oldest entry
+    rates.rate(GBPUSD)
+    rates.rate(EURGBP)
+    assert len(rates.entries) == 2
+    assert (EURUSD, None) not in rates.entries
+    assert rates.hits == 1 and rates.misses == 4
+    LOGGER.debug("PASSED test_CachedRates")
+
+
+def test_HistoricalRates():
+    LOGGER.debug("RUN test_HistoricalRates")
+    handler = make_handler()
+    rates = HistoricalRates(handler)
+    stamp = handler.data['EURUSD']['timestamp'].values[10]
+    # rate of EUR in USD is the bar of EURUSD
+    assert rates.rate(EURUSD, stamp) == pytest.approx(1.201)
+    # GBPUSD has USD quote too
+    assert rates.rate(GBPUSD, stamp) == pytest.approx(1.201)
+    # EURGBP of its own bar, latest without timestamp
+    assert rates.rate(EURGBP, stamp) == pytest.approx(0.881)
+    assert rates.rate(EURGBP) == pytest.approx(0.88 + 99e-4)
+    np.testing.assert_allclose(
+        rates.rates(EURUSD, handler.data['EURUSD']['timestamp'].values),
+        handler.data['EURUSD']['close'].values)
+    LOGGER.debug("PASSED test_HistoricalRates")
+
+
+def test_make_order_offline():
+    LOGGER.debug("RUN test_make_order_offline")
+    handler = make_handler()
+    acc = Account('beginner', 1000, rates=HistoricalRates(handler))
+    acc.timestamp = handler.data['GBPUSD']['timestamp'].values[50]
+    acc.price_tables[GBPUSD] = {'buy': 1.4052, 'sell': 1.4048}
+    pos = acc.make_order(MODE.BUY, GBPUSD, 2500)
+    assert pos.conv_rate == pytest.approx(1.205)
+    assert pos.used_funds == pytest.approx(
+        pos.margin * 2500 / 1.205 * 1.4052)
+    LOGGER.debug("PASSED test_make_order_offline")
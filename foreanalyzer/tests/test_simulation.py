@@ -5,9 +5,12 @@ tests.test_simulation
 Test the simulation module.
 """
 
+import numpy as np
 import pytest
-from foreanalyzer.simulation import AccountSimulated
+from foreanalyzer.rates import FixedRates
+from foreanalyzer.simulation import AccountSimulated, nights
 from foreanalyzer._internal_utils import ACC_CURRENCIES, MODE
+from foreanalyzer.tables import CURRENCIES
 
 # logger
 import logging
@@ -47,3 +50,152 @@ def test_simulate(get_account):
     pos.close()
     assert acc.funds != old_funds
     LOGGER.debug("PASSED test_simulate")
+
+
+def test_nights():
+    LOGGER.debug("RUN test_nights")
+    stamps = np.array(['2018-01-01T20:59', '2018-01-01T21:00',
+                       '2018-01-01T23:00', '2018-01-04T22:00'],
+                      dtype='datetime64[ns]')
+    assert list(nights(stamps)) == [0, 1, 0, 3]
+    LOGGER.debug("PASSED test_nights")
+
+
+def test_swap():
+    """test swap paid at rollover by open positions"""
+    LOGGER.debug("RUN test_swap")
+    acc = AccountSimulated('beginner', 100000, FixedRates(1.25))
+    EURUSD, USDJPY = ACC_CURRENCIES.EURUSD, ACC_CURRENCIES.USDJPY
+    acc.simulate(EURUSD, 1.1302, 1.1300, np.datetime64('2018-01-01T20:00'))
+    acc.simulate(USDJPY, 113.05, 113.02, np.datetime64('2018-01-01T20:00'))
+    acc.make_order(MODE.BUY, EURUSD, 5000)
+    acc.make_order(MODE.SELL, USDJPY, 2500)
+    acc.simulate(EURUSD, 1.1302, 1.1300, np.datetime64('2018-01-01T20:59'))
+    assert acc.funds == 100000
+    # two rollovers passed
+    acc.simulate(EURUSD, 1.1302, 1.1300, np.datetime64('2018-01-03T09:00'))
+    swap = 2 * (5000 * CURRENCIES['EURUSD'].long_swap +
+                2500 * CURRENCIES['USDJPY'].short_swap) / 1.25
+    assert acc.funds == pytest.approx(100000 + swap)
+    assert acc.swap_paid == pytest.approx(-swap)
+    LOGGER.debug("PASSED test_swap")
+
+
+def make_feeds(rows=3000):
+    """minute prices of EURUSD and of GBPUSD from 30 seconds later"""
+    rand = np.random.RandomState(0)
+    start = np.datetime64('2018-01-01T18:00', 'ns')
+    feeds = {}
+    for shift, instr in enumerate([ACC_CURRENCIES.EURUSD,
+                                   ACC_CURRENCIES.GBPUSD]):
+        stamps = start + np.arange(rows) * np.timedelta64(60, 's') + \
+            shift * np.timedelta64(30, 's')
+        mid = 1.1 + np.cumsum(rand.normal(0, 1e-4, rows))
+        feeds[instr] = (stamps, mid + 1e-4, mid - 1e-4)
+    return feeds
+
+
+def trader(acc, instr, index):
+    """buy EURUSD at 100, sell GBPUSD at 700, close all at 2500"""
+    if instr == ACC_CURRENCIES.EURUSD and index == 100:
+        acc.make_order(MODE.BUY, instr, 5000)
+    if instr == ACC_CURRENCIES.GBPUSD and index == 700:
+        acc.make_order(MODE.SELL, instr, 2500)
+    if instr == ACC_CURRENCIES.EURUSD and index == 2500:
+        for pos in list(acc.positions):
+            pos.close()
+
+
+def test_replay():
+    LOGGER.debug("RUN test_replay")
+    feeds = make_feeds()
+    # one call for each step against the same loop done by hand
+    acc = AccountSimulated('beginner', 1000, FixedRates(1.25))
+    frame = acc.replay(feeds, trader)
+    expected = AccountSimulated('beginner', 1000, FixedRates(1.25))
+    steps = sorted((stamp, i, instr) for instr, (stamps, _, _)
+                   in feeds.items() for i, stamp in enumerate(stamps))
+    equity = []
+    for stamp, i, instr in steps:
+        expected.simulate(instr, feeds[instr][1][i], feeds[instr][2][i],
+                          stamp)
+        trader(expected, instr, i)
+        equity.append(expected.funds + expected.unrealized)
+    assert len(frame) == 6000
+    np.testing.assert_allclose(frame['equity'], equity, rtol=1e-12)
+    assert acc.funds == pytest.approx(expected.funds)
+    assert acc.swap_paid == pytest.approx(expected.swap_paid)
+    assert acc.swap_paid != 0
+    # chunks between the steps of orders give the same
+    chunked = AccountSimulated('beginner', 1000, FixedRates(1.25))
+    events = [feeds[ACC_CURRENCIES.EURUSD][0][100],
+              feeds[ACC_CURRENCIES.GBPUSD][0][700],
+              feeds[ACC_CURRENCIES.EURUSD][0][2500]]
+    result = chunked.replay(feeds, trader, events)
+    np.testing.assert_allclose(result['equity'], equity, rtol=1e-12)
+    assert chunked.price_tables == acc.price_tables
+    assert len(chunked.ledger) == 2
+    LOGGER.debug("PASSED test_replay")
+
+
+def test_replay_back_in_time():
+    LOGGER.debug("RUN test_replay_back_in_time")
+    feeds = make_feeds()
+    earlier = {x: (y[0] - np.timedelta64(7, 'D'), y[1], y[2])
+               for x, y in feeds.items()}
+    acc = AccountSimulated('beginner', 1000, FixedRates(1.25))
+    acc.replay(feeds)
+    acc.make_order(MODE.BUY, ACC_CURRENCIES.EURUSD, 5000)
+    funds, swap_paid = acc.funds, acc.swap_paid
+    # no night is paid back on the first step of an earlier feed
+    for events in (None, [earlier[ACC_CURRENCIES.EURUSD][0][0]]):
+        acc.replay({x: [y[:100] for y in earlier[x]] for x in earlier},
+                   lambda *args: None, events)
+        assert acc.funds == funds and acc.swap_paid == swap_paid
+    LOGGER.debug("PASSED test_replay_back_in_time")
+
+
+def test_replay_exhausted():
+    LOGGER.debug("RUN test_replay_exhausted")
+    feeds = make_feeds()
+    acc = AccountSimulated('beginner', 1000, FixedRates(1.25))
+    acc.replay({ACC_CURRENCIES.EURUSD: [x[:10] for x in
+                                        feeds[ACC_CURRENCIES.EURUSD]]})
+    acc.make_order(MODE.BUY, ACC_CURRENCIES.EURUSD, 5000)
+    # price falls to zero, the position is over the funds
+    stamps = feeds[ACC_CURRENCIES.EURUSD][0][10:20]
+    prices = np.linspace(1.1, 0.001, 10)
+
+    def closer(acc, instr, index):
+        if index == 9:
+            acc.positions[0].close()
+    frame = acc.replay({ACC_CURRENCIES.EURUSD: (stamps, prices, prices)},
+                       closer)
+    assert len(frame) == 10
+    assert frame['equity'].iloc[-1] == 0 and acc.funds == 0
+    assert (frame['equity'].iloc[:-1] < 1000).all()
+    LOGGER.debug("PASSED test_replay_exhausted")
+
+
+def test_replay_exhausted_by_swap():
+    LOGGER.debug("RUN test_replay_exhausted_by_swap")
+    feeds = make_feeds()
+    accounts = []
+    # a step at a time and in one chunk
+    for events in (None, []):
+        acc = AccountSimulated('beginner', 1000, FixedRates(1.25))
+        acc.replay({x: [y[:1] for y in feeds[x]] for x in feeds})
+        acc.make_order(MODE.BUY, ACC_CURRENCIES.EURUSD, 5000)
+        # enough for the swap of the first night only
+        acc.funds = 0.5
+        frame = acc.replay({x: [y[1:] for y in feeds[x]] for x in feeds},
+                           lambda *args: None, events)
+        accounts.append((acc, frame))
+    (steps, frame), (chunks, result) = accounts
+    assert steps.funds == chunks.funds == 0
+    assert steps.swap_paid == pytest.approx(chunks.swap_paid)
+    assert steps.swap_paid > 0.5
+    assert steps.price_tables == chunks.price_tables
+    assert steps.timestamp == chunks.timestamp
+    assert len(frame) == len(result) < 2 * 2999
+    LOGGER.debug("PASSED test_replay_exhausted_by_swap")
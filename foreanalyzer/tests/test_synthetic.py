@@ -0,0 +1,67 @@
+"""
+tests.test_synthetic
+~~~~~~~~~~~~~~~~~~~~
+
+Test the synthetic module.
+"""
+
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from foreanalyzer._internal_utils import ACC_CURRENCIES
+from foreanalyzer.data_handler import DataHandler
+from foreanalyzer.synthetic import generate, make_bars, open_minutes, to_csv
+
+# logger
+import logging
+LOGGER = logging.getLogger("foreanalyzer.tests.test_synthetic")
+LOGGER.info("TESTING test_synthetic.py module")
+
+
+def test_to_csv():
+    LOGGER.debug("RUN test_to_csv")
+    first = np.datetime64('2001-01-02T23:58', 'm').astype(np.int64)
+    for instr, decimals in ((ACC_CURRENCIES.EURUSD, 5),
+                            (ACC_CURRENCIES.USDJPY, 3)):
+        df = make_bars(instr, open_minutes(first, 1000), 1.15,
+                       np.random.RandomState(0))
+        expected = df.to_csv(header=False, index=False, lineterminator='\n',
+                             float_format='%.{}f'.format(decimals))
+        assert to_csv(df, decimals) == expected.encode()
+    LOGGER.debug("PASSED test_to_csv")
+
+
+def test_generate(tmp_path):
+    LOGGER.debug("RUN test_generate")
+    instrs = [ACC_CURRENCIES.EURUSD, ACC_CURRENCIES.USDJPY]
+    # a friday evening start crosses the weekend in the first chunk
+    paths = generate(str(tmp_path), 5000, instrs, start='2001-01-05T21:00',
+                     seed=1, chunksize=1500)
+    assert len(paths) == 2
+    with zipfile.ZipFile(paths[0]) as zip_file:
+        assert zip_file.namelist() == ['EURUSD.txt']
+        raw = pd.read_csv(zip_file.open('EURUSD.txt'))
+    assert list(raw.columns) == ['<TICKER>', '<DTYYYYMMDD>', '<TIME>',
+                                 '<OPEN>', '<HIGH>', '<LOW>', '<CLOSE>',
+                                 '<VOL>']
+    handle = DataHandler(0, folder=str(tmp_path), use_cache=False)
+    for instr in instrs:
+        df = handle.load_data(instr)
+        assert len(df) == 5000
+        stamps = df['timestamp']
+        assert (stamps.diff().iloc[1:] > pd.Timedelta(0)).all()
+        # nothing from friday 22:00 to sunday 22:00
+        assert not (stamps.dt.dayofweek == 5).any()
+        assert (stamps.iloc[60:] >= pd.Timestamp('2001-01-07 22:00')).all()
+        # bars open at the previous close, also across chunks
+        assert (df['open'].values[1:] == df['close'].values[:-1]).all()
+        assert (df['high'] >= df[['open', 'close']].max(axis=1)).all()
+        assert (df['low'] <= df[['open', 'close']].min(axis=1)).all()
+    # same seed, same bars
+    again = generate(str(tmp_path / 'again'), 5000, instrs,
+                     start='2001-01-05T21:00', seed=1, chunksize=1500)
+    with zipfile.ZipFile(paths[1]) as f, zipfile.ZipFile(again[1]) as g:
+        assert f.read('USDJPY.txt') == g.read('USDJPY.txt')
+    LOGGER.debug("PASSED test_generate")
@@ -24,7 +24,8 @@ VERSION = None
 REQUIRED = [
     "forex_python",
     "trading212api",
-    "pandas"
+    "pandas",
+    "requests"
 ]
 
 # What packages are optional?